@@ -42,7 +42,7 @@ AD9959::AD9959(int CS, int IOUpdate, int reset, int p0, int p1, int p2, int p3)
 	_reset = reset;
 	_p[0] = p0;
 	_p[1] = p1;
-	_p[2] = p3;
+	_p[2] = p2;
 	_p[3] = p3;
 
 	RESOLUTION_F = 4294967296.0;
@@ -52,6 +52,8 @@ AD9959::AD9959(int CS, int IOUpdate, int reset, int p0, int p1, int p2, int p3)
 	_statusCFR[0] = 0x00;
 	_statusCFR[1] = 0x03;
 	_statusCFR[2] = 0x02;
+	_spiLength = 0;
+	forgetShadows();
  
 
 //Define pinModes
@@ -94,7 +96,7 @@ void AD9959::initialize(unsigned long sysClk)
   buffer[0] = _statusCFR[0];
   buffer[1] = _statusCFR[1];
   buffer[2] = _statusCFR[2];
-  writeReg(CFR, buffer, 3);
+  writeCFR(buffer);
   setAmp(512);
   IOUpdate();
 }
@@ -113,13 +115,20 @@ void AD9959::setPLL_VCO(byte ratio, bool enable)
 
 void AD9959::reset()
 {
+	// anything not yet sent would be lost in the reset anyway
+	_spiLength = 0;
 	digitalWrite(_reset, HIGH);
 	delay(10);
 	digitalWrite(_reset, LOW);
+	forgetShadows();
+	// after a reset all channels are enabled and the serial port is in 2-wire mode
+	_statusCSR = 0xF0;
+	_csrKnown = true;
 }
 
 void AD9959::IOUpdate()
 {
+	flush();
 	digitalWrite(_IOUpdate, HIGH);
 	digitalWrite(_IOUpdate, LOW);
 }
@@ -135,18 +144,62 @@ void AD9959::IOUpdate()
 void AD9959::selectChannel(byte ch)
 {
 	//To remain the last three bits of CSR status
- 	_statusCSR = ch | (0x07 & _statusCSR);
+	byte status = ch | (0x07 & _statusCSR);
+	if (_csrKnown && status == _statusCSR)
+		return;
+	_statusCSR = status;
+	_csrKnown = true;
 	writeReg(CSR, _statusCSR);
 }
 
 void AD9959::setFreq(unsigned long freq)
 {
 	//setFrequency
-	_freq = freq;
-	unsigned long FTW = (unsigned long) freq * RESOLUTION_F / _sysClk;
+	setFTW(freqToFTW(freq));
+}
+
+unsigned long AD9959::freqToFTW(unsigned long freq)
+{
+	return (unsigned long) freq * RESOLUTION_F / _sysClk;
+}
+
+/*
+	Write a frequency tuning word directly: f_out = FTW * sysClk / 2^32.
+	The host computes the words, so there is no floating point here.
+*/
+void AD9959::setFTW(unsigned long FTW)
+{
 	byte buffer[4] = {(byte)(FTW >> 24), (byte)(FTW >> 16), (byte)(FTW >> 8), (byte)FTW};
-	writeReg(CFTW0, buffer, 4);
-	//IOUpdate();
+	writeFTW(buffer);
+}
+
+/*
+	Write the 4 bytes of a tuning word, most significant first, as prepared by the caller.
+	Nothing is sent if every selected channel already holds this word.
+*/
+void AD9959::writeFTW(const byte *FTW)
+{
+	_ftw = ((unsigned long)FTW[0] << 24) | ((unsigned long)FTW[1] << 16) | ((unsigned long)FTW[2] << 8) | FTW[3];
+	bool changed = false;
+	for (int ch = 0; ch < 4; ch++) {
+		if ((_statusCSR & (0x10 << ch)) && !(_ftwKnown[ch] && _ftwShadow[ch] == _ftw)) {
+			changed = true;
+			_ftwKnown[ch] = true;
+			_ftwShadow[ch] = _ftw;
+		}
+	}
+	if (changed)
+		writeReg(CFTW0, (byte *)FTW, 4);
+}
+
+/*
+	Write the 14 bit phase offset word directly: phase = POW * 360 / 2^14 degrees
+*/
+void AD9959::setPOW(unsigned int POW)
+{
+	_phase = POW * 360.0 / RESOLUTION_P;
+	byte buffer[2] = {(byte)((POW >> 8) & 0x3F), (byte)POW};
+	writeReg(CPOW0, buffer, 2);
 }
 
 void AD9959::setPhase(double phase)
@@ -176,7 +229,7 @@ void AD9959::setAmp(unsigned long amp)
 
 unsigned long AD9959::getFreq()
 {
-	return _freq;
+	return (unsigned long) (_ftw / RESOLUTION_F * _sysClk);
 }
 
 double AD9959::getPhase()
@@ -204,8 +257,8 @@ void AD9959::linearSweepF(unsigned long* inputLW)
 	byte bufferFDW[4] = {(byte)(fDW >> 24), (byte)(fDW >> 16), (byte)(fDW >> 8), (byte)(fDW)};
 	byte bufferLSRR[2] = {inputLW[5], inputLW[3]};
   
-	writeReg(CFR, bufferCFR, 3);
-	writeReg(CFTW0, buffersFTW, 4);
+	writeCFR(bufferCFR);
+	writeFTW(buffersFTW);
 	writeReg(CW1, buffereFTW, 4);
 	writeReg(RDW, bufferRDW, 4);
 	writeReg(FDW, bufferFDW, 4);
@@ -246,7 +299,7 @@ void AD9959::linearSweepP(unsigned long* inputLW)
 	byte bufferFDW[4] = {(byte)(fDW >> 6), (byte)(fDW << 2), 0x00, 0x00};
 	byte bufferLSRR[2] = {inputLW[5], inputLW[3]};
   
-	writeReg(CFR, bufferCFR, 3);
+	writeCFR(bufferCFR);
 	writeReg(CPOW0, buffersPOW, 2);
 	writeReg(CW1, bufferePOW, 4);
 	writeReg(RDW, bufferRDW, 4);
@@ -279,7 +332,7 @@ void AD9959::linearSweepP(double* inputLW)
 	byte bufferFDW[4] = {(byte)(fDW >> 6), (byte)(fDW << 2), 0x00, 0x00};
 	byte bufferLSRR[2] = {inputLW[5], inputLW[3]};
 
-	writeReg(CFR, bufferCFR, 3);
+	writeCFR(bufferCFR);
 	writeReg(CPOW0, buffersPOW, 2);
 	writeReg(CW1, bufferePOW, 4);
 	writeReg(RDW, bufferRDW, 4);
@@ -306,7 +359,7 @@ void AD9959::linearSweepA(unsigned long* inputLW)
 	byte bufferFDW[4] = {(byte)(inputLW[4] >> 2), (byte)(inputLW[4] << 8), 0x00, 0x00};
 	byte bufferLSRR[2] = {inputLW[5], inputLW[3]};
 
-	writeReg(CFR, bufferCFR, 3);
+	writeCFR(bufferCFR);
 	writeReg(ACR, buffersACR, 3);
 	writeReg(CW1, buffereACR, 4);
 	writeReg(RDW, bufferRDW, 4);
@@ -319,13 +372,37 @@ void AD9959::linearSweepA(unsigned long* inputLW)
 //	stopSweep(inputLW[7]);
 }
 
+/*
+	Load a linear frequency sweep into the selected channels without starting it.
+	low and high are the tuning words at the ends of the sweep (CFTW0 and CW1), rdw and fdw the rising and
+	falling delta words, all 4 bytes MSB first. rsrr and fsrr are the sync clock cycles between sweep steps.
+	The sweep runs up to high while the channel's profile pin is high and down to low while it is low
+	(see startSweep and stopSweep), once an IOUpdate has applied the registers.
+*/
+void AD9959::loadSweep(const byte *low, const byte *high, const byte *rdw, const byte *fdw, byte rsrr, byte fsrr)
+{
+	byte bufferCFR[3] = {0x80, (byte)(_statusCFR[1] | 0x40), _statusCFR[2]};
+	byte bufferLSRR[2] = {fsrr, rsrr};
+	writeCFR(bufferCFR);
+	writeFTW(low);
+	writeReg(CW1, (byte *)high, 4);
+	writeReg(RDW, (byte *)rdw, 4);
+	writeReg(FDW, (byte *)fdw, 4);
+	writeReg(LSRR, bufferLSRR, 2);
+}
+
 void AD9959::startSweep(byte ch)
 {
+	flush();
+	// the pin may have been handed over to an external source by releaseProfilePin
+	pinMode(_p[ch], OUTPUT);
 	digitalWrite(_p[ch], HIGH);
 }
 
 void AD9959::stopSweep(byte ch)
 {
+	flush();
+	pinMode(_p[ch], OUTPUT);
 	digitalWrite(_p[ch], LOW);
 }
 
@@ -338,16 +415,45 @@ void AD9959::resetCFR()
   buffer[0] = _statusCFR[0];
   buffer[1] = _statusCFR[1];
   buffer[2] = _statusCFR[2];
-  writeReg(CFR, buffer, 3);
+  writeCFR(buffer);
   IOUpdate();
 }
 
+/*
+	Two-level frequency modulation of the selected channels: the output is CFTW0 while the channel's
+	profile pin is low and CW1 while it is high, switched by the DDS itself with no SPI traffic.
+	FR1 is left in its two-level mode with P0-P3 controlling CH0-CH3 (see setPLL_VCO).
+	With enable false the channels go back to a single frequency.
+*/
+void AD9959::setFrequencyModulation(bool enable)
+{
+	byte buffer[3] = {(byte)(enable ? 0x80 : _statusCFR[0]), _statusCFR[1], _statusCFR[2]};
+	writeCFR(buffer);
+}
+
+/*
+	Write the second frequency tuning word used in frequency modulation, most significant byte first
+*/
+void AD9959::writeCW1(const byte *FTW)
+{
+	writeReg(CW1, (byte *)FTW, 4);
+}
+
+/*
+	Stop driving a profile pin, so that it can be driven by another device (e.g. a labscript digital output)
+*/
+void AD9959::releaseProfilePin(byte ch)
+{
+	digitalWrite(_p[ch], LOW);
+	pinMode(_p[ch], INPUT);
+}
+
 // These functions aren't used, but could be used.
 void AD9959::powerDown(byte ch)
 {
 	selectChannel(ch);
 	byte buffer[3] = {0x00, 0x03, 0xC0};
-	writeReg(CFR, buffer, 3);
+	writeCFR(buffer);
 	IOUpdate();
 }
 
@@ -355,27 +461,71 @@ void AD9959::setSine(byte ch)
 {
 	selectChannel(ch);
 	byte buffer[3] = {0x00, 0x03, 0x01};
-	writeReg(CFR, buffer, 3);
+	writeCFR(buffer);
 	IOUpdate();
 }
 
+/*
+	Send the register writes collected so far in a single SPI transaction.
+	IOUpdate() calls this, so it is only needed when the writes must reach the chip without an update.
+*/
+void AD9959::flush()
+{
+	if (_spiLength == 0)
+		return;
+	SPI.beginTransaction(SPISettings(AD9959_SPI_CLOCK, MSBFIRST, SPI_MODE0));
+	digitalWrite(_CS, LOW);
+	SPI.transfer(_spiBuffer, _spiLength);
+	digitalWrite(_CS, HIGH);
+	SPI.endTransaction();
+	_spiLength = 0;
+}
+
 //Private function
+/*
+	Queue a register write. The AD9959 takes the next byte after the data of a register as a new
+	instruction byte, so consecutive writes can share one transaction (see flush).
+*/
 void AD9959::writeReg(byte infoReg, byte dataReg)
 {
-	SPI.beginTransaction(SPISettings(80000000, MSBFIRST, SPI_MODE0));
-	SPI.transfer(infoReg);
-	SPI.transfer(dataReg);
-	SPI.endTransaction();
+	writeReg(infoReg, &dataReg, 1);
 }
 
 void AD9959::writeReg(byte infoReg, byte *dataReg, byte len)
 {
-  
-	SPI.beginTransaction(SPISettings(80000000, MSBFIRST, SPI_MODE0));
-  digitalWrite(_CS, LOW);
-	SPI.transfer(infoReg);
-	int i = 0;
-	for(i = 0; i < len; ++i)
-		SPI.transfer(dataReg[i]);
-	SPI.endTransaction();
+	if (_spiLength + 1 + len > SPI_BUFFER)
+		flush();
+	_spiBuffer[_spiLength++] = infoReg;
+	for (byte i = 0; i < len; ++i)
+		_spiBuffer[_spiLength++] = dataReg[i];
+}
+
+/*
+	Write the channel function register of the selected channels, unless they all hold this value already
+*/
+void AD9959::writeCFR(const byte *buffer)
+{
+	bool changed = false;
+	for (int ch = 0; ch < 4; ch++) {
+		if (!(_statusCSR & (0x10 << ch)))
+			continue;
+		if (!_cfrKnown[ch] || _cfrShadow[ch][0] != buffer[0] || _cfrShadow[ch][1] != buffer[1] || _cfrShadow[ch][2] != buffer[2]) {
+			changed = true;
+			_cfrKnown[ch] = true;
+			_cfrShadow[ch][0] = buffer[0];
+			_cfrShadow[ch][1] = buffer[1];
+			_cfrShadow[ch][2] = buffer[2];
+		}
+	}
+	if (changed)
+		writeReg(CFR, (byte *)buffer, 3);
+}
+
+void AD9959::forgetShadows()
+{
+	_csrKnown = false;
+	for (int ch = 0; ch < 4; ch++) {
+		_ftwKnown[ch] = false;
+		_cfrKnown[ch] = false;
+	}
 }
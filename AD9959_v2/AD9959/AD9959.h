@@ -18,6 +18,12 @@
 
 #include "Arduino.h"
 
+// Fastest serial clock the AD9959 accepts (200 MHz). The SPI library uses the fastest rate
+// the board can generate that does not exceed it.
+#define AD9959_SPI_CLOCK 200000000
+// Register writes are collected here and sent in one SPI transaction by flush()
+#define SPI_BUFFER 64
+
 class AD9959
 {
 public:
@@ -27,10 +33,15 @@ public:
 	void initialize(unsigned long);
 	void reset();
 	void IOUpdate();
+	void flush();
 	void powerDown(byte);
 
 //	Setting-Up Functions
 	void setFreq(unsigned long);
+	void setFTW(unsigned long);
+	void writeFTW(const byte *);
+	void setPOW(unsigned int);
+	unsigned long freqToFTW(unsigned long);
 	void setPhase(double);
 	void setAmp(unsigned long);
 	void setSine(byte);
@@ -48,19 +59,37 @@ public:
 //  void linearSweepP(unsigned long, unsigned long, unsigned long, byte, unsigned long, byte);
 //	void linearSweepA(unsigned long, unsigned long, unsigned long, byte, unsigned long, byte);
 	void linearSweepA(unsigned long* inputLW);
+	void loadSweep(const byte *, const byte *, const byte *, const byte *, byte, byte);
 	void startSweep(byte);
 	void stopSweep(byte);	
   void resetCFR();
 
+//	Profile Pin Modulation
+	void setFrequencyModulation(bool);
+	void writeCW1(const byte *);
+	void releaseProfilePin(byte);
+
 private:
 	void writeReg(byte, byte);
 	void writeReg(byte, byte *, byte);
+	void writeCFR(const byte *);
+	void forgetShadows();
 
 	int _CS, _IOUpdate, _reset;
 	int _p[4];
 	byte _statusCSR, _statusFR1;
 	byte _statusCFR[3];
-	unsigned long _sysClk, _freq;
+
+//	Shadow copies of what was last written to each register, so that writes of the same value can be skipped.
+//	The channel registers are kept per channel; a shadow is only trusted once it has been written.
+	bool _csrKnown;
+	bool _ftwKnown[4], _cfrKnown[4];
+	unsigned long _ftwShadow[4];
+	byte _cfrShadow[4][3];
+
+	byte _spiBuffer[SPI_BUFFER];
+	byte _spiLength;
+	unsigned long _sysClk, _ftw;
 	double RESOLUTION_F, RESOLUTION_P, _phase;
 };
 
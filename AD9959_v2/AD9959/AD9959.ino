@@ -5,200 +5,465 @@
 #include <SPI.h>
 #include "AD9959.h"
 #include "Channel.h"
+#include "CommandParser.h"
 
 /*
     Pin 10 is SS pin of Arduino Uno. Select pin 50 and 22 as IOUpdate and reset.
     Pin 7, 6, 5, 4 are for Profile 0 (p0), p1, p2, p3, respectively.
+
+    Further boards (NUM_BOARDS in Channel.h) share the SPI clock and data lines, and each has its own chip select
+    (CSB), IOUpdate, reset and profile pins: only the board whose CSB is low listens to the SPI bus.
 */
-AD9959 DDS(10, 50, 22, 7, 6, 5, 4);
+AD9959 boards[NUM_BOARDS] = {
+  AD9959(10, 50, 22, 7, 6, 5, 4),
+#if NUM_BOARDS > 1
+  AD9959(9, 51, 23, 24, 25, 26, 27),
+#endif
+#if NUM_BOARDS > 2
+  AD9959(8, 52, 28, 29, 36, 37, 38),
+#endif
+#if NUM_BOARDS > 3
+  AD9959(12, 53, 39, 2, 3, 11, 14),
+#endif
+};
 
 //Channels on the DDS, the corresponding channel must be enabled to see an output on that channel
 int CH[4]   = {0x10, 0x20, 0x40, 0x80};
 
 
-// The length of the number of the command sent to the arduino over serial in bytes times 4 (each command has a channel flag,
-// an integer telling you the number of values to set that follow (each value is 4 bytes), followed by the actual value bytes)
+// Every command arrives in a frame: a sync byte, a sequence number, the channel flag, the command, an integer
+// telling you the number of values to set that follow (each value is 4 bytes), followed by the actual value bytes.
+// Once a frame has been applied we answer ACK_BYTE followed by its sequence number, so the host knows it can send more.
+const byte ACK_BYTE = 0x06;
+// commands that return data (e.g. command = 9) answer DATA_BYTE, the sequence number, a length byte and the data instead
+const byte DATA_BYTE = 0x07;
+// a frame we could not hold is skipped and answered with NAK_BYTE and its sequence number, so the host resends it
+const byte NAK_BYTE = 0x15;
+// sent once setup() has finished, so the host knows when it can start sending frames
+const byte READY_BANNER[] = {0x08, 'R', 'E', 'A', 'D', 'Y'};
+RxRing rx_ring;
+CommandParser parser;
+// the most bytes parsed per pass of loop(), so that the step pins are checked often
+const unsigned int PARSE_BUDGET = 32;
+byte seq = 0;
 byte num_elements = 0;
+
+// The host may ask us to switch to a faster baud rate (command = 8). If no frame arrives at the new rate within
+// BAUD_PROBATION_MS, we assume the host could not follow and go back to DEFAULT_BAUD.
+const unsigned long DEFAULT_BAUD = 115200;
+const unsigned long BAUD_PROBATION_MS = 500;
+bool baud_probation = false;
+unsigned long baud_probation_start = 0;
 int command = 0;
 // This tells us which of the DDS channels we are changing
 int flag = 0;
-// a list of frequencies that we can store to send to the DDS. Up to 100 can be sent. If changing this number, you will also need to
-// change it in the Channel class
-long current_freq_list[100] = {0};
+// the frequency tuning words of the frame being applied. Longer tables than a frame holds arrive in chunks (command 13)
+// that go straight into the channel's table of up to MAX_TABLE (see Channel.h) entries.
+unsigned long current_freq_list[MAX_FRAME_VALUES] = {0};
 unsigned long inputLW[8] = {0};
-double phase = 0;
+unsigned int phase = 0;
 int amp = 512;
 
 // after ramping, we need to reset the DDS CFR register
 bool reset_cfr = false;
 
-// input pins for stepping/resetting: the reset pin does not need to be used, but can be if you want.
-int step_ch0_pin = 30;
-int reset_ch0_pin = 31;
-int step_ch1_pin = 32;
-int reset_ch1_pin = 33;
-int step_ch2_pin = 34;
-int reset_ch2_pin = 35;
-int step_ch3_pin = 40;
-int reset_ch3_pin = 41;
+// input pins for stepping/resetting, four per board: the reset pin does not need to be used, but can be if you want.
+const int step_pins[4 * MAX_BOARDS] = {30, 32, 34, 40, 42, 44, 46, 48, 54, 56, 58, 60, 62, 64, 66, 68};
+const int reset_pins[4 * MAX_BOARDS] = {31, 33, 35, 41, 43, 45, 47, 49, 55, 57, 59, 61, 63, 65, 67, 69};
+
+// create channel classes for each channel output of the DDS boards. Each one keeps its own frequency table and
+// counter, and the four channels of a board share its AD9959 object (by reference, see boardOf)
+#define BOARD_CHANNELS(b) \
+  Channel(CH[0], step_pins[4 * (b)], reset_pins[4 * (b)]), \
+  Channel(CH[1], step_pins[4 * (b) + 1], reset_pins[4 * (b) + 1]), \
+  Channel(CH[2], step_pins[4 * (b) + 2], reset_pins[4 * (b) + 2]), \
+  Channel(CH[3], step_pins[4 * (b) + 3], reset_pins[4 * (b) + 3])
+
+Channel channel_list[NUM_CHANNELS] = {
+  BOARD_CHANNELS(0),
+#if NUM_BOARDS > 1
+  BOARD_CHANNELS(1),
+#endif
+#if NUM_BOARDS > 2
+  BOARD_CHANNELS(2),
+#endif
+#if NUM_BOARDS > 3
+  BOARD_CHANNELS(3),
+#endif
+};
+
+// Trigger edges are caught by interrupts, so none are missed while loop() is busy. attachInterrupt works on
+// any pin of the Due. Boards with fewer external interrupts (e.g. the Mega, none of whose are on the step pins)
+// poll the step pins that have none on every pass of loop() instead, which misses edges while a frame is applied.
+template <int index> void stepISR() { channel_list[index].queueStep(); }
+
+#ifndef NOT_AN_INTERRUPT
+#define NOT_AN_INTERRUPT -1
+#endif
+// the step pins without an interrupt, and their level when loop() last looked
+bool step_polled[NUM_CHANNELS] = {false};
+int step_levels[NUM_CHANNELS] = {0};
+
+#define BOARD_STEP_ISRS(b) stepISR<4 * (b)>, stepISR<4 * (b) + 1>, stepISR<4 * (b) + 2>, stepISR<4 * (b) + 3>
+
+void (*const step_isrs[NUM_CHANNELS])() = {
+  BOARD_STEP_ISRS(0),
+#if NUM_BOARDS > 1
+  BOARD_STEP_ISRS(1),
+#endif
+#if NUM_BOARDS > 2
+  BOARD_STEP_ISRS(2),
+#endif
+#if NUM_BOARDS > 3
+  BOARD_STEP_ISRS(3),
+#endif
+};
+
+/*
+  The AD9959 that outputs a channel
+*/
+AD9959 &boardOf(int index) {
+  return boards[index / 4];
+}
+
+// Time from a trigger edge to the IOUpdate that applies it. Bucket k counts latencies below 2^(k+1) us
+// (and at least 2^k us, except for bucket 0). Read and cleared by command = 9.
+const int LATENCY_BUCKETS = 16;
+unsigned long latency_histogram[LATENCY_BUCKETS] = {0};
+unsigned long latency_count = 0;
+unsigned long latency_max = 0;
+
+void recordLatency(unsigned long latency) {
+  int bucket = 0;
+  while (bucket < LATENCY_BUCKETS - 1 && (latency >> (bucket + 1)) > 0) {
+    bucket += 1;
+  }
+  latency_histogram[bucket] += 1;
+  latency_count += 1;
+  if (latency > latency_max) {
+    latency_max = latency;
+  }
+}
+
+/*
+  Whether another channel's trigger steps this channel, in which case its own step pin is ignored
+*/
+bool isFollower(int index) {
+  int first = index - index % 4;
+  for (int other = first; other < first + 4; other++) {
+    if (other != index && (channel_list[other].group_mask & (1 << (index % 4)))) {
+      return true;
+    }
+  }
+  return false;
+}
 
-// create channel classes for each channel output of the DDS
+void writeWord32(unsigned long value) {
+  Serial.write((byte)(value >> 24));
+  Serial.write((byte)(value >> 16));
+  Serial.write((byte)(value >> 8));
+  Serial.write((byte)value);
+}
 
-Channel ch0 = Channel(CH[0], step_ch0_pin, reset_ch0_pin);
-Channel ch1 = Channel(CH[1], step_ch1_pin, reset_ch1_pin);
-Channel ch2 = Channel(CH[2], step_ch2_pin, reset_ch2_pin);
-Channel ch3 = Channel(CH[3], step_ch3_pin, reset_ch3_pin);
-Channel channel_list[4] = {ch0, ch1, ch2, ch3};
+// Bytes received while the two ends ran at different rates are garbage, and a 0xA5 among them would leave the
+// parser partway through a frame that swallows the first real one. Start from a clean slate at the new rate.
+void reopenSerial(unsigned long baud) {
+  Serial.end();
+  Serial.begin(baud);
+  rx_ring.clear();
+  parser.reset();
+}
 
 void setup()
 {
   // initialize our pins
   pinMode(LED_BUILTIN, OUTPUT);
-  pinMode(step_ch0_pin, INPUT);
-  pinMode(reset_ch0_pin, INPUT);
-  pinMode(step_ch1_pin, INPUT);
-  pinMode(reset_ch1_pin, INPUT);
-  pinMode(step_ch2_pin, INPUT);
-  pinMode(reset_ch2_pin, INPUT);
-  pinMode(step_ch3_pin, INPUT);
-  pinMode(reset_ch3_pin, INPUT);
+  for (int index = 0; index < NUM_CHANNELS; index++) {
+    pinMode(step_pins[index], INPUT);
+    pinMode(reset_pins[index], INPUT);
+    int interrupt = digitalPinToInterrupt(step_pins[index]);
+    if (interrupt == NOT_AN_INTERRUPT) {
+      step_polled[index] = true;
+      step_levels[index] = digitalRead(step_pins[index]);
+    }
+    else {
+      attachInterrupt(interrupt, step_isrs[index], RISING);
+    }
+  }
   //  warming up of Serial port.
-  Serial.begin(115200);
+  Serial.begin(DEFAULT_BAUD);
   while (!Serial) ;
 
   //  Start SPI
   //  In initialize(), set the External REF frequency in Hz.
   SPI.begin();
-  DDS.initialize(20000000);
+  for (int board = 0; board < NUM_BOARDS; board++) {
+    boards[board].initialize(20000000);
+  }
+  // the host sends nothing until it sees this, so no frame is lost to the bootloader or to setup()
+  Serial.write(READY_BANNER, sizeof(READY_BANNER));
 }
 
-void loop() {
-
-//current_freq_list[0] = {1000000};
-//current_freq_list[1] = {2000000};
-//current_freq_list[2] = {3000000};
-//channel_list[0].setFreqList(3, current_freq_list, DDS);
-//delay(1000);
-//channel_list[flag].checkStep(DDS);
-//delay(1000);
-//channel_list[flag].checkStep(DDS);
-//delay(1000);
-//
-//current_freq_list[0] = {1000000};
-//channel_list[0].setFreqList(1, current_freq_list, DDS);
-//channel_list[1].setFreqList(1, current_freq_list, DDS);
-//
-//unsigned long inputLW[8] = {50000000, 100000000, 1, 1, 1, 1, 2000, 0};
-//DDS.linearSweepF(inputLW);
-
-if (Serial.available() >= 3) {
-  //if(reset_cfr){
-    //DDS.resetCFR();
-    //DDS.stopSweep(flag);
-  //}
-  
-  // figure out which of the channels we will be setting
-  flag = Serial.read();
-  //Serial.println(flag);
-  command = Serial.read();
-  //Serial.println(command);
-  // figure out how many commands need to be sent to DDS
-  num_elements = Serial.read();
-  //Serial.println(num_elements);
+/*
+  Apply the frame the parser has just completed, then acknowledge it
+*/
+void applyFrame() {
+  flag = parser.channel;
+  command = parser.command;
+  num_elements = parser.count;
+  seq = parser.seq;
+  if (flag >= NUM_CHANNELS) {
+    // a channel of a board this build does not drive: acknowledge the frame without applying it
+    command = 0;
+    flag = 0;
+  }
+  // the channel byte addresses channel flag % 4 of board flag / 4
+  AD9959 &DDS = boardOf(flag);
 
   // Here we set the frequency (command = 1)
   if (command == 1) {
-    //Serial.println("Entering Set Freq");
-    // for each 4-byte command string ...
+    // convert each 4-byte frequency in Hz into a tuning word and put it into our frequency list
     for (int a = 0; a < num_elements; a += 1) {
-      while (Serial.available() < 4) {
-        // delay until we have at least 4 bytes
-        1 + 1;
-      }
-      // read the four bytes
-      float temp1 = Serial.read();
-      //Serial.print(temp1);
-      float temp2 = Serial.read();
-      //Serial.print(temp2);
-      float temp3 = Serial.read();
-      //Serial.println(temp1);
-      float temp4 = Serial.read();
-      // convert these bytes in a single long and put into our frequency list
-      current_freq_list[a] = (temp1 * 16777216 + temp2 * 65536 + temp3 * 256 + temp4);
-
+      current_freq_list[a] = DDS.freqToFTW(parser.word32(a));
     }
     // send the frequency list to the Channel and set it
-    channel_list[flag].setFreqList(num_elements, current_freq_list, DDS);
+    channel_list[flag].setFTWList(num_elements, current_freq_list, DDS);
     DDS.IOUpdate();
   }
 
-  if (command == 2) {
-    //Serial.println("Entering Set Phase");
-    while (Serial.available() < 2) {
-      // delay until we have at least 2 bytes
-      1 + 1;
+  // Here we set the frequency from tuning words computed by the host (command = 6)
+  if (command == 6) {
+    for (int a = 0; a < num_elements; a += 1) {
+      current_freq_list[a] = parser.word32(a);
     }
-    // read the two bytes
-    float temp1 = Serial.read();
-    float temp2 = Serial.read();
-    phase = temp1 * 256 + temp2;
+    channel_list[flag].setFTWList(num_elements, current_freq_list, DDS);
+    DDS.IOUpdate();
+  }
+
+  if (command == 2) {
+    phase = parser.word16(0);
     channel_list[flag].setPhase(phase, DDS);
     DDS.IOUpdate();
   }
 
   if (command == 3) {
-    //Serial.println("Entering Set Ramp");
-    while (Serial.available() < 24) {
-      // delay until we have at least 24 bytes
-      1 + 1;
-    }
-    //unsigned long inputLW[8];
-    // size of byte buffer for serial
-    for(int i=0; i < 6; i++){
-      // read the four bytes
-      float temp1 = Serial.read();
-      //Serial.print(temp1);
-      float temp2 = Serial.read();
-      //Serial.print(temp2);
-      float temp3 = Serial.read();
-      //Serial.println(temp1);
-      float temp4 = Serial.read();
-      inputLW[i] = (temp1 * 16777216 + temp2 * 65536 + temp3 * 256 + temp4);
-      //Serial.println(inputLW[i]);
+    for (int i = 0; i < 6; i++) {
+      inputLW[i] = parser.word32(i);
     }
     inputLW[6] = 0;
-    inputLW[7] = flag;
+    inputLW[7] = flag % 4;
     DDS.linearSweepF(inputLW);
     DDS.IOUpdate();
     reset_cfr = true;
+    channel_list[flag].mode = MODE_SWEEP;
   }
 
   if (command == 4) {
-    //Serial.println("Entering Set Phase");
-    while (Serial.available() < 2) {
-      // delay until we have at least 2 bytes
-      1 + 1;
-    }
-    // read the two bytes
-    float temp1 = Serial.read();
-    float temp2 = Serial.read();
     // max value of amplitude is between 0 and 1024
-    amp = temp1 * 256 + temp2;
+    amp = parser.word16(0);
     channel_list[flag].setAmplitude(amp, DDS);
     DDS.IOUpdate();
   }
-  
- // flush the buffer just in case too many bytes were sent
- while(Serial.available()>0){
-  Serial.println(Serial.read());
- }
+
+  if (command == 5) {
+    // go back to the start of the frequency list already loaded (the host skips re-sending unchanged lists)
+    channel_list[flag].rewind(DDS);
+    DDS.IOUpdate();
+  }
+
+  if (command == 10) {
+    // update several channels with a single IOUpdate, so that they all change at the same moment.
+    // Each entry: channel, flags (bit 0 tuning word, bit 1 phase, bit 2 amplitude), tuning word, phase, amplitude
+    byte updated = 0;
+    for (int a = 0; a < num_elements; a += 1) {
+      unsigned int offset = UPDATE_ENTRY * a;
+      byte index = parser.payload[offset];
+      byte fields = parser.payload[offset + 1];
+      if (index >= NUM_CHANNELS) {
+        continue;
+      }
+      updated |= 1 << (index / 4);
+      if (fields & 0x01) {
+        current_freq_list[0] = parser.word32At(offset + 2);
+        channel_list[index].setFTWList(1, current_freq_list, boardOf(index));
+      }
+      if (fields & 0x02) {
+        channel_list[index].setPhase(parser.word16At(offset + 6), boardOf(index));
+      }
+      if (fields & 0x04) {
+        channel_list[index].setAmplitude(parser.word16At(offset + 8), boardOf(index));
+      }
+    }
+    // each board changes with its own IOUpdate, the boards one after the other
+    for (int board = 0; board < NUM_BOARDS; board++) {
+      if (updated & (1 << board)) {
+        boards[board].IOUpdate();
+      }
+    }
+  }
+
+  if (command == 11 && num_elements > 0) {
+    // profile pin modulation: the first tuning word is output while the channel's profile pin is low, the
+    // second while it is high. The pin is released so that it can be driven directly by the experiment.
+    channel_list[flag].setProfiles(parser.word32(0), parser.word32(num_elements > 1 ? 1 : 0), DDS);
+    DDS.releaseProfilePin(flag % 4);
+    DDS.IOUpdate();
+  }
+
+  if (command == 12) {
+    // arm a linear sweep, started by the next edge on the channel's step pin
+    channel_list[flag].armSweep(parser.payload, DDS);
+    DDS.IOUpdate();
+  }
+
+  if (command == 13) {
+    // a chunk of a long table: offset of the first word and length of the whole table, then the words
+    channel_list[flag].setFTWChunk(parser.word16(0), parser.word16(1), num_elements, parser.payload + 4, DDS);
+    DDS.IOUpdate();
+  }
+
+  if (command == 15) {
+    // part of a table sent compactly (e.g. a stepped scan): offset, table length, first word, step, number of
+    // distinct words, repeats of each, then num_elements bytes of corrections to the step
+    channel_list[flag].setFTWRun(parser.word16(0), parser.word16(1), parser.word32At(4), parser.word32At(8),
+                                 parser.word16At(12), parser.payload[14], parser.payload + 15, num_elements, DDS);
+    DDS.IOUpdate();
+  }
+
+  if (command == 16) {
+    // the channels of its board this channel's trigger steps as well: they all change with one IOUpdate (see loop)
+    channel_list[flag].group_mask = parser.payload[0] & 0x0F & ~(1 << (flag % 4));
+  }
+
+  // command = 7 is a ping: there is nothing to do but acknowledge it (its padding is only used to measure throughput)
+
+  if (command == 9) {
+    // report (and clear) the trigger to IOUpdate latency histogram, together with the edges the queues dropped
+    unsigned long dropped = 0;
+    for (int index = 0; index < NUM_CHANNELS; index++) {
+      dropped += channel_list[index].edges_dropped;
+      channel_list[index].edges_dropped = 0;
+    }
+    Serial.write(DATA_BYTE);
+    Serial.write(seq);
+    Serial.write((byte)(4 * (3 + LATENCY_BUCKETS)));
+    writeWord32(latency_count);
+    writeWord32(latency_max);
+    writeWord32(dropped);
+    for (int bucket = 0; bucket < LATENCY_BUCKETS; bucket++) {
+      writeWord32(latency_histogram[bucket]);
+      latency_histogram[bucket] = 0;
+    }
+    latency_count = 0;
+    latency_max = 0;
+  }
+  else if (command == 17) {
+    // report what each channel of the addressed board holds (see Channel::writeDigest), so the host only sends
+    // what differs
+    byte digest[DIGEST_SIZE];
+    Serial.write(DATA_BYTE);
+    Serial.write(seq);
+    Serial.write((byte)(4 * DIGEST_SIZE));
+    for (int index = flag - flag % 4; index < flag - flag % 4 + 4; index++) {
+      channel_list[index].writeDigest(digest);
+      Serial.write(digest, DIGEST_SIZE);
+    }
+  }
+  else if (command == 14) {
+    // report how many tuning words each channel's table holds, how many boards there are, and how many bytes
+    // we buffer while applying a frame
+    Serial.write(DATA_BYTE);
+    Serial.write(seq);
+    Serial.write((byte)7);
+    writeWord32(MAX_TABLE);
+    Serial.write((byte)NUM_BOARDS);
+    Serial.write((byte)(RX_CAPACITY >> 8));
+    Serial.write((byte)RX_CAPACITY);
+  }
+  else {
+    // tell the host this frame has been applied
+    Serial.write(ACK_BYTE);
+    Serial.write(seq);
+  }
+  baud_probation = false;
+
+  if (command == 8) {
+    // switch only once the acknowledgement has gone out at the old rate
+    Serial.flush();
+    reopenSerial(parser.word32(0));
+    baud_probation = true;
+    baud_probation_start = millis();
+  }
 }
 
+void loop() {
 
+//current_freq_list[0] = {1000000};
+//current_freq_list[1] = {2000000};
+//current_freq_list[2] = {3000000};
+//channel_list[0].setFTWList(3, current_freq_list, DDS);
+//delay(1000);
+//channel_list[flag].checkStep(DDS);
+//delay(1000);
+//channel_list[flag].checkStep(DDS);
+//delay(1000);
+//
+//current_freq_list[0] = {1000000};
+//channel_list[0].setFTWList(1, current_freq_list, DDS);
+//channel_list[1].setFTWList(1, current_freq_list, DDS);
 //
-for (int index = 0; index < 4; index ++) {
-  // see if the step pin for our channel is high. If it is, increment to the next frequency in the list for this channel
-  channel_list[index].checkStep(DDS);
+//unsigned long inputLW[8] = {50000000, 100000000, 1, 1, 1, 1, 2000, 0};
+//DDS.linearSweepF(inputLW);
+
+if (baud_probation && millis() - baud_probation_start > BAUD_PROBATION_MS) {
+  reopenSerial(DEFAULT_BAUD);
+  baud_probation = false;
+}
+
+// move whatever serial has received into our ring, then parse a bounded number of bytes. Nothing here waits for
+// bytes to arrive, so the step pins below are checked on every pass even in the middle of an upload.
+while (Serial.available() > 0 && !rx_ring.full()) {
+  rx_ring.push(Serial.read());
+}
+if (parser.poll(rx_ring, PARSE_BUDGET)) {
+  if (parser.rejected) {
+    Serial.write(NAK_BYTE);
+    Serial.write(parser.seq);
+  }
+  else {
+    applyFrame();
+  }
+}
+
+//
+for (int index = 0; index < NUM_CHANNELS; index ++) {
+  // a rising edge on a step pin without an interrupt is queued as the interrupt would have
+  if (step_polled[index]) {
+    int level = digitalRead(step_pins[index]);
+    if (level == HIGH && step_levels[index] == LOW) {
+      channel_list[index].queueStep();
+    }
+    step_levels[index] = level;
+  }
+  // apply the trigger edges the interrupt has seen on this channel's step pin: increment to the next frequency in the list
+  unsigned long edge_time;
+  AD9959 &DDS = boardOf(index);
+  // (a channel stepped by another channel's trigger drops the edges on its own pin)
+  while (channel_list[index].nextStep(edge_time)) {
+    if (isFollower(index)) {
+      continue;
+    }
+    bool update = channel_list[index].advance(DDS);
+    for (int other = 0; other < 4; other++) {
+      if (channel_list[index].group_mask & (1 << other)) {
+        update = channel_list[index - index % 4 + other].advance(DDS) || update;
+      }
+    }
+    if (update) {
+      DDS.IOUpdate();
+    }
+    recordLatency(micros() - edge_time);
+  }
 
   // see if the reset pin for our channel is high. If it is, reset the frequency to the first one in the list
   // uncommenting this was causing the ramp to not work for some reason.
@@ -3,93 +3,291 @@
 #include "Channel.h"
 #include <SPI.h>
 
-// list of frequencies to be set on the DDS
-long freq_list[100] = {0};
-// the length of the above live (not all 100 elements need be filled)
-int num_elements_channel;
-// the index of the frequency list that the DDS is currently outputting for the ch
-int reset_state_channel = 0;
-// these are telling us that we should wait to reset things until we have a full on/off cycle from the trigger
-int counter_channel = 0; 
-int step_channel = 0;
-
-int register_channel;
-// whether or not to step to the next frequency
-int reset_pin;
-// whether or not to reset the counter
-int step_pin;
+// CRC-32 (as zlib.crc32) of the reflected polynomial 0xEDB88320, four bits at a time
+static const unsigned long CRC_TABLE[16] = {
+  0x00000000UL, 0x1DB71064UL, 0x3B6E20C8UL, 0x26D930ACUL, 0x76DC4190UL, 0x6B6B51F4UL, 0x4DB26158UL, 0x5005713CUL,
+  0xEDB88320UL, 0xF00F9344UL, 0xD6D6A3E8UL, 0xCB61B38CUL, 0x9B64C2B0UL, 0x86D3D2D4UL, 0xA00AE278UL, 0xBDBDF21CUL
+};
 
+static unsigned long crc32Update(unsigned long crc, const byte *data, unsigned int length)
+{
+  for (unsigned int i = 0; i < length; i++){
+    crc ^= data[i];
+    crc = (crc >> 4) ^ CRC_TABLE[crc & 0x0F];
+    crc = (crc >> 4) ^ CRC_TABLE[crc & 0x0F];
+  }
+  return crc;
+}
 
 Channel::Channel(int reg, int step_pin_set, int reset_pin_set)
 {  
   register_channel = reg;
+  profile_pin = 0;
+  while (profile_pin < 3 && (0x10 << profile_pin) != reg){
+    profile_pin += 1;
+  }
+  sweep_armed = false;
+  sweep_falling = false;
+  group_mask = 0;
+  mode = MODE_TABLE;
+  profile_high = 0;
+  phase_word = WORD_UNSET;
+  amplitude_word = WORD_UNSET;
   // whether or not to step to the next frequency
   reset_pin = reset_pin_set;
   // whether or not to reset the counter
   step_pin = step_pin_set;
-  
+
+  // until a list is loaded, the channel holds a single 0 Hz entry
+  for (int b = 0; b < 4; b += 1){
+    ftw_table[0][b] = 0;
+  }
+  num_elements_channel = 1;
+  counter_channel = 0;
+  reset_state_channel = 0;
+
+  edge_head = 0;
+  edge_tail = 0;
+  edges_dropped = 0;
 }
 
-void Channel::setFreqList(int num_elements, long elements[100], AD9959 DDS)
+void Channel::setFTWList(int num_elements, const unsigned long *elements, AD9959 &DDS)
 { 
+  if (num_elements > MAX_TABLE){
+    num_elements = MAX_TABLE;
+  }
   for (int i = 0; i<num_elements; i+= 1){
-    freq_list[i] = elements[i];
+    ftw_table[i][0] = (byte)(elements[i] >> 24);
+    ftw_table[i][1] = (byte)(elements[i] >> 16);
+    ftw_table[i][2] = (byte)(elements[i] >> 8);
+    ftw_table[i][3] = (byte)elements[i];
   }
   counter_channel = 0;
   num_elements_channel = num_elements;
+  sweep_armed = false;
+  mode = MODE_TABLE;
   DDS.selectChannel(register_channel);
-  DDS.setFreq(freq_list[0]);
+  // leave profile pin modulation if setProfiles was used before (free if it was not, see AD9959::writeCFR)
+  DDS.setFrequencyModulation(false);
+  DDS.writeFTW(ftw_table[0]);
+}
+
+/*
+  Store `count` tuning words (4 bytes each, MSB first, as they arrive over serial) at `offset` in a table of
+  `total` entries. The first chunk (offset 0) starts the table over and outputs its first entry; anything
+  beyond MAX_TABLE is dropped, the host checks the capacity before sending.
+*/
+void Channel::setFTWChunk(unsigned int offset, unsigned int total, int count, const byte *words, AD9959 &DDS)
+{
+  for (int i = 0; i < count && offset + i < MAX_TABLE; i += 1){
+    for (int b = 0; b < 4; b += 1){
+      ftw_table[offset + i][b] = words[4 * i + b];
+    }
+  }
+  num_elements_channel = total < MAX_TABLE ? total : MAX_TABLE;
+  if (num_elements_channel < 1){
+    num_elements_channel = 1;
+  }
+  if (offset == 0){
+    counter_channel = 0;
+    sweep_armed = false;
+    mode = MODE_TABLE;
+    DDS.selectChannel(register_channel);
+    DDS.setFrequencyModulation(false);
+    DDS.writeFTW(ftw_table[0]);
+  }
+}
+
+/*
+  Like setFTWChunk, but the tuning words from `offset` on are described by the first word and a step (added
+  modulo 2^32, so it may be negative): `length` distinct words, each written `repeat` times. Bit k of
+  `corrections` (MSB first) adds one more to the k-th step, which is what rounding a scan in Hz to tuning
+  words needs. With fewer than (length - 1) / 8 bytes of corrections, the missing bits are 0.
+*/
+void Channel::setFTWRun(unsigned int offset, unsigned int total, unsigned long word, unsigned long step,
+                        unsigned int length, byte repeat, const byte *corrections, int correction_bytes, AD9959 &DDS)
+{
+  unsigned int index = offset;
+  for (unsigned int k = 0; k < length && index < MAX_TABLE; k += 1){
+    for (byte r = 0; r < repeat && index < MAX_TABLE; r += 1, index += 1){
+      ftw_table[index][0] = (byte)(word >> 24);
+      ftw_table[index][1] = (byte)(word >> 16);
+      ftw_table[index][2] = (byte)(word >> 8);
+      ftw_table[index][3] = (byte)word;
+    }
+    word += step;
+    if ((int)(k >> 3) < correction_bytes && (corrections[k >> 3] & (0x80 >> (k & 7)))){
+      word += 1;
+    }
+  }
+  // the words are in the table already, setFTWChunk only has to do the bookkeeping
+  setFTWChunk(offset, total, 0, corrections, DDS);
+}
+
+/*
+  Output `low` while the channel's profile pin is low and `high` while it is high. The DDS switches
+  between them by itself, so triggers on the step pin have nothing to step through.
+*/
+void Channel::setProfiles(unsigned long low, unsigned long high, AD9959 &DDS)
+{
+  unsigned long words[1] = {low};
+  setFTWList(1, words, DDS);
+  byte high_bytes[4] = {(byte)(high >> 24), (byte)(high >> 16), (byte)(high >> 8), (byte)high};
+  DDS.setFrequencyModulation(true);
+  DDS.writeCW1(high_bytes);
+  mode = MODE_PROFILE;
+  profile_high = high;
 }
 
-void Channel::setPhase(double phase, AD9959 DDS)
+void Channel::setPhase(unsigned int phase_word, AD9959 &DDS)
 { 
-  double RESOLUTION_P = 16384.0; // 2^14
-  phase = phase / RESOLUTION_P * 360.0;
+  this->phase_word = phase_word;
   DDS.selectChannel(register_channel);
-  DDS.setPhase(phase);
+  DDS.setPOW(phase_word);
 }
 
 
-void Channel::setAmplitude(int amplitude, AD9959 DDS)
+void Channel::setAmplitude(int amplitude, AD9959 &DDS)
 { 
+  amplitude_word = amplitude;
   DDS.selectChannel(register_channel);
   DDS.setAmp(amplitude);
 }
-void Channel::checkStep(AD9959 DDS){
 
-  if (digitalRead(step_pin) == LOW){
-    step_channel = 0;
+/*
+  Load a linear sweep that the next trigger edge starts. The sweep (command 12) is laid out as:
+  low tuning word, high tuning word, rising delta word, falling delta word (4 bytes each, MSB first),
+  rising and falling ramp rates, and 1 if the sweep goes from high to low. Until the trigger the output
+  sits at the start of the sweep.
+*/
+void Channel::armSweep(const byte *sweep, AD9959 &DDS)
+{
+  for (int b = 0; b < 4; b += 1){
+    ftw_table[0][b] = sweep[b];
+  }
+  num_elements_channel = 1;
+  counter_channel = 0;
+  DDS.selectChannel(register_channel);
+  DDS.loadSweep(sweep, sweep + 4, sweep + 8, sweep + 12, sweep[16], sweep[17]);
+  sweep_falling = sweep[18];
+  sweep_armed = true;
+  mode = MODE_SWEEP;
+  // a falling sweep starts from the high word: the host makes the rising delta word jump there in one step
+  if (sweep_falling){
+    DDS.startSweep(profile_pin);
+  }
+  else {
+    DDS.stopSweep(profile_pin);
+  }
+}
+
+/*
+  Called from the step pin interrupt: remember when the edge happened, loop() applies it
+*/
+void Channel::queueStep(){
+  if ((byte)(edge_head - edge_tail) >= STEP_QUEUE){
+    edges_dropped += 1;
+    return;
+  }
+  edge_times[edge_head & (STEP_QUEUE - 1)] = micros();
+  edge_head += 1;
+}
+
+/*
+  Take the oldest edge not yet applied off the queue. Returns false if there is none.
+*/
+bool Channel::nextStep(unsigned long &edge_time){
+  bool found = false;
+  noInterrupts();
+  if (edge_head != edge_tail){
+    edge_time = edge_times[edge_tail & (STEP_QUEUE - 1)];
+    edge_tail += 1;
+    found = true;
+  }
+  interrupts();
+  return found;
+}
+
+/*
+  Move to the next frequency in the list (if there is one), without applying it yet. Returns false if the
+  step started a sweep instead, which needs no IOUpdate.
+*/
+bool Channel::advance(AD9959 &DDS){
+  if (sweep_armed){
+    // the sweep registers are loaded already: flipping the profile pin starts it
+    sweep_armed = false;
+    if (sweep_falling){
+      DDS.stopSweep(profile_pin);
+    }
+    else {
+      DDS.startSweep(profile_pin);
+    }
+    return false;
+  }
+  if (counter_channel < num_elements_channel - 1){
+    counter_channel += 1;
+    DDS.selectChannel(register_channel);
+    DDS.writeFTW(ftw_table[counter_channel]);
   }
-  if (digitalRead(step_pin) == HIGH && step_channel == 0){
-    step_channel = 1;
-      
-    if (counter_channel < num_elements_channel - 1){
-      counter_channel += 1;
-      DDS.selectChannel(register_channel);
-      DDS.setFreq(freq_list[counter_channel]);
-    }  
-  DDS.IOUpdate();
-//    else{
-//      counter_channel = 0;
-//      DDS.selectChannel(register_channel);
-//      DDS.setFreq(freq_list[counter_channel]);
-//    }
+  return true;
+}
+
+/*
+  Move to the next frequency in the list (if there is one) and apply it
+*/
+void Channel::step(AD9959 &DDS){
+  if (advance(DDS)){
+    DDS.IOUpdate();
   }
 }
 
-void Channel::checkReset(AD9959 DDS){
+void Channel::rewind(AD9959 &DDS){
+  // go back to the first frequency in the list
+  DDS.selectChannel(register_channel);
+  DDS.writeFTW(ftw_table[0]);
+  counter_channel = 0;
+}
+
+void Channel::checkReset(AD9959 &DDS){
   if (digitalRead(reset_pin) == LOW){
     reset_state_channel = 0;
   }
   
   if(digitalRead(reset_pin) == HIGH && reset_state_channel == 0){
     
-    DDS.selectChannel(register_channel);
-    DDS.setFreq(freq_list[0]);
-    counter_channel = 0;
+    rewind(DDS);
     reset_state_channel = 1;
   
     DDS.IOUpdate();
   }
 
 }
+
+/*
+  Summarise what the channel has been programmed with in DIGEST_SIZE bytes (MSB first): the mode, the CRC-32 of
+  its tuning words (the table, or the low and high words in MODE_PROFILE) and how many there are, the phase and
+  amplitude words, and the channels its trigger steps as well.
+*/
+void Channel::writeDigest(byte *out){
+  unsigned long crc = 0xFFFFFFFFUL;
+  unsigned int length = num_elements_channel;
+  crc = crc32Update(crc, ftw_table[0], 4 * (unsigned int) num_elements_channel);
+  if (mode == MODE_PROFILE){
+    byte high_bytes[4] = {(byte)(profile_high >> 24), (byte)(profile_high >> 16), (byte)(profile_high >> 8), (byte)profile_high};
+    crc = crc32Update(crc, high_bytes, 4);
+    length += 1;
+  }
+  crc ^= 0xFFFFFFFFUL;
+  out[0] = mode;
+  out[1] = (byte)(crc >> 24);
+  out[2] = (byte)(crc >> 16);
+  out[3] = (byte)(crc >> 8);
+  out[4] = (byte)crc;
+  out[5] = (byte)(length >> 8);
+  out[6] = (byte)length;
+  out[7] = (byte)(phase_word >> 8);
+  out[8] = (byte)phase_word;
+  out[9] = (byte)(amplitude_word >> 8);
+  out[10] = (byte)amplitude_word;
+  out[11] = group_mask;
+}
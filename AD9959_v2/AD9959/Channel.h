@@ -5,30 +5,93 @@
 #include "Arduino.h"
 #include "AD9959.h"
 
+// how many trigger edges can be waiting to be applied at once (a power of two)
+#define STEP_QUEUE 8
+// the number of AD9959 boards sharing the SPI bus, each with its own chip select (see BOARD_PINS in AD9959.ino).
+// The host addresses channel k of board b as channel 4 * b + k. Reported to the host by command 14.
+#ifndef NUM_BOARDS
+#define NUM_BOARDS 1
+#endif
+#define MAX_BOARDS 4
+#define NUM_CHANNELS (4 * NUM_BOARDS)
+// the longest frequency list a channel can hold, as much as the SRAM allows: the Due (96 kB) holds 64 kB of tables,
+// i.e. 4096 tuning words per channel with one board and 1024 with four, smaller boards 100 words per channel with
+// one board. Reported to the host by command 14.
+#if defined(ARDUINO_ARCH_SAM)
+#define MAX_TABLE (4096 / NUM_BOARDS)
+#else
+#define MAX_TABLE (100 / NUM_BOARDS)
+#endif
+// the most values a single frame carries (its count is one byte): longer tables arrive in chunks (command 13)
+#define MAX_FRAME_VALUES 255
+
+// what sets a channel's frequency: its table (stepped by triggers), the profile pin, or a linear sweep
+#define MODE_TABLE 0
+#define MODE_PROFILE 1
+#define MODE_SWEEP 2
+// phase and amplitude words that have not been set since power up (both registers are narrower than 16 bits)
+#define WORD_UNSET 0xFFFF
+// bytes writeDigest reports per channel (command 17)
+#define DIGEST_SIZE 12
+
 class Channel
 {
 public:
-  long freq_list[100];
+  // frequency tuning words to step through, already split into the 4 bytes of the CFTW0 register (MSB first)
+  // so that a step is only a channel select and a register write
+  byte ftw_table[MAX_TABLE][4];
   // the length of the above live (not all 100 elements need be filled)
   int num_elements_channel;
   // the index of the frequency list that the DDS is currently outputting for the ch
   int reset_state_channel;
   // these are telling us that we should wait to reset things until we have a full on/off cycle from the trigger
   int counter_channel; 
-  int step_channel;
+
+  // trigger edges recorded by the interrupt (with their time in us) that loop() has not applied yet
+  volatile unsigned long edge_times[STEP_QUEUE];
+  volatile byte edge_head;
+  volatile byte edge_tail;
+  // edges dropped because the queue was full
+  volatile unsigned long edges_dropped;
   
+  // set by armSweep: the next trigger edge starts a linear sweep (falling or rising) instead of stepping
+  bool sweep_armed;
+  bool sweep_falling;
+
+  // the other channels of the same board a trigger edge on this channel's step pin steps as well (bit k for its
+  // channel k), so that channels sharing a trigger line change with one IOUpdate. Set by command 16.
+  byte group_mask;
+
+  // what the host last programmed, reported by writeDigest so that it can tell what needs sending again
+  byte mode;
+  // the tuning word output while the profile pin is high, in MODE_PROFILE
+  unsigned long profile_high;
+  unsigned int phase_word;
+  unsigned int amplitude_word;
+
   int register_channel;
+  // the profile pin (0-3) of this channel, which starts and stops linear sweeps
+  byte profile_pin;
   // whether or not to step to the next frequency
   int reset_pin;
   // whether or not to reset the counter
   int step_pin;
 	Channel(int, int, int);
 
-  void setFreqList(int, long [100], AD9959);
-  void setPhase(double, AD9959);
-  void setAmplitude(int, AD9959);
-  void checkStep(AD9959);
-  void checkReset(AD9959);
+  void setFTWList(int, const unsigned long *, AD9959 &);
+  void setFTWChunk(unsigned int, unsigned int, int, const byte *, AD9959 &);
+  void setFTWRun(unsigned int, unsigned int, unsigned long, unsigned long, unsigned int, byte, const byte *, int, AD9959 &);
+  void setProfiles(unsigned long, unsigned long, AD9959 &);
+  void armSweep(const byte *, AD9959 &);
+  void setPhase(unsigned int, AD9959 &);
+  void setAmplitude(int, AD9959 &);
+  void queueStep();
+  bool nextStep(unsigned long &);
+  bool advance(AD9959 &);
+  void step(AD9959 &);
+  void checkReset(AD9959 &);
+  void rewind(AD9959 &);
+  void writeDigest(byte *);
 
 };
 
@@ -0,0 +1,188 @@
+#include "Arduino.h"
+#include "CommandParser.h"
+
+const byte SYNC_BYTE = 0xA5;
+
+// which byte of the frame the parser expects next
+enum {WAIT_SYNC, WAIT_SEQ, WAIT_CHANNEL, WAIT_COMMAND, WAIT_COUNT, WAIT_PAYLOAD, DISCARD_PAYLOAD};
+
+RxRing::RxRing()
+{
+  _head = 0;
+  _tail = 0;
+}
+
+bool RxRing::push(byte b)
+{
+  if (full()) {
+    return false;
+  }
+  _buffer[_head & (RX_RING_SIZE - 1)] = b;
+  _head += 1;
+  return true;
+}
+
+int RxRing::pop()
+{
+  if (_head == _tail) {
+    return -1;
+  }
+  byte b = _buffer[_tail & (RX_RING_SIZE - 1)];
+  _tail += 1;
+  return b;
+}
+
+unsigned int RxRing::available()
+{
+  return _head - _tail;
+}
+
+bool RxRing::full()
+{
+  return available() >= RX_RING_SIZE;
+}
+
+void RxRing::clear()
+{
+  _tail = _head;
+}
+
+CommandParser::CommandParser()
+{
+  reset();
+}
+
+void CommandParser::reset()
+{
+  _state = WAIT_SYNC;
+  _received = 0;
+  payload_length = 0;
+  rejected = false;
+}
+
+/*
+	Payload size of each command in bytes, this must match PAYLOAD_SIZES in protocol.py
+*/
+unsigned int CommandParser::payloadLength(byte cmd, byte n)
+{
+  switch (cmd) {
+    case 1: return 4 * (unsigned int) n;  // frequencies in Hz
+    case 2: return 2;                     // phase
+    case 3: return 24;                    // ramp
+    case 4: return 2;                     // amplitude
+    case 5: return 0;                     // rewind
+    case 6: return 4 * (unsigned int) n;  // frequency tuning words
+    case 7: return 4 * (unsigned int) n;  // ping with padding
+    case 8: return 4;                     // baud rate
+    case 9: return 0;                     // step latency report
+    case 10: return UPDATE_ENTRY * (unsigned int) n;  // update of several channels
+    case 11: return 4 * (unsigned int) n;  // profile pin tuning words
+    case 12: return 20;                   // linear sweep started by the next trigger
+    case 13: return 4 + 4 * (unsigned int) n;  // chunk of a long tuning word table
+    case 14: return 0;                    // table capacity query
+    case 15: return 15 + (unsigned int) n;  // run of a compactly encoded tuning word table
+    case 16: return 1;                    // channels stepped by this channel's trigger
+    case 17: return 0;                    // digest query
+    default: return 0;
+  }
+}
+
+/*
+	Consume at most budget bytes from the ring.
+	Returns true as soon as a complete frame has been read; the frame stays valid until the next call.
+	A frame whose payload does not fit is returned as soon as its header has been read, with rejected set and
+	only seq valid, and its payload is skipped by the following calls.
+*/
+bool CommandParser::poll(RxRing &ring, unsigned int budget)
+{
+  while (budget > 0 && ring.available() > 0) {
+    byte b = (byte) ring.pop();
+    budget -= 1;
+
+    switch (_state) {
+      case WAIT_SYNC:
+        // skip anything that is not the start of a frame
+        if (b == SYNC_BYTE) {
+          _state = WAIT_SEQ;
+        }
+        break;
+      case WAIT_SEQ:
+        seq = b;
+        _state = WAIT_CHANNEL;
+        break;
+      case WAIT_CHANNEL:
+        channel = b;
+        _state = WAIT_COMMAND;
+        break;
+      case WAIT_COMMAND:
+        command = b;
+        _state = WAIT_COUNT;
+        break;
+      case WAIT_COUNT:
+        count = b;
+        payload_length = payloadLength(command, count);
+        _received = 0;
+        rejected = payload_length > MAX_PAYLOAD;
+        if (rejected) {
+          // more than we can hold (the host never sends this, unless the header was corrupted): skip the payload
+          // rather than look for a frame in it, and let the host know
+          _state = DISCARD_PAYLOAD;
+          return true;
+        }
+        if (payload_length == 0) {
+          _state = WAIT_SYNC;
+          return true;
+        }
+        _state = WAIT_PAYLOAD;
+        break;
+      case WAIT_PAYLOAD:
+        payload[_received] = b;
+        _received += 1;
+        if (_received == payload_length) {
+          _state = WAIT_SYNC;
+          return true;
+        }
+        break;
+      case DISCARD_PAYLOAD:
+        _received += 1;
+        if (_received == payload_length) {
+          _state = WAIT_SYNC;
+        }
+        break;
+    }
+  }
+  return false;
+}
+
+/*
+	Big endian 4 byte word starting at byte offset index * 4 of the payload
+*/
+unsigned long CommandParser::word32(unsigned int index)
+{
+  return word32At(4 * index);
+}
+
+/*
+	Big endian 2 byte word starting at byte offset index * 2 of the payload
+*/
+unsigned int CommandParser::word16(unsigned int index)
+{
+  return word16At(2 * index);
+}
+
+/*
+	Big endian 4 byte word starting at any byte offset of the payload
+*/
+unsigned long CommandParser::word32At(unsigned int i)
+{
+  return ((unsigned long) payload[i] << 24) | ((unsigned long) payload[i + 1] << 16)
+       | ((unsigned long) payload[i + 2] << 8) | (unsigned long) payload[i + 3];
+}
+
+/*
+	Big endian 2 byte word starting at any byte offset of the payload
+*/
+unsigned int CommandParser::word16At(unsigned int i)
+{
+  return ((unsigned int) payload[i] << 8) | (unsigned int) payload[i + 1];
+}
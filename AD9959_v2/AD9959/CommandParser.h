@@ -0,0 +1,74 @@
+#ifndef _CommandParser_H_
+#define _CommandParser_H_
+
+#include "Arduino.h"
+
+// number of bytes the receive ring can hold, must be a power of two
+#define RX_RING_SIZE 256
+// bytes the core's UART driver buffers until loop() moves them into the ring (128 on a Due, 64 on AVR boards)
+#if defined(SERIAL_BUFFER_SIZE)
+#define UART_RX_SIZE SERIAL_BUFFER_SIZE
+#elif defined(SERIAL_RX_BUFFER_SIZE)
+#define UART_RX_SIZE SERIAL_RX_BUFFER_SIZE
+#else
+#define UART_RX_SIZE 64
+#endif
+// bytes that can arrive while a frame is being applied without any being lost. The host keeps the frames it has
+// not had acknowledged within this (reported by command 14), as nothing else holds it back.
+#define RX_CAPACITY (UART_RX_SIZE + RX_RING_SIZE)
+// the largest payload of any command: 255 values of 4 bytes after a 4 byte offset (command 13)
+#define MAX_PAYLOAD 1024
+// bytes per channel in an update of several channels (command 10): channel, flags, tuning word, phase, amplitude
+#define UPDATE_ENTRY 10
+
+/*
+	Bytes received over serial, waiting to be parsed.
+	loop() moves whatever Serial has into the ring, the parser takes them out at its own pace.
+*/
+class RxRing
+{
+public:
+  RxRing();
+  bool push(byte);
+  int pop();
+  unsigned int available();
+  bool full();
+  void clear();
+
+private:
+  byte _buffer[RX_RING_SIZE];
+  unsigned int _head, _tail;
+};
+
+/*
+	Incremental parser for the frames sent by the host:
+	SYNC, sequence number, channel flag, command, number of values, payload.
+	poll() never waits for bytes, so loop() can go straight back to checking the step pins.
+*/
+class CommandParser
+{
+public:
+  CommandParser();
+  bool poll(RxRing &, unsigned int);
+  void reset();
+  unsigned long word32(unsigned int);
+  unsigned int word16(unsigned int);
+  unsigned long word32At(unsigned int);
+  unsigned int word16At(unsigned int);
+
+  // the last complete frame (valid after poll() returned true)
+  bool rejected;
+  byte seq;
+  byte channel;
+  byte command;
+  byte count;
+  byte payload[MAX_PAYLOAD];
+  unsigned int payload_length;
+
+private:
+  unsigned int payloadLength(byte, byte);
+  byte _state;
+  unsigned int _received;
+};
+
+#endif
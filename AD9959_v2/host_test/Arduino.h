@@ -0,0 +1,68 @@
+/*
+	Minimal stand-in for the Arduino core, so that the firmware can be built and timed on a PC.
+	Only what the firmware uses is provided. Pins and the serial port are plain memory that the
+	test program drives.
+*/
+#ifndef _ARDUINO_STUB_H_
+#define _ARDUINO_STUB_H_
+
+#include <stddef.h>
+#include <stdint.h>
+#include <deque>
+
+typedef uint8_t byte;
+
+#define HIGH 1
+#define LOW 0
+#define INPUT 0
+#define OUTPUT 1
+#define LED_BUILTIN 13
+#define RISING 3
+#define NUM_PINS 78
+// receive buffer of the Due's UART driver (RingBuffer.h in the Arduino SAM core)
+#define SERIAL_BUFFER_SIZE 128
+
+// level of every pin: written by digitalWrite, or set by the test program for inputs
+extern int pin_levels[NUM_PINS];
+
+void pinMode(int, int);
+void digitalWrite(int, int);
+int digitalRead(int);
+void delay(unsigned long);
+unsigned long micros();
+unsigned long millis();
+int digitalPinToInterrupt(int);
+void attachInterrupt(int, void (*)(), int);
+void noInterrupts();
+void interrupts();
+
+// test helper: set an input pin, calling its interrupt handler on a rising edge
+void setPinLevel(int, int);
+
+class SerialStub
+{
+public:
+  void begin(unsigned long baud) { baud_rate = baud; }
+  // the cores empty their receive buffer when the port is closed
+  void end() { rx.clear(); }
+  void flush() {}
+  operator bool() { return true; }
+  int available() { return (int) rx.size(); }
+  int peek() { return rx.empty() ? -1 : rx.front(); }
+  int read();
+  size_t write(byte b) { tx.push_back(b); return 1; }
+  size_t write(const byte *data, size_t length) { tx.insert(tx.end(), data, data + length); return length; }
+  void println(int) {}
+  // test helper: a byte arriving from the host, lost (and counted) if the UART buffer is full as on the board
+  bool receive(byte b);
+
+  unsigned long baud_rate = 0;
+  // bytes "received" from the host, and bytes sent back to it
+  std::deque<byte> rx;
+  std::deque<byte> tx;
+  unsigned long rx_overflows = 0;
+};
+
+extern SerialStub Serial;
+
+#endif
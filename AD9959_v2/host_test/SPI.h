@@ -0,0 +1,35 @@
+/*
+	Minimal stand-in for the Arduino SPI library. It counts transactions and bytes instead of sending them.
+*/
+#ifndef _SPI_STUB_H_
+#define _SPI_STUB_H_
+
+#include "Arduino.h"
+
+#define MSBFIRST 1
+#define SPI_MODE0 0
+
+class SPISettings
+{
+public:
+  SPISettings(unsigned long clock, int, int) { this->clock = clock; }
+  unsigned long clock;
+};
+
+class SPIStub
+{
+public:
+  void begin() {}
+  void beginTransaction(SPISettings settings) { transactions += 1; clock = settings.clock; }
+  void endTransaction() {}
+  byte transfer(byte) { bytes += 1; return 0; }
+  void transfer(void *, size_t count) { bytes += count; }
+
+  unsigned long transactions = 0;
+  unsigned long bytes = 0;
+  unsigned long clock = 0;
+};
+
+extern SPIStub SPI;
+
+#endif
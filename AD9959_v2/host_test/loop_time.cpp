@@ -0,0 +1,127 @@
+/*
+	Worst-case duration of one pass of loop() while a shot is uploaded.
+
+	A full table sent as a run (the longest frame to apply) and four 100 point tuning word tables (plus phase and
+	amplitude) are handed to the stub serial port at the rate a 115200 baud line (or the rate given as the first
+	argument) delivers them, while a step pin is toggled. Like link.ArduinoLink, the host starts a frame only while
+	fewer than 4 frames and at most RX_CAPACITY bytes are unacknowledged. Every pass of loop() is timed, and the
+	firmware's own trigger to IOUpdate latency histogram is printed, with the bytes the UART buffer lost.
+*/
+#include <algorithm>
+#include <chrono>
+#include <stdio.h>
+#include <stdlib.h>
+#include <vector>
+
+#include "AD9959.ino"
+
+static void frame(std::vector<std::vector<byte> > &frames, byte seq, byte channel, byte command, byte count,
+                  const std::vector<byte> &payload)
+{
+  frames.push_back(std::vector<byte>());
+  std::vector<byte> &out = frames.back();
+  out.push_back(0xA5);
+  out.push_back(seq);
+  out.push_back(channel);
+  out.push_back(command);
+  out.push_back(count);
+  out.insert(out.end(), payload.begin(), payload.end());
+}
+
+int main(int argc, char **argv)
+{
+  const double baud = argc > 1 ? atof(argv[1]) : 115200;
+  const int points = 100;
+  // the host's window (see link.ArduinoLink)
+  const size_t window = 4;
+
+  std::vector<std::vector<byte> > frames;
+  byte seq = 0;
+  // MAX_TABLE words stepping by 1: offset, table length, first word, step, number of words, repeats
+  frame(frames, seq++, 0, 15, 0, {0, 0, (byte) (MAX_TABLE >> 8), (byte) MAX_TABLE, 0x33, 0x33, 0x33, 0x33,
+                                  0, 0, 0, 1, (byte) (MAX_TABLE >> 8), (byte) MAX_TABLE, 1});
+  for (int channel = 0; channel < 4; channel++) {
+    std::vector<byte> ftws;
+    for (int i = 0; i < points; i++) {
+      unsigned long ftw = 858993459UL + 10737UL * i;
+      for (int shift = 24; shift >= 0; shift -= 8) {
+        ftws.push_back((byte) (ftw >> shift));
+      }
+    }
+    frame(frames, seq++, channel, 6, points, ftws);
+    frame(frames, seq++, channel, 2, 1, {0x10, 0x00});
+    frame(frames, seq++, channel, 4, 1, {0x02, 0x00});
+  }
+
+  setup();
+  // only the acknowledgements are counted, not the banner setup() sends
+  Serial.tx.clear();
+
+  std::vector<double> passes;
+  // the frame being sent, how much of it is on the line, and the frames started but not acknowledged
+  size_t next = 0, offset = 0, in_flight = 0, in_flight_bytes = 0, acknowledged = 0, total_bytes = 0;
+  bool started = false;
+  // time (s) at which the line can deliver the next byte, and of the last acknowledgement
+  double line_time = 0, last_ack = 0;
+  const int step_pin = 32;
+  auto start = std::chrono::steady_clock::now();
+  while (next < frames.size() || Serial.available() > 0 || Serial.tx.size() < 2 * (size_t) seq) {
+    double elapsed = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+    for (; acknowledged < Serial.tx.size() / 2; acknowledged++) {
+      in_flight -= 1;
+      in_flight_bytes -= frames[acknowledged].size();
+      last_ack = elapsed;
+    }
+    if (elapsed - last_ack > 1.0) {
+      // a frame lost some of its bytes and will never be acknowledged (the worker would resend it)
+      break;
+    }
+    // deliver the bytes that would have arrived by now (10 bits per byte), starting frames as the window allows
+    while (next < frames.size()) {
+      if (!started) {
+        if (in_flight > 0 && (in_flight >= window || in_flight_bytes + frames[next].size() > RX_CAPACITY)) {
+          break;
+        }
+        in_flight += 1;
+        in_flight_bytes += frames[next].size();
+        line_time = std::max(line_time, elapsed);
+        started = true;
+      }
+      if (line_time > elapsed) {
+        break;
+      }
+      Serial.receive(frames[next][offset++]);
+      total_bytes += 1;
+      line_time += 10 / baud;
+      if (offset == frames[next].size()) {
+        next += 1;
+        offset = 0;
+        started = false;
+      }
+    }
+    // toggle a step input every 50 passes
+    setPinLevel(step_pin, (passes.size() / 50) % 2);
+
+    auto before = std::chrono::steady_clock::now();
+    loop();
+    passes.push_back(std::chrono::duration<double, std::micro>(std::chrono::steady_clock::now() - before).count());
+  }
+
+  std::sort(passes.begin(), passes.end());
+  double total = 0;
+  for (double pass : passes) {
+    total += pass;
+  }
+  printf("upload of %zu bytes at %.0f baud: %zu passes of loop()\n", total_bytes, baud, passes.size());
+  printf("loop() time (us): mean %.3f, p99 %.3f, worst %.3f\n", total / passes.size(),
+         passes[(size_t) (0.99 * (passes.size() - 1))], passes.back());
+  printf("acknowledgements: %zu of %d, %lu bytes lost to a full UART buffer\n", Serial.tx.size() / 2, (int) seq,
+         Serial.rx_overflows);
+  printf("trigger to IOUpdate latency: %lu edges, worst %lu us\n", latency_count, latency_max);
+  for (int bucket = 0; bucket < LATENCY_BUCKETS; bucket++) {
+    if (latency_histogram[bucket] > 0) {
+      printf("  < %6lu us: %lu\n", 2UL << bucket, latency_histogram[bucket]);
+    }
+  }
+  return 0;
+}
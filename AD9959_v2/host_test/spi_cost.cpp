@@ -0,0 +1,99 @@
+/*
+	SPI traffic the firmware generates for the operations that matter during a shot.
+
+	The stub SPI library counts transactions and bytes. The bus time is estimated at the clock the driver
+	asks for (AD9959_SPI_CLOCK), limited to the fastest SPI clock of an Arduino Due.
+*/
+#include <algorithm>
+#include <stdio.h>
+
+#include "AD9959.ino"
+
+// fastest SPI clock of the Arduino Due: the 84 MHz master clock divided by 1
+const double BOARD_SPI_CLOCK = 84e6;
+
+static unsigned long start_transactions, start_bytes;
+
+static void begin()
+{
+  start_transactions = SPI.transactions;
+  start_bytes = SPI.bytes;
+}
+
+static void report(const char *what, int repeats)
+{
+  double transactions = (double) (SPI.transactions - start_transactions) / repeats;
+  double bytes = (double) (SPI.bytes - start_bytes) / repeats;
+  double clock = std::min((double) SPI.clock, BOARD_SPI_CLOCK);
+  printf("%-40s %6.2f transactions %7.2f bytes %8.3f us on the bus\n", what, transactions, bytes, bytes * 8 / clock * 1e6);
+}
+
+int main()
+{
+  const int points = 100;
+  unsigned long table[MAX_TABLE];
+  for (int i = 0; i < points; i++) {
+    table[i] = 858993459UL + 10737UL * i;
+  }
+
+  setup();
+  AD9959 &DDS = boards[0];
+
+  begin();
+  channel_list[0].setFTWList(points, table, DDS);
+  DDS.IOUpdate();
+  report("load a 100 point table", 1);
+
+  begin();
+  for (int i = 1; i < points; i++) {
+    channel_list[0].step(DDS);
+  }
+  report("step, same channel", points - 1);
+
+  for (int index = 0; index < 4; index++) {
+    channel_list[index].setFTWList(points, table, DDS);
+  }
+  DDS.IOUpdate();
+  begin();
+  for (int i = 1; i < points; i++) {
+    for (int index = 0; index < 4; index++) {
+      channel_list[index].step(DDS);
+    }
+  }
+  report("step, alternating channels", 4 * (points - 1));
+
+  // a table that holds the same frequency for several steps
+  for (int i = 0; i < points; i++) {
+    table[i] = 858993459UL + 10737UL * (i / 10);
+  }
+  channel_list[0].setFTWList(points, table, DDS);
+  DDS.IOUpdate();
+  begin();
+  for (int i = 1; i < points; i++) {
+    channel_list[0].step(DDS);
+  }
+  report("step, each frequency held for 10 steps", points - 1);
+
+  // two channels on one trigger line (command 16): both change in one transaction, with one IOUpdate
+  for (int i = 0; i < points; i++) {
+    table[i] = 858993459UL + 10737UL * i;
+  }
+  channel_list[1].setFTWList(points, table, DDS);
+  channel_list[2].setFTWList(points, table, DDS);
+  DDS.IOUpdate();
+  channel_list[1].group_mask = 1 << 2;
+  begin();
+  for (int i = 1; i < points; i++) {
+    channel_list[1].queueStep();
+    loop();
+  }
+  report("step of two channels sharing a trigger", points - 1);
+  channel_list[1].group_mask = 0;
+
+  begin();
+  channel_list[1].setPhase(0x1000, DDS);
+  channel_list[1].setAmplitude(512, DDS);
+  DDS.IOUpdate();
+  report("phase and amplitude of one channel", 1);
+  return 0;
+}
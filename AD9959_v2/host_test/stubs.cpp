@@ -0,0 +1,78 @@
+#include <chrono>
+#include "Arduino.h"
+#include "SPI.h"
+
+int pin_levels[NUM_PINS] = {0};
+static void (*rising_handlers[NUM_PINS])() = {0};
+SerialStub Serial;
+SPIStub SPI;
+
+static const std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+
+void pinMode(int, int) {}
+
+void digitalWrite(int pin, int level)
+{
+  pin_levels[pin] = level;
+}
+
+int digitalRead(int pin)
+{
+  return pin_levels[pin];
+}
+
+void delay(unsigned long) {}
+
+int digitalPinToInterrupt(int pin)
+{
+  return pin;
+}
+
+void attachInterrupt(int interrupt, void (*handler)(), int)
+{
+  rising_handlers[interrupt] = handler;
+}
+
+// the test program is single threaded, so the handlers never interrupt anything
+void noInterrupts() {}
+void interrupts() {}
+
+void setPinLevel(int pin, int level)
+{
+  bool rising = pin_levels[pin] == LOW && level == HIGH;
+  pin_levels[pin] = level;
+  if (rising && rising_handlers[pin]) {
+    rising_handlers[pin]();
+  }
+}
+
+unsigned long micros()
+{
+  return (unsigned long) std::chrono::duration_cast<std::chrono::microseconds>(
+    std::chrono::steady_clock::now() - start).count();
+}
+
+unsigned long millis()
+{
+  return micros() / 1000;
+}
+
+int SerialStub::read()
+{
+  if (rx.empty()) {
+    return -1;
+  }
+  byte b = rx.front();
+  rx.pop_front();
+  return b;
+}
+
+bool SerialStub::receive(byte b)
+{
+  if (rx.size() >= SERIAL_BUFFER_SIZE) {
+    rx_overflows += 1;
+    return false;
+  }
+  rx.push_back(b);
+  return true;
+}
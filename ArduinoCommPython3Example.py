@@ -1,17 +1,24 @@
 import serial
 import time
 
+def write_frame_start(seq=0):
+    """every command starts with the sync byte and a sequence number, which the arduino echoes back after ACK (0x06)"""
+    ser.write(int(0xA5).to_bytes(1, 'big'))
+    ser.write(seq.to_bytes(1, 'big'))
+
 def write_freq(freq_list, flag = 0):
     """
     write the frequency you choose into the arduino, which then writes it to the DDS
     Bytes have to be written sequentially (not all at once) because of the way aditya wrote the arduino code
-    The byte sequence is: 1 byte for the flag, 1 byte for the number of frequencies, and finally, 3*number of frequency bytes
+    The byte sequence is: the sync byte 0xA5, a sequence number, 1 byte for the flag, 1 byte for the command,
+    1 byte for the number of frequencies, and finally, 4*number of frequency bytes
     :param freq: in KHz
     :param num_freqs: number of frequencies to write, to be iterated when arduino voltage stepped
     :param flag: which output to change
     :return: void
     """
     command = 1
+    write_frame_start()
     ser.write(flag.to_bytes(1, 'big'))
     ser.write(command.to_bytes(1, 'big'))
     ser.write(len(freq_list).to_bytes(1, 'big'))
@@ -27,6 +34,7 @@ def write_phase(phase, flag = 0, num_elements=1):
     phase_int = int(phase / 360.0 * 2**14)
     command = 2
     print(phase_int)
+    write_frame_start()
     ser.write(flag.to_bytes(1, 'big'))
     ser.write(command.to_bytes(1, 'big'))
     ser.write(num_elements.to_bytes(1, 'big'))
@@ -37,6 +45,7 @@ def write_phase(phase, flag = 0, num_elements=1):
 
 def write_ramp(start, stop, delta_up, rate_up, delta_down, rate_down, flag = 0, num_elements=1):
     command = 3
+    write_frame_start()
     ser.write(flag.to_bytes(1, 'big'))
     ser.write(command.to_bytes(1, 'big'))
     ser.write(len([1]).to_bytes(1, 'big'))
@@ -0,0 +1,53 @@
+"""Helpers shared by the benchmark scripts in this folder.
+
+The device code uses relative imports (it is installed as
+user_devices.<lab>.AD9959ArduinoComm), so the modules are imported here as
+members of a package named after the repository folder.
+"""
+
+import importlib
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+
+
+def load(module_name):
+    """Import a module of this device as part of its package"""
+    parent = os.path.dirname(ROOT)
+    if parent not in sys.path:
+        sys.path.insert(0, parent)
+    return importlib.import_module('{}.{}'.format(PACKAGE, module_name))
+
+
+class FakeSerial:
+    """Stands in for serial.Serial and counts what the worker writes"""
+
+    def __init__(self, baud_rate=115200):
+        self.baudrate = baud_rate
+        self.write_calls = 0
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.write_calls += 1
+        self.bytes_written += len(data)
+        return len(data)
+
+    def wire_time(self):
+        """Time the written bytes take on the line (8N1: 10 bits per byte)"""
+        return self.bytes_written * 10 / self.baudrate
+
+    def close(self):
+        pass
+
+
+def timeit(function, repeats=200):
+    """Best-of-n wall clock time of function() in seconds"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
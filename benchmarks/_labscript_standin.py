@@ -0,0 +1,75 @@
+"""The few pieces of labscript that labscript_devices.py uses, for compile benchmarks.
+
+install() puts them in sys.modules as `labscript` and `labscript.labscript`,
+so the device classes can be imported and used without the labscript suite.
+Outputs only record their instructions, with none of the checks or
+pseudoclock processing labscript does, so the compile benchmarks time this
+device's own code.
+"""
+
+import sys
+import types
+
+
+def set_passed_properties(property_names=None):
+    def decorator(function):
+        return function
+    return decorator
+
+
+class Device:
+
+    def __init__(self, name, parent_device=None, connection=None, **kwargs):
+        self.name = name
+        self.parent_device = parent_device
+        self.connection = connection
+
+    def generate_code(self, hdf5_file):
+        hdf5_file.require_group('/devices/{}'.format(self.name))
+
+
+class IntermediateDevice(Device):
+    pass
+
+
+class Output(Device):
+
+    def __init__(self, name, parent_device, connection, default_value=0, **kwargs):
+        Device.__init__(self, name, parent_device, connection)
+        self.default_value = default_value
+        self.instructions = {}
+
+    def add_instruction(self, time, instruction):
+        self.instructions[time] = instruction
+
+
+class DigitalOut(Output):
+
+    def go_high(self, t):
+        self.add_instruction(t, 1)
+
+    def go_low(self, t):
+        self.add_instruction(t, 0)
+
+
+class AnalogOut(Output):
+
+    def constant(self, t, value):
+        self.add_instruction(t, value)
+
+
+class Trigger(DigitalOut):
+    pass
+
+
+def install():
+    """Make `import labscript` and `from labscript.labscript import ...` use this stand-in"""
+    package = types.ModuleType('labscript')
+    module = types.ModuleType('labscript.labscript')
+    for name in ['Device', 'IntermediateDevice', 'Output', 'DigitalOut', 'AnalogOut', 'Trigger',
+                 'set_passed_properties']:
+        setattr(package, name, globals()[name])
+        setattr(module, name, globals()[name])
+    package.labscript = module
+    sys.modules['labscript'] = package
+    sys.modules['labscript.labscript'] = module
@@ -0,0 +1,66 @@
+"""Size and upload time of frequency tables sent plainly versus compactly.
+
+Each sequence is encoded with 4 bytes per tuning word (split in chunks when it
+is longer than one command holds) and with protocol.encode_ftw_table, which
+switches to arithmetic progression runs when they are shorter. The upload goes
+through the acknowledged link to the firmware emulator with realtime=True at
+115200 baud, and the emulated table is checked against the original.
+"""
+
+import time
+
+import numpy as np
+
+from _common import load
+
+protocol = load('protocol')
+emulator = load('emulator')
+link = load('link')
+
+
+def sequences():
+    """Representative tables: (name, tuning words)"""
+    rng = np.random.default_rng(0)
+    scan = protocol.frequency_to_ftw(80e6 + 10e3 * np.arange(1000))
+    yield 'single frequency', protocol.frequency_to_ftw([80e6])
+    yield 'stepped scan, 100', scan[:100]
+    yield 'stepped scan, 1000', scan
+    yield 'scan, 5 shots/step', np.repeat(scan[:200], 5)
+    yield 'up and down, 2x250', np.concatenate([scan[:250], scan[249::-1]])
+    yield 'two-level toggle, 200', np.tile(scan[[0, 100]], 100)
+    yield 'random, 255', protocol.frequency_to_ftw(rng.uniform(70e6, 90e6, 255))
+
+
+def plain(ftw_list):
+    if len(ftw_list) <= protocol.MAX_FRAME_VALUES:
+        return [protocol.encode_ftw(0, ftw_list)]
+    return protocol.encode_ftw_chunks(0, ftw_list)
+
+
+def upload(commands):
+    device = emulator.FirmwareEmulator(realtime=True)
+    arduino = link.ArduinoLink(device)
+    start = time.perf_counter()
+    for command in commands:
+        arduino.send(command)
+    arduino.wait_all()
+    return time.perf_counter() - start, device.channels[0].ftw_list
+
+
+def main():
+    print('{:>22} {:>7} {:>9} {:>9} {:>7} {:>11} {:>11}'.format(
+        'sequence', 'points', 'plain (B)', 'auto (B)', 'ratio', 'plain (ms)', 'auto (ms)'))
+    for name, ftw_list in sequences():
+        plain_commands = plain(ftw_list)
+        auto_commands = protocol.encode_ftw_table(0, ftw_list)
+        plain_bytes = sum(map(len, plain_commands))
+        auto_bytes = sum(map(len, auto_commands))
+        plain_time, _ = upload(plain_commands)
+        auto_time, table = upload(auto_commands)
+        assert table == [int(word) for word in ftw_list]
+        print('{:>22} {:>7} {:>9} {:>9} {:>7.1f} {:>11.1f} {:>11.1f}'.format(
+            name, len(ftw_list), plain_bytes, auto_bytes, plain_bytes / auto_bytes, 1e3 * plain_time, 1e3 * auto_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Compile time of scan-heavy sequences, with stored baselines.
+
+Synthetic shots of 10^2 to 10^5 jump_frequency calls spread over the four
+channels are compiled against the labscript stand-in in _labscript_standin.py
+(labscript itself is not needed). For each size it reports, in ms:
+
+  jumps          the jump_frequency calls, including the triggers they make
+  bulk jumps     the same sequence with one jump_frequencies call per channel
+  trigger        AD9959ArduinoTriggerDigital.trigger_next_freq alone, same number of calls
+  check/coerce   check_frequency and coerce_frequency on every channel's list
+  generate_code  AD9959ArduinoComm.generate_code into an HDF5 file
+  hdf5 write     flushing and closing that file
+
+and the peak memory (MiB, from tracemalloc) of the jumps and generate_code.
+max_table_length is raised to the longest list, so sizes beyond what the
+arduino holds still compile.
+
+    python bench_compile.py            compare against baselines.json
+    python bench_compile.py --update   store the current results as the baselines
+
+Comparing exits with status 1 if any result is more than TOLERANCE times its
+baseline, plus SLACK_MS or SLACK_MIB as small results are noisy.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import h5py
+import numpy as np
+
+import _labscript_standin
+from _common import load
+
+_labscript_standin.install()
+labscript_devices = load('labscript_devices')
+
+SIZES = [100, 1000, 10000, 100000]
+CHANNELS = ['ch0', 'ch1', 'ch2', 'ch3']
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+TOLERANCE = 2.0
+SLACK_MS = 5.0
+SLACK_MIB = 1.0
+
+
+def build_device(jumps):
+    """The DDS with a digital trigger per channel, allowed to hold every jump"""
+    triggers = {name: labscript_devices.AD9959ArduinoTriggerDigital('trigger_' + name, None, 'port0/line{}'.format(n))
+                for n, name in enumerate(CHANNELS)}
+    return labscript_devices.AD9959ArduinoComm(
+        'dds', 'COM3', channel_mappings={name: name for name in CHANNELS}, trigger_mappings=triggers,
+        max_table_length=max(jumps // len(CHANNELS), 1))
+
+
+def scan(jumps, n):
+    """A stepped scan for channel n, 1 ms per step, with a few points out of range"""
+    frequencies = 80e6 + 1e6 * n + 1e3 * np.arange(jumps // len(CHANNELS))
+    frequencies[::97] = 500e6
+    return 1e-3 * np.arange(len(frequencies)), frequencies
+
+
+def jump_all(device, jumps):
+    for n, name in enumerate(CHANNELS):
+        times, frequencies = scan(jumps, n)
+        device.jump_frequency(0, name, frequencies[0], trigger=False)
+        for t, frequency in zip(times[1:], frequencies[1:]):
+            device.jump_frequency(t, name, frequency)
+
+
+def jump_all_bulk(device, jumps):
+    for n, name in enumerate(CHANNELS):
+        times, frequencies = scan(jumps, n)
+        device.jump_frequency(0, name, frequencies[0], trigger=False)
+        device.jump_frequencies(times[1:], name, frequencies[1:])
+
+
+def run(jumps, folder):
+    result = {}
+    device = build_device(jumps)
+    start = time.perf_counter()
+    jump_all(device, jumps)
+    result['jumps'] = time.perf_counter() - start
+
+    bulk_device = build_device(jumps)
+    start = time.perf_counter()
+    jump_all_bulk(bulk_device, jumps)
+    result['bulk jumps'] = time.perf_counter() - start
+    for name in CHANNELS:
+        assert np.array_equal(bulk_device.freq_dict[name].values, device.freq_dict[name].values)
+        assert bulk_device.trigger_mappings[name].instructions == device.trigger_mappings[name].instructions
+
+    trigger = labscript_devices.AD9959ArduinoTriggerDigital('trigger', None, 'port0/line7')
+    start = time.perf_counter()
+    for step in range(jumps):
+        trigger.trigger_next_freq(1e-3 * step)
+    result['trigger'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for freq_list in device.freq_dict.values():
+        if not device.check_frequency(freq_list):
+            device.coerce_frequency(freq_list)
+    result['check/coerce'] = time.perf_counter() - start
+
+    path = os.path.join(folder, 'shot_{}.h5'.format(jumps))
+    hdf5_file = h5py.File(path, 'w')
+    start = time.perf_counter()
+    device.generate_code(hdf5_file)
+    result['generate_code'] = time.perf_counter() - start
+    start = time.perf_counter()
+    hdf5_file.close()
+    result['hdf5 write'] = time.perf_counter() - start
+    os.remove(path)
+    return {key: 1e3 * value for key, value in result.items()}
+
+
+def peak_memory(jumps, folder):
+    """Peak traced memory in MiB of compiling a shot"""
+    tracemalloc.start()
+    device = build_device(jumps)
+    jump_all(device, jumps)
+    path = os.path.join(folder, 'memory.h5')
+    with h5py.File(path, 'w') as hdf5_file:
+        device.generate_code(hdf5_file)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    os.remove(path)
+    return peak / 2**20
+
+
+def measure():
+    results = {}
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+        for jumps in SIZES:
+            # best of three, as for the other benchmarks
+            runs = [run(jumps, folder) for _ in range(3)]
+            results[str(jumps)] = {key: min(r[key] for r in runs) for key in runs[0]}
+            results[str(jumps)]['peak memory'] = peak_memory(jumps, folder)
+    return results
+
+
+def regressions(results, baselines):
+    """Descriptions of the results that are worse than their baseline allows"""
+    found = []
+    for jumps, values in results.items():
+        for key, value in values.items():
+            baseline = baselines.get(jumps, {}).get(key)
+            if baseline is None:
+                continue
+            limit = TOLERANCE * baseline + (SLACK_MIB if key == 'peak memory' else SLACK_MS)
+            if value > limit:
+                found.append('{} jumps, {}: {:.2f} (baseline {:.2f})'.format(jumps, key, value, baseline))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--update', action='store_true', help='store the results as the new baselines')
+    args = parser.parse_args()
+
+    results = measure()
+    keys = list(next(iter(results.values())))
+    print('{:>7} '.format('jumps') + ' '.join('{:>14}'.format(key) for key in keys))
+    for jumps, values in results.items():
+        print('{:>7} '.format(jumps) + ' '.join('{:>14.2f}'.format(values[key]) for key in keys))
+
+    if args.update:
+        with open(BASELINES, 'w') as f:
+            rounded = {jumps: {key: round(value, 3) for key, value in values.items()} for jumps, values in results.items()}
+            json.dump({'compile': rounded}, f, indent=4, sort_keys=True)
+        print('Stored the baselines in {}'.format(BASELINES))
+        return
+    if not os.path.exists(BASELINES):
+        print('No baselines to compare with, store them with --update')
+        return
+    with open(BASELINES) as f:
+        found = regressions(results, json.load(f).get('compile', {}))
+    for line in found:
+        print('Regression: ' + line)
+    if found:
+        sys.exit(1)
+    print('Within {}x of the baselines'.format(TOLERANCE))
+
+
+if __name__ == '__main__':
+    main()
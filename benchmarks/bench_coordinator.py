@@ -0,0 +1,110 @@
+"""Shot setup time of several devices, one after the other and with coordinator.UploadCoordinator.
+
+Each device is a virtual arduino (emulator.EmulatedPort) on its own
+pseudo-terminal at 115200 baud, programmed with a new shot of 1000
+frequencies per channel and then with a shot in which one channel changed.
+Needs Linux and the labscript suite, like bench_worker.py.
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import h5py
+
+from bench_worker import CHANNELS, DEVICE_NAME, write_shot
+from _common import load
+
+protocol = load('protocol')
+emulator = load('emulator')
+coordinator = load('coordinator')
+blacs_workers = load('blacs_workers')
+
+POINTS = 1000
+
+
+def properties(port):
+    """The worker keyword arguments of a device on `port` (see blacs_tabs.initialise_workers)"""
+    return {
+        'com_port': port,
+        'baud_rate': protocol.DEFAULT_BAUD_RATE,
+        'max_baud_rate': None,
+        # opening the emulator's port does not reset it, so there is no banner to wait for
+        'auto_reset': False,
+        'banner_timeout': 2.0,
+        'calibrate_link': False,
+        'channels': CHANNELS,
+        'boards': [DEVICE_NAME],
+        'channel_mappings': {name: name for name in CHANNELS},
+        'div_32': False,
+        'default_values': {name: 80e6 for name in CHANNELS},
+    }
+
+
+def write_shots(folder, devices):
+    """A new shot and one with a channel changed, each with the same tables for every device"""
+    paths = []
+    for name, shift in [('new.h5', 0.0), ('changed.h5', 10e3)]:
+        path = os.path.join(folder, name)
+        write_shot(path, POINTS, shift)
+        # the shot file has one group per device
+        with h5py.File(path, 'r+') as hdf5_file:
+            for device_name in devices[1:]:
+                hdf5_file.copy('devices/{}'.format(DEVICE_NAME), 'devices/{}'.format(device_name))
+            if devices[0] != DEVICE_NAME:
+                hdf5_file.move('devices/{}'.format(DEVICE_NAME), 'devices/{}'.format(devices[0]))
+        paths.append((name, path, shift == 0.0))
+    return paths
+
+
+def sequential(ports, folder, devices):
+    workers = {name: blacs_workers.AD9959ArduinoCommWorker.in_process(**properties(port)) for name, port in zip(devices, ports)}
+    for worker in workers.values():
+        worker.init()
+    results = []
+    for name, path, fresh in write_shots(folder, devices):
+        start = time.perf_counter()
+        for device_name, worker in workers.items():
+            worker.transition_to_buffered(device_name, path, {}, fresh)
+        results.append((name, time.perf_counter() - start))
+        for worker in workers.values():
+            worker.transition_to_manual()
+    for worker in workers.values():
+        worker.shutdown()
+    return results
+
+
+def coordinated(ports, folder, devices):
+    upload = coordinator.UploadCoordinator()
+    for name, port in zip(devices, ports):
+        upload.add(name, blacs_workers.AD9959ArduinoCommWorker.in_process(**properties(port)))
+    results = []
+    for name, path, fresh in write_shots(folder, devices):
+        start = time.perf_counter()
+        upload.transition_to_buffered(path, fresh=fresh)
+        results.append((name, time.perf_counter() - start, max(upload.upload_times.values())))
+        upload.transition_to_manual()
+    upload.shutdown()
+    return results
+
+
+def main():
+    print('{:>8} {:>12} {:>17} {:>17} {:>22}'.format('devices', 'shot', 'sequential (ms)', 'coordinated (ms)',
+                                                      'slowest device (ms)'))
+    for count in [1, 2, 3]:
+        devices = ['{}{}'.format(DEVICE_NAME, n) for n in range(count)]
+        with contextlib.ExitStack() as stack:
+            ports = [stack.enter_context(emulator.EmulatedPort()).port for _ in devices]
+            folder = stack.enter_context(tempfile.TemporaryDirectory())
+            with contextlib.redirect_stdout(io.StringIO()):
+                one_by_one = sequential(ports, folder, devices)
+                together = coordinated(ports, folder, devices)
+        for (name, sequential_time), (_, coordinated_time, slowest) in zip(one_by_one, together):
+            print('{:>8} {:>12} {:>17.1f} {:>17.1f} {:>22.1f}'.format(
+                count, name, 1e3 * sequential_time, 1e3 * coordinated_time, 1e3 * slowest))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Compare per-byte serial writes with the single-buffer command encoder.
+
+Run from anywhere with ``python benchmarks/bench_encoder.py``. For each table
+length it reports the number of write calls, the bytes sent, the host time
+spent producing the writes and the time the bytes take on a 115200 baud line.
+"""
+
+import numpy as np
+
+from _common import FakeSerial, load, timeit
+
+protocol = load('protocol')
+
+
+def legacy_set_frequency(connection, channel, freq_list):
+    """The original implementation: one write per byte"""
+    connection.write(channel.to_bytes(1, 'big'))
+    connection.write(protocol.COMMANDS['freq'].to_bytes(1, 'big'))
+    connection.write(len(freq_list).to_bytes(1, 'big'))
+    for freq in freq_list:
+        for by in int(freq).to_bytes(4, 'big'):
+            connection.write(by.to_bytes(1, 'big'))
+
+
+def encode_frequency(channel, freq_list):
+    """The first single-buffer encoder, of the frequencies in Hz the original command took
+
+    The arduino now takes tuning words (see protocol.encode_ftw), so this is only kept as the
+    reference the per-byte writes are compared with.
+
+    Args:
+        channel (int): The channel to set
+        freq_list ([int list]): the frequencies, already scaled, as integers in Hz
+
+    Returns:
+        bytes: header followed by 4 bytes per frequency
+    """
+    words = np.asarray(freq_list, dtype=np.float64).astype('>u4')
+    return protocol.encode_header(channel, 'freq', len(words)) + words.tobytes()
+
+
+def encoded_set_frequency(connection, channel, freq_list):
+    connection.write(encode_frequency(channel, freq_list))
+
+
+def main():
+    print('{:>6} {:>10} {:>8} {:>8} {:>12} {:>12}'.format(
+        'points', 'method', 'calls', 'bytes', 'host (us)', 'wire (ms)'))
+    for points in [1, 10, 100, 255]:
+        freq_list = [80e6 + 1e3 * n for n in range(points)]
+        for name, method in [('per-byte', legacy_set_frequency), ('encoded', encoded_set_frequency)]:
+            connection = FakeSerial()
+            method(connection, 1, freq_list)
+            calls, nbytes, wire = connection.write_calls, connection.bytes_written, connection.wire_time()
+            host = timeit(lambda: method(FakeSerial(), 1, freq_list))
+            print('{:>6} {:>10} {:>8} {:>8} {:>12.1f} {:>12.2f}'.format(
+                points, name, calls, nbytes, host * 1e6, wire * 1e3))
+
+
+if __name__ == '__main__':
+    main()
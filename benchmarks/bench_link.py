@@ -0,0 +1,59 @@
+"""Upload time of a full shot with fixed sleeps versus acknowledged streaming.
+
+Uses the firmware emulator with realtime=True, so bytes take as long as they
+would on the serial line. For the fixed-sleep upload, "host done" is when the
+worker would have moved on, and "device done" is when the arduino would really
+have applied the last command; the acknowledged upload finishes exactly when
+the device does.
+"""
+
+import time
+
+from _common import load
+
+protocol = load('protocol')
+emulator = load('emulator')
+link = load('link')
+
+
+def shot_commands(points):
+    commands = []
+    for channel in range(4):
+        ftws = protocol.frequency_to_ftw([80e6 + 1e3 * n for n in range(points)])
+        commands += [protocol.encode_ftw(channel, ftws), protocol.encode_phase(channel, 4096),
+                     protocol.encode_amplitude(channel, 512)]
+    return commands
+
+
+def upload_with_sleeps(device, commands):
+    start = time.perf_counter()
+    for seq, command in enumerate(commands):
+        device.write(protocol.encode_frame(seq % 256, command))
+        time.sleep(1e-4)
+    host_done = time.perf_counter() - start
+    return host_done, max(device._line_free - start, host_done)
+
+
+def upload_acknowledged(device, commands):
+    start = time.perf_counter()
+    arduino = link.ArduinoLink(device)
+    for command in commands:
+        arduino.send(command)
+    arduino.wait_all()
+    done = time.perf_counter() - start
+    return done, done
+
+
+def main():
+    print('{:>6} {:>14} {:>14} {:>16}'.format('points', 'method', 'host done (ms)', 'device done (ms)'))
+    for points in [1, 10, 50, 100]:
+        commands = shot_commands(points)
+        for name, upload in [('fixed sleeps', upload_with_sleeps), ('acknowledged', upload_acknowledged)]:
+            device = emulator.FirmwareEmulator(realtime=True)
+            host_done, device_done = upload(device, commands)
+            assert device.frames_received == len(commands)
+            print('{:>6} {:>14} {:>14.2f} {:>16.2f}'.format(points, name, 1e3 * host_done, 1e3 * device_done))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Latency and throughput of the BLACS worker against the virtual arduino.
+
+The worker opens emulator.EmulatedPort like the arduino's serial port, so
+everything from encoding a command to reading its acknowledgement runs as it
+does in BLACS, with the bytes taking as long as they would on the line at the
+baud rate in use. Needs Linux (for the pseudo-terminal) and the labscript
+suite, which the worker imports; the arduino itself is not needed.
+
+Measured:
+  init                     opening the port up to the default frequencies being set
+  startup                  init of a worker started with the arduino (which announces itself with its banner), and
+                           of workers restarted while it keeps running (auto_reset=False), with and without
+                           calibrating the link
+  transition_to_buffered   a new shot, the same shot again (smart programming) and a shot with one channel changed
+  restart                  a new worker (BLACS restarted) reading what the arduino holds: bytes init sends when the
+                           default frequencies are already output, and bytes of the same shot again after init
+  manual commands          round trip of single acknowledged commands, and commands per second back to back
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from _common import load
+
+protocol = load('protocol')
+emulator = load('emulator')
+blacs_workers = load('blacs_workers')
+
+DEVICE_NAME = 'dds'
+CHANNELS = ['ch0', 'ch1', 'ch2', 'ch3']
+
+
+def make_worker(port, max_baud_rate=None, auto_reset=False, calibrate_link=False):
+    """A worker set up as BLACS would, without starting a worker process
+
+    Opening the emulator's port does not reset it (see resetting), so by default the worker does not wait
+    for the banner of a reset arduino.
+    """
+    # the keyword arguments the tab creates the worker with (see blacs_tabs.initialise_workers)
+    return blacs_workers.AD9959ArduinoCommWorker.in_process(
+        com_port=port,
+        baud_rate=protocol.DEFAULT_BAUD_RATE,
+        max_baud_rate=max_baud_rate,
+        auto_reset=auto_reset,
+        banner_timeout=2.0,
+        calibrate_link=calibrate_link,
+        channels=CHANNELS,
+        boards=[DEVICE_NAME],
+        channel_mappings={name: name for name in CHANNELS},
+        div_32=False,
+        default_values={name: 80e6 for name in CHANNELS},
+    )
+
+
+def write_shot(path, points, shift=0.0):
+    """A shot file in which each channel steps through `points` frequencies"""
+    rows = []
+    ftw_lists = []
+    for channel in range(4):
+        start = 80e6 + 1e6 * channel + (shift if channel == 0 else 0.0)
+        ftw_lists.append(protocol.frequency_to_ftw(start + 1e3 * np.arange(points)))
+        rows.append((channel, channel * points, points, 0.0, 1.0, 0, channel))
+    with h5py.File(path, 'w') as hdf5_file:
+        group = hdf5_file.require_group('devices/{}'.format(DEVICE_NAME))
+        group.create_dataset('channel_table', data=np.array(rows, dtype=protocol.CHANNEL_TABLE_DTYPE))
+        group.create_dataset('frequency_table', data=np.concatenate(ftw_lists))
+        group.create_dataset('sweep_table', data=np.empty(0, dtype=protocol.SWEEP_TABLE_DTYPE))
+
+
+def timed(function, *args):
+    """Wall clock time of function(*args) in seconds, with what it prints discarded"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - start
+
+
+def bench_init(max_baud_rate):
+    with emulator.EmulatedPort() as port:
+        worker = make_worker(port.port, max_baud_rate)
+        elapsed = timed(worker.init)
+        worker.shutdown()
+    return elapsed
+
+
+def resetting(worker, port):
+    """worker.open_port, followed by the reset of the arduino that opening its port causes"""
+    def open_port():
+        connection = type(worker).open_port(worker)
+        # a pseudo-terminal has no DTR line, so the emulator is reset explicitly (without a bootloader delay)
+        port.reset()
+        return connection
+    return open_port
+
+
+def bench_startup():
+    """init of the first worker, then of workers restarted on the running arduino"""
+    results = []
+    with emulator.EmulatedPort() as port:
+        for name, auto_reset, calibrate_link in [('first start', True, False),
+                                                 ('restart', False, False),
+                                                 ('restart, calibrate_link=True', False, True)]:
+            worker = make_worker(port.port, auto_reset=auto_reset, calibrate_link=calibrate_link)
+            if auto_reset:
+                worker.open_port = resetting(worker, port)
+            elapsed = timed(worker.init)
+            results.append((name, elapsed, worker.startup_time))
+            worker.shutdown()
+    return results
+
+
+def bench_transitions(worker, folder, points):
+    paths = [os.path.join(folder, name) for name in ('shot.h5', 'changed.h5')]
+    write_shot(paths[0], points)
+    write_shot(paths[1], points, shift=10e3)
+    results = []
+    for name, path, fresh in [('new', paths[0], True), ('same again', paths[0], False),
+                              ('one channel changed', paths[1], False)]:
+        elapsed = timed(worker.transition_to_buffered, DEVICE_NAME, path, {}, fresh)
+        results.append((name, elapsed, worker.telemetry))
+        timed(worker.transition_to_manual)
+    return results
+
+
+def restart(port, worker):
+    """A new worker on the same arduino, with the bytes its init sent"""
+    worker.shutdown()
+    worker = make_worker(port)
+    timed(worker.init)
+    return worker, worker.link.bytes_sent
+
+
+def bench_restart(port, folder, points):
+    """Bytes sent by workers started while the arduino holds the defaults, then after it ran a shot"""
+    path = os.path.join(folder, 'shot.h5')
+    write_shot(path, points)
+    worker = make_worker(port)
+    timed(worker.init)
+    first_init = worker.link.bytes_sent
+    worker, idle_init = restart(port, worker)
+    timed(worker.transition_to_buffered, DEVICE_NAME, path, {}, True)
+    timed(worker.transition_to_manual)
+    # init puts the default frequencies back, but the phases, amplitudes and groups stay programmed
+    worker, shot_init = restart(port, worker)
+    timed(worker.transition_to_buffered, DEVICE_NAME, path, {}, False)
+    telemetry = worker.telemetry
+    timed(worker.transition_to_manual)
+    worker.shutdown()
+    return first_init, idle_init, shot_init, telemetry
+
+
+def bench_manual(worker, repeats=50):
+    commands = [
+        ('set_frequency', lambda n: worker.set_frequency(0, [80e6 + n])),
+        ('set_phase', lambda n: worker.set_phase(0, n % 360)),
+        ('set_amplitude', lambda n: worker.set_amplitude(0, 0.5 + 0.001 * n)),
+        ('set_frequencies', lambda n: worker.set_frequencies({channel: 80e6 + n for channel in range(4)})),
+    ]
+    results = []
+    for name, command in commands:
+        round_trips = []
+        for n in range(repeats):
+            round_trips.append(timed(lambda: (command(n), worker.link.wait_all())))
+        # back to back: each call waits for its acknowledgement, as for the tab, except set_frequencies whose
+        # commands are only limited by the window of unacknowledged frames
+        elapsed = timed(lambda: ([command(n) for n in range(repeats)], worker.link.wait_all()))
+        results.append((name, np.median(round_trips), np.max(round_trips), repeats / elapsed))
+    return results
+
+
+def main():
+    print('init')
+    for max_baud_rate in [None, 2000000]:
+        print('  {:>24}: {:8.1f} ms'.format('max_baud_rate={}'.format(max_baud_rate),
+                                           1e3 * bench_init(max_baud_rate)))
+
+    print('startup')
+    for name, elapsed, startup_time in bench_startup():
+        print('  {:>30}: {:8.1f} ms (startup_time {:.1f} ms)'.format(name, 1e3 * elapsed, 1e3 * startup_time))
+
+    for max_baud_rate in [None, 2000000]:
+        with emulator.EmulatedPort() as port, tempfile.TemporaryDirectory() as folder:
+            worker = make_worker(port.port, max_baud_rate)
+            timed(worker.init)
+            print('at {} baud'.format(worker.baud_rate))
+            print('  transition_to_buffered {:>22} {:>10} {:>11} {:>11} {:>11} {:>11} {:>7}'.format(
+                'shot', 'total (ms)', 'hdf5 (ms)', 'encode (ms)', 'write (ms)', 'ack (ms)', 'bytes'))
+            for points in [1, 100, 1000]:
+                for name, elapsed, telemetry in bench_transitions(worker, folder, points):
+                    print('  {:>22} {:>22} {:>10.1f} {:>11.2f} {:>11.2f} {:>11.2f} {:>11.2f} {:>7}'.format(
+                        '{} points'.format(points), name, 1e3 * elapsed, 1e3 * telemetry['hdf5_read'],
+                        1e3 * telemetry['encode'], 1e3 * telemetry['serial_write'], 1e3 * telemetry['acknowledge'],
+                        telemetry['bytes_sent']))
+            print('  {:>22} {:>22} {:>10} {:>11}'.format('manual command', 'median (ms)', 'max (ms)', 'per second'))
+            for name, median, worst, rate in bench_manual(worker):
+                print('  {:>22} {:>22.2f} {:>10.2f} {:>11.0f}'.format(name, 1e3 * median, 1e3 * worst, rate))
+            statistics = worker.get_telemetry()
+            print('  over {} shots: total p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms'.format(
+                statistics['shots'], *(1e3 * statistics['total'][key] for key in ('p50', 'p90', 'p99'))))
+            writes = [write for write in port.device.register_writes if write.register != 'IOUPDATE']
+            print('  {} register writes, {} IOUpdates'.format(
+                len(writes), len(port.device.register_writes) - len(writes)))
+            worker.shutdown()
+
+    print('restart (bytes sent)')
+    with emulator.EmulatedPort() as port, tempfile.TemporaryDirectory() as folder:
+        first_init, idle_init, shot_init, telemetry = bench_restart(port.port, folder, 1000)
+        print('  {:>40}: {:7}'.format('init, first start', first_init))
+        print('  {:>40}: {:7}'.format('init, defaults already output', idle_init))
+        print('  {:>40}: {:7}'.format('init, after a 1000 point shot', shot_init))
+        print('  {:>40}: {:7}'.format('the same shot again', telemetry['bytes_sent']))
+
+
+if __name__ == '__main__':
+    main()
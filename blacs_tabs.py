@@ -18,6 +18,8 @@ from qtutils.qt.QtGui import *
 from qtutils.qt.QtWidgets import *
 from PyQt5.QtWidgets import QComboBox, QGridLayout, QLineEdit
 
+from .protocol import channel_index
+
 class AD9959ArduinoCommTab(DeviceTab):
     def initialise_GUI ( self ):
         """Initializes the GUI tab for the arduino/dds communication
@@ -33,8 +35,14 @@ class AD9959ArduinoCommTab(DeviceTab):
         
         self.com_port = device.properties['com_port']
         self.baud_rate = device.properties['baud_rate']
+        self.max_baud_rate = device.properties.get('max_baud_rate')
+        self.auto_reset = device.properties.get('auto_reset', True)
+        self.banner_timeout = device.properties.get('banner_timeout', 2.0)
+        self.calibrate_link = device.properties.get('calibrate_link', False)
         self.channels = device.properties['channels']
         self.channel_mappings = device.properties['channel_mappings']
+        # connection tables compiled before boards could be given have a single board
+        self.boards = device.properties.get('boards') or [self.device_name]
         self.div_32 = device.properties['div_32']
         self.default_values = device.properties['default_values']
 
@@ -146,6 +154,11 @@ class AD9959ArduinoCommTab(DeviceTab):
 
             layout.addLayout(cur_row)
 
+        # how long programming the last shots took (see AD9959ArduinoCommWorker.get_telemetry)
+        self.telemetry_label = QLabel()
+        self.telemetry_label.setText("No shots programmed yet")
+        layout.addWidget(self.telemetry_label)
+
         # we add the buttons to a button group so that we can determine which button was pressed
         self.freq_btn_grp = QButtonGroup()
         self.freq_btn_grp.setExclusive(True)
@@ -182,7 +195,7 @@ class AD9959ArduinoCommTab(DeviceTab):
         channel_name = btn.text().split(" ")[-1]
 
         # get the number of the channel from the name of the channel
-        channel_number = int(self.channel_mappings[channel_name][-1])
+        channel_number = channel_index(self.channel_mappings[channel_name])
         
         # try to get the float value from the textbox, check to see if the contents are a float, then set the DDS channel
         try:
@@ -211,7 +224,7 @@ class AD9959ArduinoCommTab(DeviceTab):
         channel_name = btn.text().split(" ")[-1]
 
         # get the number of the channel from the name of the channel
-        channel_number = int(self.channel_mappings[channel_name][-1])
+        channel_number = channel_index(self.channel_mappings[channel_name])
 
         # try to get the float value from the textbox, check to see if the contents are a float, then set the DDS channel
         try:
@@ -236,7 +249,7 @@ class AD9959ArduinoCommTab(DeviceTab):
         channel_name = btn.text().split(" ")[-1]
 
         # get the number of the channel from the name of the channel
-        channel_number = int(self.channel_mappings[channel_name][-1])
+        channel_number = channel_index(self.channel_mappings[channel_name])
 
         # try to get the float value from the textbox, check to see if the contents are a float, then set the DDS channel
         try:
@@ -266,7 +279,7 @@ class AD9959ArduinoCommTab(DeviceTab):
         # try to get the value from the textbox, check to see if the contents are a numbers, then set the DDS. 
         # We must first convert from string to float, then to int, in order to allow inputs like 10e6
         try:
-            channel_number = int(self.channel_mappings[channel_name][-1])
+            channel_number = channel_index(self.channel_mappings[channel_name])
             ramp_start = int(float(self.ramp_start_textbox.text()))
             ramp_stop = int(float(self.ramp_stop_textbox.text()))
             ramp_time_up = float(self.ramp_time_up_textbox.text())
@@ -279,6 +292,27 @@ class AD9959ArduinoCommTab(DeviceTab):
 
         return
 
+    @define_state(MODE_MANUAL, True, True)
+    def update_telemetry(self):
+        """Show the rolling statistics of how long the worker took to program the last shots"""
+        statistics = yield(self.queue_work(self.primary_worker, 'get_telemetry'))
+        if statistics is None:
+            self.telemetry_label.setText("Worker not started")
+            return
+        lines = ["Worker started in {:.1f} ms".format(1e3 * statistics['startup'])]
+        if statistics['shots'] == 0:
+            self.telemetry_label.setText("\n".join(lines))
+            return
+
+        lines.append("Last {} shots (last / median / 90% / 99%)".format(statistics['shots']))
+        for name in ['total', 'hdf5_read', 'encode', 'serial_write', 'acknowledge']:
+            lines.append("{}: {:.1f} / {:.1f} / {:.1f} / {:.1f} ms".format(
+                name, *[1e3 * statistics[name][key] for key in ('last', 'p50', 'p90', 'p99')]))
+        for name in ['bytes_sent', 'channels_skipped', 'max_step_latency_us']:
+            lines.append("{}: {:.0f} / {:.0f} / {:.0f} / {:.0f}".format(
+                name, *[statistics[name][key] for key in ('last', 'p50', 'p90', 'p99')]))
+        self.telemetry_label.setText("\n".join(lines))
+
         
 
 
@@ -293,7 +327,12 @@ class AD9959ArduinoCommTab(DeviceTab):
             {
                 'com_port': self.com_port,
                 'baud_rate': self.baud_rate,
+                'max_baud_rate': self.max_baud_rate,
+                'auto_reset': self.auto_reset,
+                'banner_timeout': self.banner_timeout,
+                'calibrate_link': self.calibrate_link,
                 'channels': self.channels,
+                'boards': self.boards,
                 'channel_mappings': self.channel_mappings,
                 'div_32': self.div_32,
                 'default_values': self.default_values
@@ -301,3 +340,6 @@ class AD9959ArduinoCommTab(DeviceTab):
         )
         self.primary_worker = 'main_worker'
 
+        # refresh the telemetry every 5 s (it only changes between shots)
+        self.statemachine_timeout_add(5000, self.update_telemetry)
+
@@ -9,7 +9,7 @@
 #                                                                   #
 #####################################################################
 
-from collections import defaultdict
+from collections import defaultdict, deque
 import time
 
 import labscript_utils.h5_lock  # Must be imported before importing h5py.
@@ -20,9 +20,47 @@ from labscript.labscript import set_passed_properties
 
 from blacs.tab_base_classes import Worker
 
+from .link import ArduinoLink
+from .protocol import (CHANNEL_TABLE_DTYPE, CHANNELS_PER_BOARD, MODE_PROFILE, MODE_SWEEP, MODE_TABLE, SWEEP_TABLE_DTYPE, WORD_UNSET,
+                       amplitude_to_word, channel_index, channel_name, decode_capacity, decode_digests, decode_latency, encode_capacity_query,
+                       encode_digest_query, encode_latency_query, encode_ftw_table, encode_group, encode_phase,
+                       encode_profiles, encode_amplitude, encode_ramp, encode_rewind, encode_sweep, encode_update,
+                       frequency_to_ftw, group_mask, phase_to_word, table_crc)
+
+# number of shots the rolling telemetry statistics (see get_telemetry) are taken over
+TELEMETRY_HISTORY = 100
+# the keyword arguments the BLACS tab creates the worker with (see blacs_tabs.initialise_workers)
+WORKER_PROPERTIES = ['com_port', 'baud_rate', 'max_baud_rate', 'auto_reset', 'banner_timeout', 'calibrate_link',
+                     'channels', 'boards', 'channel_mappings', 'div_32', 'default_values']
 
 class AD9959ArduinoCommWorker(Worker):
 
+    @classmethod
+    def in_process(cls, **properties):
+        """A worker that runs in the calling process, for code that drives the arduino without BLACS
+
+        BLACS runs each worker in a process of its own, which sets the keyword arguments the tab creates it
+        with as attributes before calling init. This sets up the worker the same way without starting a
+        process (Worker.__init__ is not called); init then opens the port.
+
+        Args:
+            properties: the keyword arguments the BLACS tab creates the worker with (WORKER_PROPERTIES)
+
+        Raises:
+            Exception: if any of them is missing, or an unknown one is given
+
+        Returns:
+            AD9959ArduinoCommWorker: the worker, not yet initialised
+        """
+        missing = [name for name in WORKER_PROPERTIES if name not in properties]
+        unknown = [name for name in properties if name not in WORKER_PROPERTIES]
+        if missing or unknown:
+            raise Exception("A worker needs the properties {}: {} missing, {} unknown".format(
+                ', '.join(WORKER_PROPERTIES), ', '.join(missing) or 'none', ', '.join(unknown) or 'none'))
+        worker = cls.__new__(cls)
+        worker.__dict__.update(properties)
+        return worker
+
     def init (self):
         # Once off device initialisation code called when the
         # worker process is first started .
@@ -32,74 +70,267 @@ class AD9959ArduinoCommWorker(Worker):
 
         global serial; import serial
 
-        # mappings between commands sent to arduino and their meaning
-        self.command_dict = {"freq":1, "phase":2, 'ramp':3, 'amplitude':4}
-        
+        start = time.perf_counter()
+        # set before anything that can fail, so that the tab can ask for the telemetry of a worker that did not
+        # start: how long init took (None until it has finished), and the telemetry of the last shots, newest last
+        # (see transition_to_manual)
+        self.startup_time = None
+        self.telemetry_history = deque(maxlen=TELEMETRY_HISTORY)
+        self.telemetry = None
         # start up the serial connection
-        self.connection = serial.Serial(self.com_port, baudrate=self.baud_rate, timeout=0.1)
+        self.connection = self.open_port()
+        # every command is acknowledged by the arduino once it has been applied
+        self.link = ArduinoLink(self.connection)
+
+        # what each (channel, 'freq'/'phase'/'amplitude'/'group') was last programmed with, in the form the
+        # arduino reports it (see read_device_state), used to skip re-uploading tables that did not change
+        # between shots. Read from the arduino once it answers, so that what it kept survives a BLACS restart.
+        self.programmed_digests = {}
 
         # system clock period in Hz: 20 MHz clock + 20x frequency double = 400 MHz clock 
         # the extra factor of 4 accounts for the fact that 4 bytes need to be transferred (I think)
         # see https://www.analog.com/media/en/technical-documentation/data-sheets/ad9959.pdf page 25
         self.sys_clock = 1/(400e6 / 4)
         
-        time.sleep(0.3)
-        # implement default values
+        # opening the port resets the arduino unless auto_reset is off: wait for the firmware to announce it has
+        # started rather than pinging into the bootloader. Without a reset (or with firmware that sends no banner)
+        # the arduino is already running and answers a ping straight away.
+        ready = self.link.wait_banner(self.banner_timeout) if self.auto_reset else None
+        if ready is None:
+            ready = self.link.wait_ready()
+        # the number of tuning words each channel can hold depends on the board the firmware was built for,
+        # and on the number of AD9959 boards it drives. The bytes it buffers bound the frames kept in flight.
+        self.table_capacity, firmware_boards, self.link.rx_capacity = decode_capacity(
+            self.link.query(encode_capacity_query()))
+        if len(self.boards) > firmware_boards:
+            raise Exception("The connection table has {} AD9959 boards, but the arduino firmware was built for {} "
+                            "(NUM_BOARDS in Channel.h)".format(len(self.boards), firmware_boards))
+        # if the arduino was not reset (e.g. BLACS restarted), it still holds the last shot's tables
+        self.programmed_digests = self.read_device_state()
+
+        # go as fast as both ends allow, then measure what the link actually achieves
+        if self.max_baud_rate:
+            self.baud_rate = self.link.negotiate_baud(self.max_baud_rate)
+        if self.calibrate_link:
+            self.link_bytes_per_second, self.link_round_trip = self.link.calibrate()
+            print("Serial link at {} baud: {:.0f} bytes/s, {:.2f} ms round trip".format(
+                self.baud_rate, self.link_bytes_per_second, 1e3 * self.link_round_trip))
+        else:
+            self.link_bytes_per_second, self.link_round_trip = None, None
+        # implement default values, all in one command, leaving out those the arduino already outputs
+        defaults = {}
         for key in self.default_values:
-            channel = self.channel_mappings[key]
-            channel_int = int(channel[-1])
-            frequency = self.default_values[key]
-            freq_list = [frequency]
-            print("Setting Default {}: {:2.3E}".format(key, frequency))
-            # program it into the arduino
-            self.set_frequency(channel_int, freq_list)
+            print("Setting Default {}: {:2.3E}".format(key, self.default_values[key]))
+            defaults[channel_index(self.channel_mappings[key])] = self.default_values[key]
+        self.set_frequencies(defaults, skip_unchanged=True)
+        self.link.wait_all()
+        self.startup_time = time.perf_counter() - start
+        print("Started in {:.1f} ms (arduino ready after {:.1f} ms)".format(1e3 * self.startup_time, 1e3 * ready))
+
+    def open_port(self):
+        """Open the serial port, without resetting the arduino if auto_reset is off
+
+        Opening a port asserts DTR, which resets most arduinos into their bootloader. Keeping DTR low
+        from the start avoids that where the operating system and the USB serial chip allow it.
+
+        Returns:
+            serial.Serial: the open port
+        """
+        connection = serial.Serial(None, baudrate=self.baud_rate, timeout=0.1)
+        connection.port = self.com_port
+        if not self.auto_reset:
+            connection.dtr = False
+        connection.open()
+        return connection
             
     
-    def set_frequency(self, channel, freq_list):
-        """Command the arduino to set the frequency of the specified DDS channel
+    def send_command(self, channel, kind, state, encode, skip_unchanged=False):
+        """Write an encoded command to the arduino and remember what the channel holds
+
+        Args:
+            channel (int): The channel the command is for
+            kind (str): 'freq', 'phase', 'amplitude' or 'group'
+            state: what the channel holds once the command is applied, as read_device_state reports it
+            encode (callable): returns the encoded command, or a list of them to send one after the other.
+            Only called if the command is sent.
+            skip_unchanged (bool, optional): don't send the command if the channel already holds `state`.
+            Defaults to False.
+
+        Returns:
+            bool: whether or not the command was sent
+        """
+        if skip_unchanged and self.programmed_digests.get((channel, kind)) == state:
+            return False
+        command = encode()
+        for command in command if isinstance(command, list) else [command]:
+            self.link.send(command)
+        self.programmed_digests[(channel, kind)] = state
+        return True
+
+    def read_device_state(self):
+        """Ask the arduino what each channel holds
+
+        Returns:
+            dict: (channel, kind) -> state, as send_command records them. Channels in sweep mode have no
+            'freq' entry, and phases and amplitudes not set since the arduino started have none either.
+        """
+        digests = []
+        for board in range(len(self.boards)):
+            digests += decode_digests(self.link.query(encode_digest_query(board)))
+        state = {}
+        for channel, digest in enumerate(digests):
+            if digest['mode'] != MODE_SWEEP:
+                state[(channel, 'freq')] = (digest['mode'], digest['crc'], digest['length'])
+            if digest['phase_word'] != WORD_UNSET:
+                state[(channel, 'phase')] = digest['phase_word']
+            if digest['amplitude_word'] != WORD_UNSET:
+                state[(channel, 'amplitude')] = digest['amplitude_word']
+            state[(channel, 'group')] = digest['group_mask']
+        return state
+
+    def verify_device_state(self):
+        """Check that the arduino holds everything sent to it since it was last queried
+
+        Raises:
+            Exception: listing the channels whose tables, phases, amplitudes or groups differ
+        """
+        device_state = self.read_device_state()
+        differing = ['{} {}'.format(channel_name(channel), kind)
+                     for (channel, kind), state in sorted(self.programmed_digests.items())
+                     if device_state.get((channel, kind)) != state]
+        if differing:
+            # whatever the arduino holds, it is not what we think: send everything again next time
+            self.programmed_digests = device_state
+            raise Exception("The arduino does not hold what was uploaded: {}".format(', '.join(differing)))
+
+    def set_frequency(self, channel, freq_list, skip_unchanged=False):
+        """Command the arduino to set the frequency of the specified DDS channel, and wait until it has
 
         Args:
             channel (int): The channel to set
             freq_list ([int list]): The list of frequencies to set in Hz
-            
+            skip_unchanged (bool, optional): see send_command. Defaults to False.
+
+        Returns:
+            bool: whether or not the list was sent
         """
+        sent = self.set_tuning_words(channel, self.frequency_to_ftw(freq_list), skip_unchanged)
+        self.link.wait_all()
+        return sent
+
+    def frequency_to_ftw(self, freq_list):
+        """The tuning words the DDS needs to output the given frequencies (in Hz)"""
         # div_32 bool: for the MOT and Repump locks, the AD4007 divides the actual frequency by 32
+        freq_list = np.asarray(freq_list, dtype=float)
         if self.div_32:
-            freq_list = [n / 32.0 for n in freq_list]
-        # number of frequencies to write
-        self.connection.write(channel.to_bytes(1, 'big'))
-        self.connection.write(self.command_dict['freq'].to_bytes(1, 'big'))
-        self.connection.write(len(freq_list).to_bytes(1, 'big'))
-        
-        # convert each frequency into a byte array 4 bytes long, then send each 
-        # sequentially. 
-        for freq in freq_list:
-            freq = int(freq) 
-            byte_array = freq.to_bytes(4, 'big')
-            for by in byte_array:
-                self.connection.write(by.to_bytes(1, 'big'))
-
-    def set_phase(self, channel, phase):
+            freq_list = freq_list / 32.0
+        return frequency_to_ftw(freq_list)
+
+    def set_frequencies(self, frequencies, phases=None, amplitudes=None, skip_unchanged=False):
+        """Change several channels at the same moment
+
+        Everything goes to the arduino in one command, which it applies with a single IOUpdate,
+        so e.g. the MOT and repump frequencies change together.
+
+        Args:
+            frequencies (dict): channel -> frequency in Hz
+            phases (dict, optional): channel -> phase in degrees. Defaults to None.
+            amplitudes (dict, optional): channel -> amplitude between 0 and 1. Defaults to None.
+            skip_unchanged (bool, optional): leave out frequencies the channels already output.
+                Defaults to False.
+        """
+        phases = phases or {}
+        amplitudes = amplitudes or {}
+        if skip_unchanged:
+            frequencies = {channel: frequency for channel, frequency in frequencies.items()
+                           if self.programmed_digests.get((channel, 'freq')) !=
+                           (MODE_TABLE, table_crc(self.frequency_to_ftw([frequency])), 1)}
+        channels = sorted(set(frequencies) | set(phases) | set(amplitudes))
+        if not channels:
+            return
+        entries = []
+        for channel in channels:
+            ftw = int(self.frequency_to_ftw([frequencies[channel]])[0]) if channel in frequencies else None
+            phase_word = phase_to_word(phases[channel]) if channel in phases else None
+            amplitude_word = amplitude_to_word(amplitudes[channel]) if channel in amplitudes else None
+            entries.append((channel, ftw, phase_word, amplitude_word))
+            # the channel now holds what the equivalent single channel commands would have left it with
+            if ftw is not None:
+                self.programmed_digests[(channel, 'freq')] = (MODE_TABLE, table_crc([ftw]), 1)
+            if phase_word is not None:
+                self.programmed_digests[(channel, 'phase')] = phase_word
+            if amplitude_word is not None:
+                self.programmed_digests[(channel, 'amplitude')] = amplitude_word
+        self.link.send(encode_update(entries))
+
+    def set_tuning_words(self, channel, ftw_list, skip_unchanged=False):
+        """Command the arduino to step through a list of frequency tuning words on a DDS channel
+
+        Args:
+            channel (int): The channel to set
+            ftw_list (np.ndarray): uint32 frequency tuning words, as compiled by AD9959ArduinoComm
+            skip_unchanged (bool, optional): see send_command. Defaults to False.
+
+        Raises:
+            Exception: if the list is longer than the arduino's table
+
+        Returns:
+            bool: whether or not the list was sent
+        """
+        if len(ftw_list) > self.table_capacity:
+            raise Exception("{} has {} frequencies, but the arduino can only hold {}".format(
+                channel_name(channel), len(ftw_list), self.table_capacity))
+        # whichever of the plain (4 bytes per word, in chunks for long tables) and the compact encoding
+        # (arithmetic progressions, e.g. a stepped scan) is shorter
+        return self.send_command(channel, 'freq', (MODE_TABLE, table_crc(ftw_list), len(ftw_list)),
+                                 lambda: encode_ftw_table(channel, ftw_list), skip_unchanged)
+
+    def set_profiles(self, channel, ftw_list, skip_unchanged=False):
+        """Command the arduino to put a DDS channel in profile pin modulation
+
+        Args:
+            channel (int): The channel to set
+            ftw_list (np.ndarray): the uint32 tuning words output while the channel's profile pin is low and high
+            skip_unchanged (bool, optional): see send_command. Defaults to False.
+
+        Returns:
+            bool: whether or not the tuning words were sent
+        """
+        # the arduino outputs the first word while the pin is low and the last one while it is high
+        state = (MODE_PROFILE, table_crc([ftw_list[0], ftw_list[-1]]), 2)
+        return self.send_command(channel, 'freq', state, lambda: encode_profiles(channel, ftw_list), skip_unchanged)
+
+    def rewind(self, channel, wait=True):
+        """Command the arduino to go back to the first frequency of the list already loaded on a channel
+
+        Args:
+            channel (int): The channel to rewind
+            wait (bool, optional): return only once the arduino has applied the command, so that a lost frame
+            raises here rather than in a later command. Defaults to True.
+        """
+        self.link.send(encode_rewind(channel))
+        if wait:
+            self.link.wait_all()
+
+    def set_phase(self, channel, phase, skip_unchanged=False, wait=True):
         """Command the arduino to set the phase of the specified DDS channel
 
         Args:
             channel (int): The channel to set
             phase (int): The phase (in degrees) to send to the DDS
+            skip_unchanged (bool, optional): see send_command. Defaults to False.
+            wait (bool, optional): see rewind. Defaults to True.
+
+        Returns:
+            bool: whether or not the phase was sent
         """
 
         # The Phase register is 14 bits long in the DDS, so convert a degree into bits to send to arduino
-        phase_int = int((phase%360) / 360.0 * 2**14)
-        num_phases = 1
-        # number of frequencies to write
-        self.connection.write(channel.to_bytes(1, 'big'))
-        self.connection.write(self.command_dict['phase'].to_bytes(1, 'big'))
-        self.connection.write(num_phases.to_bytes(1, 'big'))
-
-        # convert each into a byte array 2 bytes long, then send each 
-        # sequentially.
-        byte_array = phase_int.to_bytes(2, 'big')
-        for by in byte_array:
-            self.connection.write(by.to_bytes(1, 'big'))
+        phase_int = phase_to_word(phase)
+        sent = self.send_command(channel, 'phase', phase_int, lambda: encode_phase(channel, phase_int), skip_unchanged)
+        if wait:
+            self.link.wait_all()
+        return sent
 
     def set_ramp(self, channel, ramp_start, ramp_stop, ramp_time_up, ramp_time_down, clock_cycles_per_increment=1):
         """Tell the AD9959 to ramp
@@ -143,38 +374,47 @@ class AD9959ArduinoCommWorker(Worker):
         ramp_rate_up = int(ramp_rate_up)
         ramp_rate_down = int(ramp_rate_down)
 
-        self.connection.write(channel.to_bytes(1, 'big'))
-        self.connection.write(self.command_dict['ramp'].to_bytes(1, 'big'))
-        self.connection.write(int(0).to_bytes(1, 'big'))
+        self.link.send(encode_ramp(channel, ramp_start, ramp_stop, ramp_rate_up, clock_cycles_per_increment,
+                                   ramp_rate_down, clock_cycles_per_increment))
+        # the sweep leaves the channel in a different state from any table we have sent
+        for kind in ['freq', 'phase', 'amplitude']:
+            self.programmed_digests.pop((channel, kind), None)
+        self.link.wait_all()
+
+    def arm_sweep(self, channel, start_ftw, stop_ftw, delta, rate):
+        """Load a linear frequency sweep that the channel's next trigger starts
 
-        self.connection.write(ramp_start.to_bytes(4, 'big'))
-        self.connection.write(ramp_stop.to_bytes(4, 'big'))
-        self.connection.write(ramp_rate_up.to_bytes(4, 'big'))
-        self.connection.write(clock_cycles_per_increment.to_bytes(4, 'big'))
-        self.connection.write(ramp_rate_down.to_bytes(4, 'big'))
-        self.connection.write(clock_cycles_per_increment.to_bytes(4, 'big'))
+        Args:
+            channel (int): the channel to sweep
+            start_ftw (int): tuning word output until the trigger
+            stop_ftw (int): tuning word held once the sweep is over
+            delta (int): tuning word step, see protocol.sweep_parameters
+            rate (int): sync clock cycles between steps
+        """
+        self.link.send(encode_sweep(channel, start_ftw, stop_ftw, int(delta), int(rate)))
+        # the channel no longer holds the table we last sent it, which has to be sent again to leave sweep mode
+        self.programmed_digests.pop((channel, 'freq'), None)
 
-    def set_amplitude(self, channel, amplitude):
+    def set_amplitude(self, channel, amplitude, skip_unchanged=False, wait=True):
         """Command the arduino to set the phase of the specified DDS channel
 
         Args:
             channel (int): The channel to set
             phase (double): The amplitude (between 0 and 1) to set. The maximimal value in bits for the amplitude is 1024
+            skip_unchanged (bool, optional): see send_command. Defaults to False.
+            wait (bool, optional): see rewind. Defaults to True.
+
+        Returns:
+            bool: whether or not the amplitude was sent
         """
 
         # The Phase register is 14 bits long in the DDS, so convert a degree into bits to send to arduino
-        amp_int = int(amplitude*1023)
-
-        self.connection.write(channel.to_bytes(1, 'big'))
-        self.connection.write(self.command_dict['amplitude'].to_bytes(1, 'big'))
-        # write only one amplitude
-        self.connection.write(int(1).to_bytes(1, 'big'))
-
-        # convert each into a byte array 2 bytes long, then send each 
-        # sequentially.
-        byte_array = amp_int.to_bytes(2, 'big')
-        for by in byte_array:
-            self.connection.write(by.to_bytes(1, 'big'))
+        amp_int = amplitude_to_word(amplitude)
+        sent = self.send_command(channel, 'amplitude', amp_int, lambda: encode_amplitude(channel, amp_int),
+                                 skip_unchanged)
+        if wait:
+            self.link.wait_all()
+        return sent
 
 
     def shutdown ( self ):
@@ -190,6 +430,31 @@ class AD9959ArduinoCommWorker(Worker):
         # return a dictionary of coerced / quantised values for each
         # channel , keyed by the channel name (or an empty dictionary )
         return {}
+    def read_device_table(self, h5_file_path, device_name):
+        """Read the compiled tables of this device into memory
+
+        Args:
+            h5_file_path (str): the shot file
+            device_name (str): the name of this device in the shot file
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray): the channel table (see CHANNEL_TABLE_DTYPE), the flat
+            uint32 frequency table it indexes into and the sweep table (see SWEEP_TABLE_DTYPE)
+        """
+        tables = {
+            'channel_table': np.empty(0, dtype=CHANNEL_TABLE_DTYPE),
+            'frequency_table': np.empty(0, dtype=np.uint32),
+            'sweep_table': np.empty(0, dtype=SWEEP_TABLE_DTYPE),
+        }
+        with h5py.File(h5_file_path, 'r') as hdf5_file:
+            group = hdf5_file['devices'][device_name]
+            # the whole device is stored in three datasets (see AD9959ArduinoComm.generate_code)
+            for name, table in tables.items():
+                if name in group and group[name].shape[0] > 0:
+                    tables[name] = np.empty(group[name].shape, dtype=table.dtype)
+                    group[name].read_direct(tables[name])
+        return tables['channel_table'], tables['frequency_table'], tables['sweep_table']
+
     def transition_to_buffered ( self , device_name , h5_file_path,
     initial_values , fresh ):
         # Access the HDF5 file specified and program the table of
@@ -209,54 +474,150 @@ class AD9959ArduinoCommWorker(Worker):
         # maintain output continuity when we return to manual mode
         # after the shot completes .
 
-        # self.h5_filepath = h5_file
-        # self.device_name = device_name
-
-        # From the H5 sequence file, get the sequence we want programmed into the arduino
-        with h5py.File(h5_file_path, 'r') as hdf5_file:
-            
-            devices = hdf5_file['devices'][device_name]
-
-            for channel in devices.keys():
-                print("Setting Frequency for {}".format(channel))
-
-                if "frequency" in channel:
-                    # extract the integer part of the name
-                    channel_int = int(channel[-1])
-                    freq_list = list(devices[channel])
-                    print(list(freq_list))
-                    # program it into the arduino
-                    self.set_frequency(channel_int, freq_list)
-
-                if "phase" in channel:
-                    print("Setting Phase for {}".format(channel))
-                    channel_int = int(channel[-1])
-                    # unpack the list
-                    phase = devices[channel][0]
-                    print("Phase {} deg".format(phase))
-                    self.set_phase(channel_int, phase)
-
-                if "amplitude" in channel:
-                    print("Setting Amplitude for {}".format(channel))
-                    channel_int = int(channel[-1])
-                    # unpack the list
-                    amplitude = devices[channel][0]
-                    print("Amplitude {} fraction (0-1)".format(amplitude))
-                    self.set_amplitude(channel_int, amplitude)
-
-                # give the arduino time to implement the changes
-                time.sleep(1e-4)
+        self.h5_file_path = h5_file_path
+        self.device_name = device_name
+
+        # From the H5 sequence file, get the sequence we want programmed into the arduino.
+        # The file (and with it the h5_lock shared with the other BLACS workers) is only held
+        # while the tables are read into memory; the serial upload happens after it is closed.
+        start_time = time.perf_counter()
+        channel_table, frequency_table, sweep_table = self.read_device_table(h5_file_path, device_name)
+        read_time = time.perf_counter()
+        bytes_sent, write_time, wait_time = self.link.bytes_sent, self.link.write_time, self.link.wait_time
+        channels_skipped = 0
+
+        # Unless a fresh program is requested, only the tables that differ from what the
+        # arduino already holds are sent (smart programming).
+        skip_unchanged = not fresh
+
+        # channels sharing a trigger line are stepped by the arduino on the edges at their leader's step pin
+        followers = defaultdict(list)
+        for row in channel_table:
+            followers[int(row['leader'])].append(int(row['channel']))
+        for channel_int in range(CHANNELS_PER_BOARD * len(self.boards)):
+            self.send_command(channel_int, 'group', group_mask(channel_int, followers[channel_int]),
+                              lambda: encode_group(channel_int, followers[channel_int]), skip_unchanged)
+
+        for row in channel_table:
+            channel_int = int(row['channel'])
+
+            # tuning words are computed at compile time, so they can be sent as they are
+            ftw_list = frequency_table[row['offset']:row['offset'] + row['length']]
+            # program it into the arduino
+            if row['profile']:
+                # the profile pin selects between the two words, there is nothing to rewind
+                sent = self.set_profiles(channel_int, ftw_list, skip_unchanged)
+            else:
+                sent = self.set_tuning_words(channel_int, ftw_list, skip_unchanged)
+            if not sent and not row['profile']:
+                # the table is already loaded, but the last shot stepped through it
+                self.rewind(channel_int, wait=False)
+
+            # the commands of the whole shot stream out, and are waited for at the end
+            sent = self.set_phase(channel_int, row['phase'], skip_unchanged, wait=False) or sent
+            sent = self.set_amplitude(channel_int, row['amplitude'], skip_unchanged, wait=False) or sent
+
+            if sent:
+                print("Programmed {}".format(channel_name(channel_int)))
+            else:
+                channels_skipped += 1
+
+        # sweeps go last, as loading a table takes the channel out of sweep mode
+        for row in sweep_table:
+            self.arm_sweep(int(row['channel']), row['start'], row['stop'], row['delta'], row['rate'])
+            print("Armed a {:.3f} ms sweep on {}".format(1e3 * row['duration'], channel_name(int(row['channel']))))
+        # the arduino acknowledges each command once it has been applied
+        self.link.wait_all()
+        if fresh:
+            # a fresh program is also when we make sure the arduino agrees with what we think it holds
+            self.verify_device_state()
+        upload_time = time.perf_counter()
+
+        # Where the time went, in seconds: holding the shot file lock, preparing the commands (everything
+        # on the host except the serial port), writing them and waiting for the arduino to acknowledge them.
+        # Saved in the shot file by transition_to_manual.
+        serial_write = self.link.write_time - write_time
+        acknowledge = self.link.wait_time - wait_time
+        self.telemetry = {
+            'hdf5_read': read_time - start_time,
+            'encode': upload_time - read_time - serial_write - acknowledge,
+            'serial_write': serial_write,
+            'acknowledge': acknowledge,
+            'upload': upload_time - read_time,
+            'total': time.perf_counter() - start_time,
+            'bytes_sent': self.link.bytes_sent - bytes_sent,
+            'channels_programmed': len(channel_table) - channels_skipped,
+            'channels_skipped': channels_skipped,
+        }
+        print("Shot file locked for {:.2f} ms, upload took {:.2f} ms ({} bytes)".format(
+            1e3 * self.telemetry['hdf5_read'], 1e3 * self.telemetry['upload'], self.telemetry['bytes_sent']))
 
         final_values = {}
         return final_values
 
 
+    def get_step_latency(self):
+        """Read (and clear) the arduino's record of how long it took from each trigger edge to the IOUpdate applying it
+
+        Returns:
+            dict: see protocol.decode_latency
+        """
+        return decode_latency(self.link.query(encode_latency_query()))
+
     def transition_to_manual ( self ):
         # Called when the shot has finished , the device should
         # be placed back into manual mode
         # return True on success
+
+        # report how quickly the triggers of this shot were applied
+        self.step_latency = self.get_step_latency()
+        if self.step_latency['count'] > 0:
+            print("{} steps, worst trigger to IOUpdate latency {} us, {} edges dropped".format(
+                self.step_latency['count'], self.step_latency['max_us'], self.step_latency['dropped']))
+
+        if self.telemetry is not None:
+            self.telemetry.update({
+                'steps': self.step_latency['count'],
+                'max_step_latency_us': self.step_latency['max_us'],
+                'edges_dropped': self.step_latency['dropped'],
+            })
+            self.save_telemetry(self.h5_file_path, self.device_name, self.telemetry)
+            self.telemetry_history.append(self.telemetry)
+            self.telemetry = None
         return True
 
+    def save_telemetry(self, h5_file_path, device_name, telemetry):
+        """Store the telemetry of a shot as attributes of a 'telemetry' group under the device's group
+
+        Args:
+            h5_file_path (str): the shot file
+            device_name (str): the name of this device in the shot file
+            telemetry (dict): name -> value, times in seconds
+        """
+        with h5py.File(h5_file_path, 'r+') as hdf5_file:
+            group = hdf5_file['devices'][device_name].require_group('telemetry')
+            for name, value in telemetry.items():
+                group.attrs[name] = value
+
+    def get_telemetry(self):
+        """Rolling statistics of the telemetry of the last shots (at most TELEMETRY_HISTORY), for the BLACS tab
+
+        Returns:
+            dict: 'startup' -> seconds init took, 'shots' -> number of shots the statistics are taken over,
+            and for each telemetry name a dict with the 'last' value and the 'p50', 'p90' and 'p99' percentiles.
+            None if init has not finished (or failed).
+        """
+        if getattr(self, 'startup_time', None) is None:
+            return None
+        statistics = {'startup': self.startup_time, 'shots': len(self.telemetry_history)}
+        if not self.telemetry_history:
+            return statistics
+        for name in self.telemetry_history[-1]:
+            values = np.array([telemetry.get(name, np.nan) for telemetry in self.telemetry_history], dtype=float)
+            p50, p90, p99 = np.nanpercentile(values, [50, 90, 99])
+            statistics[name] = {'last': values[-1], 'p50': p50, 'p90': p90, 'p99': p99}
+        return statistics
+
     def abort_transition_to_buffered ( self ):
         # Called only if transition_to_buffered succeeded and the
         # shot if aborted prior to the initial trigger
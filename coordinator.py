@@ -0,0 +1,157 @@
+#####################################################################
+#                                                                   #
+# Copyright 2019, Monash University and contributors                #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+
+"""Programming several arduino DDS devices from one process at once.
+
+Each device's upload is limited by its own serial line and by its arduino
+acknowledging frames, so programming devices one after the other takes the
+sum of their upload times. UploadCoordinator runs the transitions of every
+device in a thread of its own, so a shot is ready after roughly the slowest
+single upload.
+
+Every device keeps its own serial port (opened once, when it is added), its
+own window of unacknowledged frames (see link.ArduinoLink) and a lock, so a
+slow arduino only holds back its own port and commands sent to a device
+from another thread wait for its upload to finish.
+
+In BLACS each device has a worker process of its own, which BLACS already
+transitions in parallel; the coordinator is for code that drives several
+devices itself, such as a script or a single worker owning several boxes.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+class UploadCoordinator:
+    """Runs the transitions of several devices in parallel, one thread per serial port"""
+
+    def __init__(self, max_threads=None):
+        """
+        Args:
+            max_threads (int, optional): most devices programmed at once. Defaults to None (all of them).
+        """
+        self.max_threads = max_threads
+        # device name -> worker, in the order the devices were added
+        self.workers = {}
+        # device name -> lock held while its port is in use
+        self.locks = {}
+        # device name -> seconds its last transition_to_buffered took
+        self.upload_times = {}
+        self._executor = None
+
+    def add(self, device_name, worker):
+        """Open a device's serial port and initialise it (see AD9959ArduinoCommWorker.init)
+
+        Args:
+            device_name (str): the name of the device in the shot files
+            worker (AD9959ArduinoCommWorker): the device's worker, e.g. from AD9959ArduinoCommWorker.in_process
+
+        Raises:
+            Exception: if the device or its serial port has been added already
+        """
+        if device_name in self.workers:
+            raise Exception("{} has been added to the coordinator already".format(device_name))
+        for name, other in self.workers.items():
+            if other.com_port == worker.com_port:
+                raise Exception("{} and {} are both on {}, but a serial port can only be opened once".format(
+                    name, device_name, worker.com_port))
+        worker.init()
+        self.workers[device_name] = worker
+        self.locks[device_name] = threading.Lock()
+        # the next run needs a thread more: replace the pool rather than leave its threads behind
+        self._shutdown_executor()
+
+    def _shutdown_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _run(self, function):
+        """Call function(device_name, worker) for every device, each in a thread and holding its lock
+
+        Returns:
+            dict: device name -> what function returned
+
+        Raises:
+            Exception: the first device's exception, once all of them have finished
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_threads or max(len(self.workers), 1),
+                                                thread_name_prefix='upload')
+
+        def locked(device_name, worker):
+            with self.locks[device_name]:
+                return function(device_name, worker)
+
+        futures = {name: self._executor.submit(locked, name, worker) for name, worker in self.workers.items()}
+        # wait for every device, so that none is still busy when the caller handles an error
+        errors = [future.exception() for future in futures.values()]
+        for error in errors:
+            if error is not None:
+                raise error
+        return {name: future.result() for name, future in futures.items()}
+
+    def transition_to_buffered(self, h5_file_path, initial_values=None, fresh=False):
+        """Program every device for a shot, all at once, and return once all of them are ready
+
+        Args:
+            h5_file_path (str): the shot file
+            initial_values (dict, optional): device name -> front panel values. Defaults to None.
+            fresh (bool, optional): see AD9959ArduinoCommWorker.transition_to_buffered. Defaults to False.
+
+        Returns:
+            dict: device name -> its final values
+        """
+        if not self.workers:
+            return {}
+        initial_values = initial_values or {}
+        start = time.perf_counter()
+
+        def upload(device_name, worker):
+            device_start = time.perf_counter()
+            final_values = worker.transition_to_buffered(device_name, h5_file_path,
+                                                         initial_values.get(device_name, {}), fresh)
+            self.upload_times[device_name] = time.perf_counter() - device_start
+            return final_values
+
+        final_values = self._run(upload)
+        slowest = max(self.upload_times, key=self.upload_times.get)
+        print("{} devices ready in {:.2f} ms (slowest {}: {:.2f} ms)".format(
+            len(self.workers), 1e3 * (time.perf_counter() - start), slowest, 1e3 * self.upload_times[slowest]))
+        return final_values
+
+    def transition_to_manual(self):
+        """Return every device to manual mode
+
+        Returns:
+            bool: True if all of them succeeded
+        """
+        return all(self._run(lambda device_name, worker: worker.transition_to_manual()).values())
+
+    def call(self, device_name, method, *args):
+        """Call a method of one device's worker (e.g. set_frequency) once its port is free
+
+        Returns:
+            what the method returned
+        """
+        with self.locks[device_name]:
+            return getattr(self.workers[device_name], method)(*args)
+
+    def shutdown(self):
+        """Close every device's serial port"""
+        self._shutdown_executor()
+        for device_name, worker in self.workers.items():
+            with self.locks[device_name]:
+                worker.shutdown()
+        self.workers = {}
+        self.locks = {}
@@ -0,0 +1,447 @@
+#####################################################################
+#                                                                   #
+# Copyright 2019, Monash University and contributors                #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+
+"""Host-side model of the arduino firmware (AD9959_v2/AD9959/AD9959.ino).
+
+FirmwareEmulator behaves like the serial port the worker talks to: bytes
+written to it are parsed into frames the same way the firmware does, the
+resulting channel state is kept in Python, and acknowledgements can be read
+back. With realtime=True the bytes take as long as they would on a serial
+line at the configured baud rate, so upload times can be benchmarked without
+hardware. The values each frame leaves in the AD9959's registers are recorded
+with the time the frame finished arriving.
+
+EmulatedPort serves an emulator on a pseudo-terminal (Linux), so that code
+which opens a serial port by name, such as the BLACS worker, can run against it
+unchanged.
+"""
+
+from collections import deque, namedtuple
+import os
+import select
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .protocol import (ACK, BAUD_PROBATION, CHANNELS_PER_BOARD, COMMANDS, DATA, DIGEST, MAX_PAYLOAD, NAK, READY_BANNER, RUN, LATENCY_BUCKETS, DEFAULT_BAUD_RATE, DEFAULT_TABLE_CAPACITY, FTW_RESOLUTION, SWEEP, SYNC, SYS_CLOCK,
+                       MODE_PROFILE, MODE_SWEEP, MODE_TABLE, UPDATE_AMPLITUDE, UPDATE_ENTRY, UPDATE_FTW, UPDATE_PHASE, WORD_UNSET,
+                       payload_length, table_crc)
+
+# 8 data bits plus start and stop bits
+BITS_PER_BYTE = 10
+
+# A register of one channel taking a new value: the frequency tuning word (CFTW0), phase offset word (CPOW0),
+# amplitude scale factor (ACR) or the second tuning word of profile pin modulation and sweeps (CW1). IOUpdates,
+# which make the written values take effect, are recorded with register 'IOUPDATE' and channel None.
+RegisterWrite = namedtuple('RegisterWrite', ['time', 'channel', 'register', 'value'])
+
+# commands the firmware answers without touching the DDS
+NO_IO_UPDATE = {COMMANDS['ping'], COMMANDS['baud'], COMMANDS['latency'], COMMANDS['capacity'], COMMANDS['group'],
+                COMMANDS['digest']}
+
+
+class EmulatedChannel:
+    """State the firmware keeps for one DDS channel"""
+
+    def __init__(self):
+        self.ftw_list = [0]
+        self.counter = 0
+        self.phase_word = 0
+        self.amplitude_word = 512
+        self.ramp = None
+        # (low, high) tuning words selected by the profile pin, if the channel is in profile pin modulation
+        self.profiles = None
+        # (start, stop) tuning words of a linear sweep the next trigger starts
+        self.sweep = None
+        # other channels this channel's trigger steps as well (bit k for channel k)
+        self.group_mask = 0
+        # what sets the frequency (MODE_TABLE, MODE_PROFILE or MODE_SWEEP), and which of 'phase' and
+        # 'amplitude' have been set since power up, as reported in the digest
+        self.mode = MODE_TABLE
+        self.words_set = set()
+
+    def load(self, ftw_list):
+        """What Channel::setFTWList does: a new list, which also ends profile pin modulation and sweeps"""
+        self.ftw_list = list(ftw_list)
+        self.counter = 0
+        self.profiles = None
+        self.sweep = None
+        self.mode = MODE_TABLE
+
+    def digest(self):
+        """What Channel::writeDigest reports, packed as protocol.DIGEST"""
+        ftw_list = self.ftw_list if self.mode != MODE_PROFILE else list(self.profiles)
+        return DIGEST.pack(self.mode, table_crc(ftw_list), len(ftw_list),
+                           self.phase_word if 'phase' in self.words_set else WORD_UNSET,
+                           self.amplitude_word if 'amplitude' in self.words_set else WORD_UNSET, self.group_mask)
+
+    @property
+    def ftw(self):
+        """The tuning word currently output"""
+        return self.ftw_list[self.counter]
+
+    def registers(self):
+        """The values of the registers this channel's state sets, keyed by register name"""
+        values = {'CFTW0': self.ftw, 'CPOW0': self.phase_word, 'ACR': self.amplitude_word}
+        if self.profiles is not None:
+            values['CW1'] = self.profiles[1]
+        elif self.sweep is not None:
+            values['CW1'] = self.sweep[1]
+        return values
+
+    def step(self):
+        """What Channel::step does on a trigger"""
+        if self.sweep is not None:
+            # the DDS sweeps by itself and holds the end of the sweep
+            self.ftw_list = [self.sweep[1]]
+            self.counter = 0
+            self.sweep = None
+            return
+        if self.counter < len(self.ftw_list) - 1:
+            self.counter += 1
+
+
+class FirmwareEmulator:
+    """Stands in for the serial port connected to the arduino"""
+
+    def __init__(self, baud_rate=DEFAULT_BAUD_RATE, realtime=False, timeout=0.1, max_baud_rate=2000000,
+                 table_capacity=DEFAULT_TABLE_CAPACITY, boards=1, rx_capacity=128 + 256):
+        """
+        Args:
+            baud_rate (int, optional): modelled line rate. Defaults to DEFAULT_BAUD_RATE.
+            realtime (bool, optional): delay acknowledgements by the time the bytes take on the line. Defaults to False.
+            timeout (float, optional): read timeout in seconds, as for serial.Serial. Defaults to 0.1.
+            max_baud_rate (int, optional): fastest rate at which the modelled link is reliable. Defaults to 2000000.
+            table_capacity (int, optional): tuning words per channel table (MAX_TABLE). Defaults to DEFAULT_TABLE_CAPACITY.
+            boards (int, optional): AD9959 boards the firmware drives (NUM_BOARDS). Defaults to 1.
+            rx_capacity (int, optional): bytes the firmware reports it buffers (RX_CAPACITY). Defaults to that
+                of a Due.
+        """
+        # the rate the host has configured; bytes are only understood if it matches device_baud_rate
+        self.baudrate = baud_rate
+        self.device_baud_rate = baud_rate
+        self.max_baud_rate = max_baud_rate
+        self.table_capacity = table_capacity
+        # time after which the firmware gives up on a new baud rate, if one was just requested
+        self._probation_until = None
+        self.realtime = realtime
+        self.timeout = timeout
+        self.boards = boards
+        self.rx_capacity = rx_capacity
+        self.channels = [EmulatedChannel() for _ in range(CHANNELS_PER_BOARD * boards)]
+        self.frames_received = 0
+        self.bytes_received = 0
+        # trigger to IOUpdate latencies (us) of the steps applied since the last latency query
+        self.latencies = []
+        # every RegisterWrite so far, in order
+        self.register_writes = []
+        # what each channel's registers were last set to, so that only changes are recorded
+        self._registers = [channel.registers() for channel in self.channels]
+        # bytes not yet parsed into a frame
+        self._pending = bytearray()
+        # (time the bytes are readable by the host, bytes), starting with what setup() sends once it has finished
+        self._replies = deque([(0.0, READY_BANNER)])
+        # time at which the modelled line has finished sending everything written so far
+        self._line_free = 0.0
+
+    def reset(self, boot_time=0.0):
+        """What opening the port does to an arduino that resets on DTR: every channel back to its power up
+        state, the baud rate back to the default, and the banner once the bootloader and setup() have run
+
+        Args:
+            boot_time (float, optional): seconds until the banner is sent. Defaults to 0.0.
+        """
+        self.device_baud_rate = DEFAULT_BAUD_RATE
+        self._probation_until = None
+        self.channels = [EmulatedChannel() for _ in range(CHANNELS_PER_BOARD * self.boards)]
+        self._registers = [channel.registers() for channel in self.channels]
+        self.latencies = []
+        self._pending = bytearray()
+        self._replies = deque([(time.perf_counter() + boot_time, READY_BANNER)])
+
+    def _byte_time(self, count):
+        return count * BITS_PER_BYTE / self.baudrate if self.realtime else 0.0
+
+    def write(self, data):
+        now = time.perf_counter()
+        if self._probation_until is not None and now > self._probation_until:
+            self.switch_baud_rate(DEFAULT_BAUD_RATE)
+            self._probation_until = None
+        if self.baudrate != self.device_baud_rate or self.device_baud_rate > self.max_baud_rate:
+            # at mismatched (or unreliable) rates the firmware only sees garbage
+            return len(data)
+        self._line_free = max(now, self._line_free) + self._byte_time(len(data))
+        self.bytes_received += len(data)
+        self._pending += data
+        self._parse()
+        return len(data)
+
+    def _parse(self):
+        while True:
+            # skip anything that is not the start of a frame
+            while self._pending and self._pending[0] != SYNC:
+                del self._pending[0]
+            if len(self._pending) < 5:
+                return
+            seq, channel, command, count = self._pending[1:5]
+            end = 5 + payload_length(command, count)
+            if len(self._pending) < end:
+                return
+            payload = bytes(self._pending[5:end])
+            del self._pending[:end]
+            # the bytes still pending follow this frame on the line
+            frame_time = self._line_free - self._byte_time(len(self._pending))
+            if len(payload) > MAX_PAYLOAD:
+                # more than the firmware holds: its payload is skipped and the frame rejected
+                self._replies.append((frame_time + self._byte_time(2), bytes((NAK, seq))))
+                continue
+            if channel >= len(self.channels):
+                # a channel of a board the firmware does not drive: acknowledged without being applied
+                channel, command = 0, 0
+            self.apply(channel, command, count, payload)
+            self.frames_received += 1
+            if command and command not in NO_IO_UPDATE:
+                self._record_registers(frame_time)
+            if command == COMMANDS['latency']:
+                data = self.latency_report()
+                reply = bytes((DATA, seq, len(data))) + data
+            elif command == COMMANDS['capacity']:
+                reply = bytes((DATA, seq, 7)) + struct.pack('>IBH', self.table_capacity, self.boards, self.rx_capacity)
+            elif command == COMMANDS['digest']:
+                first = channel - channel % CHANNELS_PER_BOARD
+                data = b''.join(state.digest() for state in self.channels[first:first + CHANNELS_PER_BOARD])
+                reply = bytes((DATA, seq, len(data))) + data
+            else:
+                reply = bytes((ACK, seq))
+            self._replies.append((frame_time + self._byte_time(len(reply)), reply))
+            self._probation_until = None
+            if command == COMMANDS['baud']:
+                # the firmware switches once the acknowledgement has gone out
+                self.switch_baud_rate(*struct.unpack('>I', payload))
+                self._probation_until = time.perf_counter() + BAUD_PROBATION
+
+    def switch_baud_rate(self, baud_rate):
+        """What the firmware's reopenSerial does: the new rate, and nothing of a frame received before it"""
+        self.device_baud_rate = baud_rate
+        self._pending.clear()
+
+    def apply(self, channel, command, count, payload):
+        """Update the channel state for a decoded command, as the firmware's loop() does"""
+        state = self.channels[channel]
+        if command == COMMANDS['freq']:
+            # the firmware converts Hz to tuning words when the list is loaded
+            freqs = struct.unpack('>{}I'.format(count), payload)
+            state.load(int(f * FTW_RESOLUTION / SYS_CLOCK) for f in freqs)
+        elif command == COMMANDS['ftw']:
+            state.load(struct.unpack('>{}I'.format(count), payload))
+        elif command in (COMMANDS['chunk'], COMMANDS['run']):
+            if command == COMMANDS['chunk']:
+                offset, total = struct.unpack('>HH', payload[:4])
+                words = list(struct.unpack('>{}I'.format(count), payload[4:]))
+            else:
+                offset, total, word, step, length, repeat = RUN.unpack(payload[:RUN.size])
+                corrections = np.unpackbits(np.frombuffer(payload[RUN.size:], dtype=np.uint8))
+                words = []
+                for k in range(length):
+                    words += [word] * repeat
+                    word = (word + step + (int(corrections[k]) if k < len(corrections) else 0)) % FTW_RESOLUTION
+            count = len(words)
+            total = max(min(total, self.table_capacity), 1)
+            if offset == 0:
+                state.load(words)
+            ftw_list = (state.ftw_list + [0] * total)[:total]
+            ftw_list[offset:offset + count] = words[:max(total - offset, 0)]
+            state.ftw_list = ftw_list
+        elif command == COMMANDS['profile'] and count > 0:
+            words = struct.unpack('>{}I'.format(count), payload)
+            state.load(words[:1])
+            state.profiles = (words[0], words[min(1, count - 1)])
+            state.mode = MODE_PROFILE
+        elif command == COMMANDS['phase']:
+            state.phase_word, = struct.unpack('>H', payload)
+            state.words_set.add('phase')
+        elif command == COMMANDS['amplitude']:
+            state.amplitude_word, = struct.unpack('>H', payload)
+            state.words_set.add('amplitude')
+        elif command == COMMANDS['ramp']:
+            state.ramp = struct.unpack('>6I', payload)
+            state.mode = MODE_SWEEP
+        elif command == COMMANDS['rewind']:
+            state.counter = 0
+        elif command == COMMANDS['sweep']:
+            low, high, _, _, _, _, falling = SWEEP.unpack(payload)
+            state.load([high if falling else low])
+            state.sweep = (high, low) if falling else (low, high)
+            state.mode = MODE_SWEEP
+        elif command == COMMANDS['group']:
+            state.group_mask = payload[0] & 0x0F & ~(1 << (channel % CHANNELS_PER_BOARD))
+        elif command == COMMANDS['update']:
+            for index, fields, ftw, phase_word, amplitude_word in UPDATE_ENTRY.iter_unpack(payload):
+                if index >= len(self.channels):
+                    continue
+                entry = self.channels[index]
+                if fields & UPDATE_FTW:
+                    entry.load([ftw])
+                if fields & UPDATE_PHASE:
+                    entry.phase_word = phase_word
+                    entry.words_set.add('phase')
+                if fields & UPDATE_AMPLITUDE:
+                    entry.amplitude_word = amplitude_word
+                    entry.words_set.add('amplitude')
+
+    def _record_registers(self, timestamp):
+        """Record the registers that changed since the last IOUpdate, followed by the IOUpdate itself"""
+        for index, channel in enumerate(self.channels):
+            for register, value in channel.registers().items():
+                if self._registers[index].get(register) != value:
+                    self._registers[index][register] = value
+                    self.register_writes.append(RegisterWrite(timestamp, index, register, value))
+        self.register_writes.append(RegisterWrite(timestamp, None, 'IOUPDATE', None))
+
+    def trigger(self, channel, latency=0):
+        """Apply a trigger edge on a channel's step pin, as if loop() took `latency` us to apply it
+
+        The edge also steps the channels grouped with this one, and is ignored if another channel's
+        trigger steps this one. Groups are channels of one board, whose bits in group_mask count from
+        the board's first channel.
+        """
+        first = channel - channel % CHANNELS_PER_BOARD
+        board = self.channels[first:first + CHANNELS_PER_BOARD]
+        bit = 1 << (channel - first)
+        if any(other.group_mask & bit for index, other in enumerate(board) if first + index != channel):
+            return
+        group_mask = self.channels[channel].group_mask | bit
+        for index, state in enumerate(board):
+            if group_mask & (1 << index):
+                state.step()
+        self.latencies.append(latency)
+        self._record_registers(time.perf_counter() + 1e-6 * latency)
+
+    def latency_report(self):
+        """The reply to a latency query (see protocol.decode_latency); clears the recorded latencies"""
+        histogram = [0] * LATENCY_BUCKETS
+        for latency in self.latencies:
+            histogram[min(max(int(latency).bit_length() - 1, 0), LATENCY_BUCKETS - 1)] += 1
+        data = struct.pack('>{}I'.format(3 + LATENCY_BUCKETS), len(self.latencies),
+                           int(max(self.latencies, default=0)), 0, *histogram)
+        self.latencies = []
+        return data
+
+    def _ready(self):
+        now = time.perf_counter()
+        return sum(len(data) for ready, data in self._replies if ready <= now)
+
+    @property
+    def in_waiting(self):
+        return self._ready()
+
+    @property
+    def reply_due(self):
+        """The time at which the next reply becomes readable, or None if there is none"""
+        return self._replies[0][0] if self._replies else None
+
+    def read(self, size=1):
+        deadline = time.perf_counter() + (self.timeout or 0)
+        while self._ready() == 0:
+            wait = min(self._replies[0][0] if self._replies else deadline, deadline) - time.perf_counter()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        out = bytearray()
+        now = time.perf_counter()
+        while self._replies and self._replies[0][0] <= now and len(out) < size:
+            ready, data = self._replies.popleft()
+            room = size - len(out)
+            out += data[:room]
+            if len(data) > room:
+                # keep what did not fit for the next read
+                self._replies.appendleft((ready, data[room:]))
+        return bytes(out)
+
+    def reset_input_buffer(self):
+        self._replies.clear()
+
+    def close(self):
+        pass
+
+
+# ioctl reading the termios2 structure, which holds the exact line rate (Linux)
+TCGETS2 = 0x802C542A
+TERMIOS2 = struct.Struct('4IB19s2I')
+
+
+class EmulatedPort:
+    """Serves a FirmwareEmulator on a pseudo-terminal, as a stand-in for the arduino's serial port
+
+    Open `port` with serial.Serial like the arduino's port. Bytes are handed to the emulator as they arrive and
+    its replies are written back once they are due, so with a realtime emulator the host sees the timing of a
+    real serial line at whatever baud rate it has set on the port.
+    """
+
+    def __init__(self, device=None):
+        """
+        Args:
+            device (FirmwareEmulator, optional): the emulator to serve. Defaults to a new one with realtime=True.
+        """
+        # pseudo-terminals only exist on unix-like systems
+        import tty
+        self.device = device if device is not None else FirmwareEmulator(realtime=True)
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def host_baud_rate(self):
+        """The baud rate the host has set on the port"""
+        import fcntl
+        try:
+            return TERMIOS2.unpack(fcntl.ioctl(self._slave, TCGETS2, bytes(TERMIOS2.size)))[-1]
+        except OSError:
+            return self.device.baudrate
+
+    def reset(self, boot_time=0.0):
+        """Reset the emulator as opening the port resets the arduino (see FirmwareEmulator.reset)
+
+        A pseudo-terminal has no DTR line, so opening `port` does not do this by itself.
+        """
+        self.device.reset(boot_time)
+
+    def _serve(self):
+        while not self._stop.is_set():
+            due = self.device.reply_due
+            timeout = 0.01 if due is None else min(max(due - time.perf_counter(), 0), 0.01)
+            readable, _, _ = select.select([self._master], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError:
+                    return
+                self.device.baudrate = self.host_baud_rate()
+                self.device.write(data)
+            ready = self.device.in_waiting
+            if ready:
+                os.write(self._master, self.device.read(ready))
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
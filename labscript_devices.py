@@ -13,6 +13,58 @@ from labscript import IntermediateDevice, AnalogOut, DigitalOut, Trigger
 from labscript.labscript import Device, set_passed_properties
 import numpy as np
 
+from .protocol import (CHANNEL_TABLE_DTYPE, CHANNELS_PER_BOARD, DEFAULT_TABLE_CAPACITY, MAX_BOARDS, MAX_TABLE_WORDS,
+                       SWEEP_TABLE_DTYPE, channel_index, channel_name, frequency_to_ftw, ftw_to_frequency,
+                       sweep_parameters)
+
+
+class FrequencyList:
+    """The frequencies (in Hz) a channel steps through, kept in a float64 array that grows as needed
+
+    Appending one value at a time is amortised O(1), and extending with an array copies it in one go,
+    so long scans never build a Python list of floats.
+    """
+
+    def __init__(self, values=()):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self._data = np.empty(max(len(values), 16), dtype=np.float64)
+        self._data[:len(values)] = values
+        self._length = len(values)
+
+    def _reserve(self, length):
+        if length > len(self._data):
+            data = np.empty(max(length, 2 * len(self._data)), dtype=np.float64)
+            data[:self._length] = self.values
+            self._data = data
+
+    def append(self, value):
+        self._reserve(self._length + 1)
+        self._data[self._length] = value
+        self._length += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self._reserve(self._length + len(values))
+        self._data[self._length:self._length + len(values)] = values
+        self._length += len(values)
+
+    @property
+    def values(self):
+        """The frequencies as an array (a view, valid until the list grows)"""
+        return self._data[:self._length]
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
 class AD9959ArduinoComm ( IntermediateDevice ):
 
     # A human readable name for device model used in error messages
@@ -30,22 +82,51 @@ class AD9959ArduinoComm ( IntermediateDevice ):
                     'com_port',
                     'channel_mappings',
                     'baud_rate',
+                    'max_baud_rate',
+                    'auto_reset',
+                    'banner_timeout',
+                    'calibrate_link',
+                    'max_table_length',
                     'channels',
+                    'boards',
                     'div_32',
                     'default_values'
                 ]
         }
     )
-    def __init__ ( self , name , com_port, channel_mappings, trigger_mappings, div_32=False, default_values={}, channels=['ch0', 'ch1', 'ch2', 'ch3'], baud_rate = 115200, **kwargs):
+    def __init__ ( self , name , com_port, channel_mappings, trigger_mappings, div_32=False, default_values={}, channels=None, baud_rate = 115200, max_baud_rate=None, profile_mappings={}, max_table_length=None, boards=None, auto_reset=True, banner_timeout=2.0, calibrate_link=False, **kwargs):
         """ initialize device
 
         Args:
             name (str): name of device
             com_port (int): the comport the device is attached to 
             baud_rate (int, optional): The baud rate (rate of communication over serial). Defaults to 115200.
+            max_baud_rate (int, optional): If set, the worker negotiates the fastest rate up to this one that works with the arduino
+            (for example 2000000), falling back to baud_rate. Defaults to None (no negotiation).
+            auto_reset (bool, optional): whether opening the serial port may reset the arduino. If False, the worker
+            keeps DTR low so that a restarted worker finds the arduino running with its tables, and starts in
+            milliseconds instead of waiting for the bootloader. Defaults to True.
+            banner_timeout (float, optional): seconds the worker waits for the firmware to announce it has started
+            after opening the port reset the arduino, before pinging it. Pings sent while the bootloader runs are
+            lost or confuse it, so this is as long as an AVR bootloader takes by default; a Due sends its banner
+            within a few ms, and 0.3 is plenty for it. Defaults to 2.0.
+            calibrate_link (bool, optional): whether the worker measures the link's throughput and round trip when it
+            starts (about 200 ms at 115200 baud) and prints it. Defaults to False.
             trigger_mappings (dict): A dictionary of triggers that maps the trigger for that channel to the channel name.
+            Channels mapped to the same trigger share its line, which must be wired to the step pin of the lowest
+            numbered of them: the arduino then steps them all on each edge, with a single IOUpdate.
+            max_table_length (int, optional): the most frequencies each channel of the arduino holds (MAX_TABLE in
+            Channel.h): 4096 on a Due, 100 on boards with less memory, divided by the number of boards. Defaults to
+            DEFAULT_TABLE_CAPACITY divided by the number of boards.
+            profile_mappings (dict, optional): channel name -> DigitalOut wired to the AD9959 profile pin (P0-P3) of that
+            channel. Jumps of these channels are made by the DDS itself when the output toggles, see jump_profile. Defaults to {}.
             default_values (dict): default values for the channels. Ex: {"MOT":1250e6}
             channel_mappings  (str, optional): the names of the channel. Example: {"MOT":"ch1", "Repump":"ch2"}.
+            Channels of the boards after the first are prefixed with the board's index, e.g. "b1.ch2".
+            boards (list, optional): a name for each AD9959 board the arduino drives through its own chip select
+            pin, in the order of the pins (see AD9959.ino, built with NUM_BOARDS set to their number). Channels
+            sharing a trigger must be on the same board. Defaults to a single board.
+            channels (list, optional): the channels of the boards that can be programmed. Defaults to all of them.
             div_32 (bool): For the MOT and Repump frequencies, we divide them by 32 because of the frequency rescaling done by the AD4007
         """
         IntermediateDevice.__init__ ( self , name , parent_device=None)
@@ -53,11 +134,37 @@ class AD9959ArduinoComm ( IntermediateDevice ):
         self.name = name
         self.default_values = default_values
         self.trigger_mappings = trigger_mappings
-        self.channels = channels
+        # the times at which each trigger shared by several channels has fired, keyed by the trigger's name,
+        # so that channels jumping together fire it once
+        self.shared_trigger_times = {}
+        for trigger in trigger_mappings.values():
+            if sum(other is trigger for other in trigger_mappings.values()) > 1:
+                self.shared_trigger_times[trigger.name] = set()
+        self.profile_mappings = profile_mappings
+        self.boards = boards or [name]
+        if len(self.boards) > MAX_BOARDS:
+            raise Exception("{} has {} boards, but the arduino drives at most {}".format(name, len(self.boards), MAX_BOARDS))
+        # the boards share the arduino's memory (MAX_TABLE = 4096 / NUM_BOARDS)
+        if max_table_length is None:
+            max_table_length = DEFAULT_TABLE_CAPACITY // len(self.boards)
+        if max_table_length > MAX_TABLE_WORDS:
+            raise Exception("{} has max_table_length {}, but tables of more than {} tuning words cannot be sent".format(
+                name, max_table_length, MAX_TABLE_WORDS))
+        self.max_table_length = max_table_length
+        if channels is None:
+            channels = [channel_name(index) for index in range(CHANNELS_PER_BOARD * len(self.boards))]
+        # the same channel can be named 'ch2' or 'b0.ch2': use one name throughout
+        self.channels = [self.channel_name(channel) for channel in channels]
         # define list of frequencies to set for each AD9959 channel
         self.freq_dict = {}
         for channel in self.channels:
-            self.freq_dict[channel] = []
+            self.freq_dict[channel] = FrequencyList()
+        # the (at most two) frequencies of each channel in profile pin modulation: low level first
+        self.profile_dict = {}
+        for channel in self.channels:
+            self.profile_dict[channel] = []
+        # the linear sweep of each channel that has one: (start time, start, stop, duration)
+        self.sweep_dict = {}
         self.phase_dict = {}
         # the default phase between channels should be 0
         for channel in self.channels:
@@ -78,7 +185,19 @@ class AD9959ArduinoComm ( IntermediateDevice ):
             self.lower_lim = .01*32e6 # Hz
             self.upper_lim = 400*32e6 # Hz
 
-        self.channel_mappings  = channel_mappings
+        self.channel_mappings = {descriptor: self.channel_name(channel) for descriptor, channel in channel_mappings.items()}
+
+    def channel_name(self, channel):
+        """The name a channel of this device is stored under (see protocol.channel_name)
+
+        Raises:
+            Exception: if it is not a channel of one of the boards
+        """
+        index = channel_index(channel)
+        if index >= CHANNELS_PER_BOARD * len(self.boards):
+            raise Exception("{} is not a channel of {}, which has {} board(s): {}".format(
+                channel, self.name, len(self.boards), ', '.join(str(board) for board in self.boards)))
+        return channel_name(index)
 
     def generate_code(self,hdf5_file):
         """Write the frequency sequence for each channel to the HDF file
@@ -89,9 +208,41 @@ class AD9959ArduinoComm ( IntermediateDevice ):
 
         Device.generate_code(self, hdf5_file)
 
+        # one row per programmed channel: where its tuning words sit in the frequency table,
+        # plus its phase and amplitude
+        channel_rows = []
+        ftw_lists = []
+        offset = 0
+
+        # the channel whose trigger steps each channel: the lowest numbered of those sharing its trigger
+        leaders = {}
+        for channel_descriptor, channel in self.channel_mappings.items():
+            group = self.trigger_group(channel_descriptor)
+            indices = [channel_index(self.channel_mappings[other]) for other in group]
+            if len(set(index // CHANNELS_PER_BOARD for index in indices)) > 1:
+                raise Exception("Channels {} of {} share a trigger but are on different boards, which update separately".format(
+                    ', '.join(group), self.name))
+            leaders[channel] = min(indices)
+            # they all step on every edge, so each needs one frequency more than the trigger fires
+            steps = len(self.freq_dict[channel]) - 1
+            if len(group) > 1 and steps >= 0:
+                fired = len(self.shared_trigger_times[self.trigger_mappings[channel_descriptor].name])
+                if steps != fired:
+                    raise Exception("Channel {} of {} shares its trigger with {}, which fires {} times, but it steps {} times".format(
+                        channel_descriptor, self.name, ', '.join(other for other in group if other != channel_descriptor),
+                        fired, steps))
+
         for channel_num, channel in enumerate(self.freq_dict.keys()):
             
-            cur_freq_list = self.freq_dict[channel]
+            cur_freq_list = self.freq_dict[channel].values
+            profile = len(self.profile_dict[channel]) > 0
+            if profile:
+                # the low and high frequencies (the same twice if the channel never jumped)
+                cur_freq_list = self.profile_dict[channel] * (3 - len(self.profile_dict[channel]))
+
+            if len(cur_freq_list) > self.max_table_length:
+                raise Exception("{} steps through {} frequencies on {}, but the arduino holds at most {} per channel".format(
+                    self.name, len(cur_freq_list), channel, self.max_table_length))
 
             # check to see if any frequencies are set for the channel
             if len(cur_freq_list) > 0:
@@ -100,25 +251,40 @@ class AD9959ArduinoComm ( IntermediateDevice ):
                 if not self.check_frequency(cur_freq_list):
                     cur_freq_list = self.coerce_frequency(cur_freq_list)
 
-                grp = hdf5_file.require_group(f'/devices/{self.name}/')
-                
-                # reserve space for channel to set
-                dset_freq = grp.require_dataset('frequency_{}'.format(channel),
-                (len(cur_freq_list),),dtype='f')
-                # list the channel mappings
-                # S30 means string with 30 characters (in UTF-8)
-                dset_str = grp.require_dataset('channel_mappings', (len(self.channel_mappings),),dtype='S30')
+                # quantize to the tuning words the DDS will actually be programmed with
+                ftw_list = self.frequency_to_tuning_words(cur_freq_list)
+                ftw_lists.append(ftw_list)
 
-                dset_freq[:] = cur_freq_list
-                dset_str[:] = [n.encode("ascii", "ignore") for n in self.channel_mappings ]
+                channel_rows.append((channel_index(channel), offset, len(ftw_list),
+                                     self.coerce_phase(self.phase_dict[channel]),
+                                     self.coerce_amplitude(self.amplitude_dict[channel]), profile,
+                                     leaders.get(channel, channel_index(channel))))
+                offset += len(ftw_list)
 
-                dset_phase = grp.require_dataset('phase_{}'.format(channel),
-                (1,),dtype='f')
-                dset_phase[0] = self.coerce_phase(self.phase_dict[channel])
+        sweep_rows = []
+        for channel, (t, start, stop, duration) in self.sweep_dict.items():
+            if len(self.freq_dict[channel]) > 1:
+                raise Exception("Channel {} of {} cannot both ramp and step through a frequency list in one shot".format(
+                    channel, self.name))
+            start_ftw, stop_ftw, delta, rate, actual_duration = self.sweep_registers(start, stop, duration)
+            sweep_rows.append((channel_index(channel), t, start_ftw, stop_ftw, delta, rate, actual_duration))
 
-                dset_amplitude = grp.require_dataset('amplitude_{}'.format(channel),
-                (1,),dtype='f')
-                dset_amplitude[0] = self.coerce_amplitude(self.amplitude_dict[channel])
+        if len(channel_rows) > 0 or len(sweep_rows) > 0:
+            grp = hdf5_file.require_group(f'/devices/{self.name}/')
+
+            grp.create_dataset('channel_table', data=np.array(channel_rows, dtype=CHANNEL_TABLE_DTYPE))
+
+            frequency_table = np.concatenate(ftw_lists) if ftw_lists else np.empty(0, dtype=np.uint32)
+            grp.create_dataset('frequency_table', data=frequency_table)
+            # keep the output frequencies (Hz) corresponding to the tuning words for analysis. This is a dataset
+            # rather than an attribute, as HDF5 attributes hold at most 64 kB (8192 frequencies).
+            grp.create_dataset('frequencies', data=self.tuning_words_to_frequency(frequency_table))
+
+            grp.create_dataset('sweep_table', data=np.array(sweep_rows, dtype=SWEEP_TABLE_DTYPE))
+
+            # list the channel mappings
+            # S30 means string with 30 characters (in UTF-8)
+            grp.create_dataset('channel_mappings', data=[n.encode("ascii", "ignore") for n in self.channel_mappings], dtype='S30')
 
     def check_frequency(self, freq_list):
         """ check whether or not the frequencies are within the limits required
@@ -131,7 +297,8 @@ class AD9959ArduinoComm ( IntermediateDevice ):
             [bool]: whether or not the the frequencies fit within the required lims
         """
 
-        if max(freq_list) > self.upper_lim or min(freq_list) < self.lower_lim:
+        freq_array = np.asarray(freq_list, dtype=np.float64)
+        if freq_array.max() > self.upper_lim or freq_array.min() < self.lower_lim:
             print("Frequencies were clipped to match the limits: 0-200 MHz")
             return False
         else:
@@ -149,6 +316,47 @@ class AD9959ArduinoComm ( IntermediateDevice ):
         print("Warning: Frequencies input into DDS {} are not within limits".format(self.name))
         return list(np.clip(freq_list, self.lower_lim, self.upper_lim))
 
+    def frequency_to_tuning_words(self, freq_list):
+        """Convert frequencies in Hz to the 32 bit tuning words sent to the DDS
+
+        Args:
+            freq_list ([float]): frequencies in Hz, already within the limits
+
+        Returns:
+            np.ndarray: uint32 tuning words
+        """
+        freq_array = np.asarray(freq_list, dtype=np.float64)
+        # div_32 bool: for the MOT and Repump locks, the AD4007 divides the actual frequency by 32
+        if self.div_32:
+            freq_array = freq_array / 32.0
+        return frequency_to_ftw(freq_array)
+
+    def sweep_registers(self, start, stop, duration):
+        """The tuning words and sweep registers a linear sweep is loaded with (see protocol.sweep_parameters)
+
+        Args:
+            start (float): frequency at the start of the sweep in Hz
+            stop (float): frequency at the end of the sweep in Hz
+            duration (float): requested length of the sweep in seconds
+
+        Returns:
+            (int, int, int, int, float): start and stop tuning words, delta word, ramp rate and the
+            duration of the quantized sweep in seconds
+        """
+        ends = [start, stop]
+        if not self.check_frequency(ends):
+            ends = self.coerce_frequency(ends)
+        start_ftw, stop_ftw = self.frequency_to_tuning_words(ends)
+        delta, rate, actual_duration = sweep_parameters(start_ftw, stop_ftw, duration)
+        return start_ftw, stop_ftw, delta, rate, actual_duration
+
+    def tuning_words_to_frequency(self, ftw_list):
+        """The frequencies in Hz that a list of tuning words produce (the inverse of frequency_to_tuning_words)"""
+        freq_array = ftw_to_frequency(ftw_list)
+        if self.div_32:
+            freq_array = freq_array * 32.0
+        return freq_array
+
     def program_freq(self, channel_descriptor, freq_list):
         """set the frequencies in the dictionary, which will be used in the 
         generate code method
@@ -158,7 +366,7 @@ class AD9959ArduinoComm ( IntermediateDevice ):
             freq_list : see above
         """
 
-        self.freq_dict[self.channel_mappings[channel_descriptor]] = freq_list
+        self.freq_dict[self.channel_mappings[channel_descriptor]] = FrequencyList(freq_list)
 
     def jump_frequency(self, t, channel_descriptor, frequency, trigger=True):
         """Jump the AD9959 frequency to the next value. The first time it is set, trigger should be set to false
@@ -170,12 +378,142 @@ class AD9959ArduinoComm ( IntermediateDevice ):
             trigger (bool, optional): Whether or not to trigger. Defaults to True.
         """
 
+        if channel_descriptor in self.profile_mappings:
+            self.jump_profile(t, channel_descriptor, frequency)
+            return
+
         self.freq_dict[self.channel_mappings[channel_descriptor]].append(frequency)
         if trigger:
             #print("Triggering {} at t={}".format(channel_descriptor, t))
-            self.trigger_mappings[channel_descriptor].trigger_next_freq(t)
-   
+            self.trigger_channel(t, channel_descriptor)
 
+    def trigger_channel(self, t, channel_descriptor):
+        """Trigger the next frequency of a channel, unless another channel sharing its trigger already did at t
+
+        Args:
+            t (float): time at which to trigger in seconds
+            channel_descriptor (string): the channel to step
+        """
+        trigger = self.trigger_mappings[channel_descriptor]
+        fired = self.shared_trigger_times.get(trigger.name)
+        if fired is not None:
+            if t in fired:
+                return
+            fired.add(t)
+        trigger.trigger_next_freq(t)
+
+    def trigger_group(self, channel_descriptor):
+        """The channels (descriptors) stepped by the trigger of a channel, itself included
+
+        Channels in profile pin mode are not stepped by a trigger, so they are never part of a group.
+        """
+        if channel_descriptor in self.profile_mappings or channel_descriptor not in self.trigger_mappings:
+            return [channel_descriptor]
+        trigger = self.trigger_mappings[channel_descriptor]
+        return [other for other, other_trigger in self.trigger_mappings.items()
+                if other_trigger is trigger and other not in self.profile_mappings]
+
+    def jump_frequencies(self, times, channel_descriptor, frequencies, trigger=True):
+        """Jump a channel through many frequencies at once, e.g. a stepped scan
+
+        Equivalent to calling jump_frequency for each pair of time and frequency, but the
+        trigger spacing is checked for all of them together and the frequencies are stored
+        as one array, which is much faster for long sequences.
+
+        Args:
+            times (np.ndarray): times of the jumps in seconds
+            channel_descriptor (string): the channel to set
+            frequencies (np.ndarray): frequency to jump to at each time
+            trigger (bool, optional): Whether or not to trigger each jump. Defaults to True.
+
+        Raises:
+            Exception: if times and frequencies differ in length, or the triggers are too close together
+        """
+        times = np.asarray(times, dtype=np.float64).ravel()
+        frequencies = np.asarray(frequencies, dtype=np.float64).ravel()
+        if len(times) != len(frequencies):
+            raise Exception("Got {} times but {} frequencies for channel {} of {}".format(
+                len(times), len(frequencies), channel_descriptor, self.name))
+
+        if channel_descriptor in self.profile_mappings:
+            for t, frequency in zip(times, frequencies):
+                self.jump_profile(t, channel_descriptor, frequency)
+            return
+
+        # the triggers are checked before anything is stored, so nothing is left half done if they are invalid
+        if trigger:
+            trigger_device = self.trigger_mappings[channel_descriptor]
+            fired = self.shared_trigger_times.get(trigger_device.name)
+            if fired is None:
+                trigger_device.trigger_next_freqs(times)
+            else:
+                # another channel on the same trigger may have fired it at some of these times already
+                new_times = times[~np.isin(times, np.fromiter(fired, dtype=np.float64, count=len(fired)))]
+                trigger_device.trigger_next_freqs(new_times)
+                fired.update(new_times.tolist())
+        self.freq_dict[self.channel_mappings[channel_descriptor]].extend(frequencies)
+
+
+
+    def ramp(self, t, channel_descriptor, start, stop, duration):
+        """Sweep the frequency of a channel linearly from start to stop, beginning at t
+
+        The sweep is loaded into the DDS before the shot and started by the channel's trigger, after
+        which the DDS steps the frequency by itself every few sync clock cycles. A channel can ramp once
+        per shot, and not also step through a frequency list.
+
+        Args:
+            t (float): time at which to start the ramp in seconds
+            channel_descriptor (string): the channel to ramp
+            start (float): frequency at the start of the ramp in Hz, output until t
+            stop (float): frequency at the end of the ramp in Hz, held after the ramp
+            duration (float): length of the ramp in seconds
+
+        Raises:
+            Exception: if the ramp is slower than the DDS can sweep between start and stop
+
+        Returns:
+            float: the duration of the ramp the DDS makes, which the sweep registers quantize
+        """
+        channel = self.channel_mappings[channel_descriptor]
+        if channel in self.sweep_dict:
+            raise Exception("Channel {} of {} can only ramp once per shot".format(channel_descriptor, self.name))
+        if channel_descriptor in self.profile_mappings:
+            raise Exception("Channel {} of {} is in profile pin mode and cannot ramp".format(channel_descriptor, self.name))
+        if len(self.trigger_group(channel_descriptor)) > 1:
+            raise Exception("Channel {} of {} shares its trigger with other channels and cannot ramp".format(
+                channel_descriptor, self.name))
+        actual_duration = self.sweep_registers(start, stop, duration)[-1]
+        self.sweep_dict[channel] = (t, start, stop, duration)
+        self.trigger_channel(t, channel_descriptor)
+        return actual_duration
+
+    def jump_profile(self, t, channel_descriptor, frequency):
+        """Jump a channel in profile pin modulation to one of its two frequencies
+
+        The DDS holds both frequencies and switches between them on an edge of the channel's
+        profile pin, so the jump happens at t without the arduino being involved. The first
+        frequency given for the channel is output while the pin is low, the second while it is high.
+
+        Args:
+            t (float): time of the jump in seconds
+            channel_descriptor (string): the channel to set, which must be in profile_mappings
+            frequency (float): frequency to set
+
+        Raises:
+            Exception: if the channel would need more than two frequencies
+        """
+        levels = self.profile_dict[self.channel_mappings[channel_descriptor]]
+        if frequency not in levels:
+            if len(levels) == 2:
+                raise Exception("Channel {} of {} is in profile pin mode and can only switch between two frequencies ({} and {} Hz), "
+                                "not {} Hz".format(channel_descriptor, self.name, levels[0], levels[1], frequency))
+            levels.append(frequency)
+
+        if levels.index(frequency) == 0:
+            self.profile_mappings[channel_descriptor].go_low(t)
+        else:
+            self.profile_mappings[channel_descriptor].go_high(t)
 
     def coerce_phase(self, phase):
         
@@ -289,4 +627,34 @@ class AD9959ArduinoTriggerDigital(DigitalOut):
         self.go_high(trigger_time)
         self.go_low(trigger_time+self.min_trigger_pulse_width/2)
 
-        return self.min_trigger_pulse_width
\ No newline at end of file
+        return self.min_trigger_pulse_width
+
+    def trigger_next_freqs(self, trigger_times):
+        """Trigger the next frequency at each of several times (see trigger_next_freq)
+
+        Args:
+            trigger_times (np.ndarray): times to trigger, in the order the frequencies are stepped through
+
+        Raises:
+            Exception: if any trigger time is too close to the one before it
+
+        Returns:
+            float: length of each trigger
+        """
+        trigger_times = np.asarray(trigger_times, dtype=np.float64).ravel()
+        if len(trigger_times) == 0:
+            return self.min_trigger_pulse_width
+
+        spacings = np.abs(np.diff(trigger_times, prepend=self.prev_trigger_time))
+        if np.any(spacings < self.min_trigger_pulse_width):
+            raise Exception("Invalid triggering sequence. Please ensure the times between triggers are larger than the minimum. "
+                            "The first trigger too close to the one before it is at t={}".format(
+                                trigger_times[np.argmax(spacings < self.min_trigger_pulse_width)]))
+
+        self.prev_trigger_time = trigger_times[-1]
+        go_high, go_low = self.go_high, self.go_low
+        for trigger_time, end_time in zip(trigger_times.tolist(), (trigger_times + self.min_trigger_pulse_width/2).tolist()):
+            go_high(trigger_time)
+            go_low(end_time)
+
+        return self.min_trigger_pulse_width
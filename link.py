@@ -0,0 +1,300 @@
+#####################################################################
+#                                                                   #
+# Copyright 2019, Monash University and contributors                #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+
+"""Acknowledged transport for the commands encoded in protocol.py"""
+
+from collections import OrderedDict
+import time
+
+from .protocol import (ACK, BAUD_PROBATION, DATA, NAK, DEFAULT_BAUD_RATE, DEFAULT_RX_CAPACITY, READY_BANNER, encode_baud,
+                       encode_frame, encode_ping)
+
+
+class ArduinoLink:
+    """Streams framed commands to the arduino, keeping at most `window` of them unacknowledged
+
+    The firmware acknowledges every frame once it has applied it, in the order they were sent,
+    so the host never has to guess how long the arduino needs. Nothing else stops the host from
+    overrunning the arduino while it applies a long frame, so the frames in flight are also kept
+    within the bytes its receive buffers hold (`rx_capacity`). A frame that is not acknowledged,
+    or that the arduino rejects, is sent again together with every frame after it.
+    """
+
+    def __init__(self, connection, window=4, timeout=1.0, rx_capacity=DEFAULT_RX_CAPACITY, retries=2):
+        """
+        Args:
+            connection (serial.Serial): the open serial port (or anything with read, write and in_waiting)
+            window (int, optional): maximum number of frames in flight. Defaults to 4.
+            timeout (float, optional): seconds to wait for an acknowledgement before resending. Defaults to 1.0.
+            rx_capacity (int, optional): bytes the arduino buffers while it applies a frame (see
+                protocol.decode_capacity). A longer frame is only sent once every other frame is acknowledged.
+                Defaults to DEFAULT_RX_CAPACITY.
+            retries (int, optional): times unacknowledged frames are resent before giving up. Defaults to 2.
+        """
+        self.connection = connection
+        self.window = window
+        self.timeout = timeout
+        self.rx_capacity = rx_capacity
+        self.retries = retries
+        self.next_seq = 0
+        # sequence number -> (time the frame was written, the frame), oldest first
+        self.outstanding = OrderedDict()
+        self.outstanding_bytes = 0
+        self.bytes_sent = 0
+        # frames sent again after a timeout or a NAK
+        self.frames_resent = 0
+        # seconds spent writing to the port, and waiting for acknowledgements
+        self.write_time = 0.0
+        self.wait_time = 0.0
+        # sequence number -> data returned by the arduino, for commands that return something
+        self.replies = {}
+        self._received = bytearray()
+        # the frame the arduino rejected or acknowledged out of order, meaning that an older one was lost
+        self._lost = None
+
+    def send(self, command):
+        """Frame and write a command, first waiting for room in the window
+
+        Args:
+            command (bytes): an encoded command (see protocol.py)
+
+        Returns:
+            int: the sequence number of the frame
+        """
+        seq = self.next_seq
+        frame = encode_frame(seq, command)
+        while self.outstanding and (len(self.outstanding) >= self.window or
+                                    self.outstanding_bytes + len(frame) > self.rx_capacity):
+            self.wait_all(len(self.outstanding) - 1)
+        self.next_seq = (seq + 1) % 256
+        self.outstanding_bytes += len(frame)
+        self._write(seq, frame)
+        return seq
+
+    def _write(self, seq, frame):
+        start = time.perf_counter()
+        self.connection.write(frame)
+        now = time.perf_counter()
+        self.outstanding[seq] = (now, frame)
+        self.write_time += now - start
+        self.bytes_sent += len(frame)
+
+    def resend(self):
+        """Write every unacknowledged frame again, oldest first, as the arduino applies frames in order"""
+        self._lost = None
+        for seq, (_, frame) in list(self.outstanding.items()):
+            self._write(seq, frame)
+            self.frames_resent += 1
+
+    def forget(self):
+        """Stop waiting for the frames in flight, e.g. ones sent while the arduino was not listening"""
+        self.outstanding.clear()
+        self.outstanding_bytes = 0
+        self._lost = None
+
+    def wait_all(self, max_outstanding=0):
+        """Block until all but `max_outstanding` of the frames sent so far have been acknowledged
+
+        Frames that are not acknowledged within the timeout, or that the arduino rejects, are resent
+        (with every frame after them) up to `retries` times.
+
+        Raises:
+            Exception: if the oldest frame is still not acknowledged after the last retry
+        """
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.resend()
+            if self.drain(max_outstanding, self.timeout):
+                break
+        else:
+            seq = next(iter(self.outstanding))
+            self.forget()
+            self.wait_time += time.perf_counter() - start
+            raise Exception("The arduino did not acknowledge frame {} within {} s, {} times".format(
+                seq, self.timeout, self.retries + 1))
+        self.wait_time += time.perf_counter() - start
+
+    def drain(self, max_outstanding, timeout):
+        """Read acknowledgements until at most `max_outstanding` frames are unacknowledged
+
+        Args:
+            max_outstanding (int): number of frames that may stay in flight
+            timeout (float): seconds since the oldest outstanding frame was sent after which to give up
+
+        Returns:
+            bool: False if we gave up, or if a frame was lost and has to be resent
+        """
+        while len(self.outstanding) > max_outstanding:
+            data = self.connection.read(max(1, self.connection.in_waiting))
+            self._received += data
+            while len(self._received) >= 2:
+                if self._received[0] == ACK:
+                    self.acknowledge(self._received[1])
+                    del self._received[:2]
+                elif self._received[0] == NAK:
+                    # the arduino dropped a frame it could not make sense of
+                    if self._received[1] in self.outstanding:
+                        self._lost = self._received[1]
+                    del self._received[:2]
+                elif self._received[0] == DATA:
+                    if len(self._received) < 3 or len(self._received) < 3 + self._received[2]:
+                        # wait for the rest of the reply
+                        break
+                    length = self._received[2]
+                    self.replies[self._received[1]] = bytes(self._received[3:3 + length])
+                    self.acknowledge(self._received[1])
+                    del self._received[:3 + length]
+                else:
+                    # not the start of an acknowledgement, e.g. debug output from the firmware
+                    del self._received[0]
+
+            # resend once the frames sent after the lost one are through, so that their acknowledgements
+            # are not mistaken for those of the frames sent again
+            if self._lost is not None and self.outstanding and self._lost == next(reversed(self.outstanding)):
+                return False
+            if not data and self.outstanding:
+                oldest, _ = next(iter(self.outstanding.values()))
+                if time.perf_counter() - oldest > timeout:
+                    return False
+        return True
+
+    def acknowledge(self, seq):
+        """Mark a frame as applied by the arduino
+
+        The arduino applies frames in the order they were sent, so an acknowledgement of any frame but
+        the oldest one in flight means that the oldest was lost (e.g. corrupted on the line).
+        """
+        if seq not in self.outstanding:
+            # e.g. the late acknowledgement of a frame that has been resent
+            return
+        if seq != next(iter(self.outstanding)):
+            self._lost = seq
+            return
+        _, (_, frame) = self.outstanding.popitem(last=False)
+        self.outstanding_bytes -= len(frame)
+
+    def query(self, command):
+        """Send a command that returns data and wait for the reply
+
+        Args:
+            command (bytes): an encoded command
+
+        Returns:
+            bytes: the data the arduino sent back
+        """
+        seq = self.send(command)
+        self.wait_all()
+        return self.replies.pop(seq)
+
+    def ping(self):
+        """Send a frame that does nothing and wait for every frame to be acknowledged"""
+        self.send(encode_ping())
+        self.wait_all()
+
+    def wait_ready(self, timeout=3.0, retry_interval=0.1):
+        """Ping the arduino until it answers, e.g. while it boots after the port was opened
+
+        Args:
+            timeout (float, optional): seconds to keep trying. Defaults to 3.0.
+            retry_interval (float, optional): seconds to wait for each ping. Defaults to 0.1.
+
+        Returns:
+            float: seconds until the arduino answered
+        """
+        start = time.perf_counter()
+        while True:
+            self.send(encode_ping())
+            if self.drain(0, retry_interval):
+                return time.perf_counter() - start
+            # pings sent while the arduino was booting are lost
+            self.forget()
+            if time.perf_counter() - start > timeout:
+                raise Exception("The arduino did not respond within {} s of opening the port".format(timeout))
+
+    def wait_banner(self, timeout=2.0):
+        """Wait for the banner the firmware sends once it has started, e.g. after opening the port reset it
+
+        Nothing is sent meanwhile, so no frame is lost while the bootloader or setup() runs, and the
+        link is ready the moment the banner arrives.
+
+        Args:
+            timeout (float, optional): seconds to wait. Defaults to 2.0, long enough for the bootloader
+                of an AVR board; a Due, which has none, sends its banner within a few ms.
+
+        Returns:
+            float: seconds until the banner arrived, or None if it did not (the arduino was not reset,
+            or runs firmware that does not send it)
+        """
+        start = time.perf_counter()
+        while time.perf_counter() - start < timeout:
+            self._received += self.connection.read(max(1, self.connection.in_waiting))
+            index = self._received.find(READY_BANNER)
+            if index >= 0:
+                # anything before it is from the bootloader
+                del self._received[:index + len(READY_BANNER)]
+                return time.perf_counter() - start
+        # whatever came is not from the firmware we talk to
+        self._received.clear()
+        return None
+
+    def negotiate_baud(self, max_baud_rate, candidates=(2000000, 1000000, 500000, 250000, 230400)):
+        """Switch the link to the fastest baud rate (up to max_baud_rate) that both ends handle
+
+        Each candidate is tried from the fastest down: the arduino is asked to switch, and the rate is
+        kept if a ping at the new rate is acknowledged. Otherwise both ends return to DEFAULT_BAUD_RATE.
+
+        Args:
+            max_baud_rate (int): the highest rate to try
+            candidates (tuple, optional): rates to try, fastest first
+
+        Returns:
+            int: the baud rate in use
+        """
+        for baud_rate in candidates:
+            if baud_rate > max_baud_rate or baud_rate == self.connection.baudrate:
+                continue
+            self.send(encode_baud(baud_rate))
+            self.wait_all()
+            self.connection.baudrate = baud_rate
+            self.send(encode_ping())
+            if self.drain(0, 0.1):
+                return baud_rate
+            # the arduino did not understand us: wait for it to fall back and make sure it did
+            self.forget()
+            time.sleep(BAUD_PROBATION)
+            self.connection.baudrate = DEFAULT_BAUD_RATE
+            self.connection.reset_input_buffer()
+            self.ping()
+        return self.connection.baudrate
+
+    def calibrate(self, pings=10, frames=2):
+        """Measure the round trip latency and the throughput of the link
+
+        Args:
+            pings (int, optional): number of empty pings to average the round trip over. Defaults to 10.
+            frames (int, optional): number of maximum size pings streamed to measure throughput. Defaults to 2.
+
+        Returns:
+            (float, float): bytes per second and round trip time in seconds
+        """
+        start = time.perf_counter()
+        for _ in range(pings):
+            self.ping()
+        round_trip = (time.perf_counter() - start) / pings
+
+        sent = self.bytes_sent
+        start = time.perf_counter()
+        for _ in range(frames):
+            self.send(encode_ping(255))
+        self.wait_all()
+        bytes_per_second = (self.bytes_sent - sent) / (time.perf_counter() - start)
+        return bytes_per_second, round_trip
@@ -0,0 +1,653 @@
+#####################################################################
+#                                                                   #
+# Copyright 2019, Monash University and contributors                #
+#                                                                   #
+# This file is part of labscript_devices, in the labscript suite    #
+# (see http://labscriptsuite.org), and is licensed under the        #
+# Simplified BSD License. See the license.txt file in the root of   #
+# the project for the full license.                                 #
+#                                                                   #
+#####################################################################
+
+"""Encoding of the serial commands understood by AD9959.ino.
+
+Every command is a 3 byte header (channel, command id, number of values)
+followed by the big-endian payload. Each encoder below returns the whole
+command as one contiguous bytes object so that the worker can hand it to
+the serial port in a single write.
+
+On the wire each command is wrapped in a frame: a SYNC byte and a sequence
+number come first (see encode_frame). Once the firmware has applied a frame
+it answers with the two bytes ACK, sequence number (see link.ArduinoLink),
+or with a DATA reply for commands that return something.
+"""
+
+import re
+import struct
+import zlib
+
+import numpy as np
+
+# mappings between commands sent to arduino and their meaning
+COMMANDS = {"freq": 1, "phase": 2, "ramp": 3, "amplitude": 4, "rewind": 5, "ftw": 6, "ping": 7, "baud": 8, "latency": 9,
+            "update": 10, "profile": 11, "sweep": 12, "chunk": 13, "capacity": 14,
+            "run": 15, "group": 16, "digest": 17}
+
+# payload size of each command id in bytes: (bytes per value, fixed bytes)
+PAYLOAD_SIZES = {1: (4, 0), 2: (0, 2), 3: (0, 24), 4: (0, 2), 5: (0, 0), 6: (4, 0), 7: (4, 0), 8: (0, 4), 9: (0, 0),
+                 10: (10, 0), 11: (4, 0), 12: (0, 20), 13: (4, 4), 14: (0, 0),
+                 15: (1, 15), 16: (0, 1), 17: (0, 0)}
+
+# first byte of every frame sent to the arduino, and of every acknowledgement it sends back
+SYNC = 0xA5
+ACK = 0x06
+# commands that return data are answered with DATA, the sequence number, a length byte and the data instead of ACK
+DATA = 0x07
+# a frame the firmware could not hold is dropped and answered with NAK and its sequence number
+NAK = 0x15
+# sent once by the firmware when setup() has finished and it listens for frames (none of its bytes is ACK or DATA)
+READY_BANNER = b'\x08READY'
+
+# the most values one command carries: its count is a single byte
+MAX_FRAME_VALUES = 255
+# the longest payload the firmware holds (MAX_PAYLOAD in CommandParser.h): a longer frame is answered with NAK
+MAX_PAYLOAD = 1024
+# tuning words each channel of the firmware holds on an Arduino Due (MAX_TABLE in Channel.h). The
+# firmware reports its actual capacity, see encode_capacity_query.
+DEFAULT_TABLE_CAPACITY = 4096
+# the longest table the chunk and run commands can address: offsets and table lengths are 16 bit
+MAX_TABLE_WORDS = 2**16 - 1
+# bytes the firmware buffers while it applies a frame: its UART buffer plus RX_RING_SIZE (CommandParser.h).
+# The firmware reports its own (see decode_capacity); this is what firmware that does not report it holds
+# on a board with a 64 byte UART buffer.
+DEFAULT_RX_CAPACITY = 64 + 256
+
+# number of buckets in the firmware's trigger to IOUpdate latency histogram
+LATENCY_BUCKETS = 16
+
+# rate the firmware starts at, and falls back to if the host goes quiet after a baud rate change
+DEFAULT_BAUD_RATE = 115200
+# the firmware drops back to DEFAULT_BAUD_RATE if no frame arrives this long after switching (s)
+BAUD_PROBATION = 0.5
+
+# DDS system clock: 20 MHz reference multiplied by 20 in the AD9959 PLL (see AD9959::initialize)
+SYS_CLOCK = 400e6
+# frequencies are set with a 32 bit frequency tuning word (FTW): f_out = FTW * SYS_CLOCK / 2**32
+FTW_RESOLUTION = 2**32
+# linear sweeps advance on the sync clock, a quarter of the system clock
+SYNC_CLOCK = SYS_CLOCK / 4
+# the longest ramp rate register value: sync clock cycles between sweep steps
+MAX_RAMP_RATE = 255
+
+HEADER = struct.Struct('>BBB')
+
+# channels of each AD9959 board. The arduino can drive several boards (NUM_BOARDS in Channel.h), and commands
+# address channel k of board b as channel CHANNELS_PER_BOARD * b + k (see channel_index).
+CHANNELS_PER_BOARD = 4
+# the most boards the firmware has pins for
+MAX_BOARDS = 4
+# a channel name in the connection table: 'ch2', or 'b1.ch2' for a board other than the first
+CHANNEL_NAME = re.compile(r'(?:b(\d+)\.)?ch(\d+)')
+
+# what sets a channel's frequency, as reported in its digest (see decode_digests)
+MODE_TABLE = 0
+MODE_PROFILE = 1
+MODE_SWEEP = 2
+# phase or amplitude word of a channel that has not been set since the arduino started
+WORD_UNSET = 0xFFFF
+# one channel of the reply to a digest query: mode, CRC-32 of its tuning words, how many there are,
+# phase word, amplitude word and the channels its trigger steps as well
+DIGEST = struct.Struct('>BIHHHB')
+
+# one channel of an update command: channel, fields present, tuning word, phase word, amplitude word
+UPDATE_ENTRY = struct.Struct('>BBIHH')
+# bits of the fields byte of an update entry
+UPDATE_FTW = 0x01
+UPDATE_PHASE = 0x02
+UPDATE_AMPLITUDE = 0x04
+
+# Layout of the per-device channel table written by AD9959ArduinoComm.generate_code. Each row
+# points at the channel's tuning words in the flat uint32 frequency_table dataset. Rows with
+# profile set hold the two tuning words selected by the channel's profile pin instead of a list
+# to step through. leader is the channel whose trigger steps this one: itself, unless the channel
+# shares a trigger line with lower numbered channels.
+CHANNEL_TABLE_DTYPE = np.dtype([
+    ('channel', 'u1'),
+    ('offset', 'u4'),
+    ('length', 'u4'),
+    ('phase', 'f4'),
+    ('amplitude', 'f4'),
+    ('profile', 'u1'),
+    ('leader', 'u1'),
+])
+
+# Layout of the per-device sweep table: one linear frequency sweep per row, started by the channel's
+# trigger at 'time'. delta is the tuning word step made every 'rate' sync clock cycles, and
+# duration the time the quantized sweep actually takes.
+SWEEP_TABLE_DTYPE = np.dtype([
+    ('channel', 'u1'),
+    ('time', 'f8'),
+    ('start', 'u4'),
+    ('stop', 'u4'),
+    ('delta', 'u4'),
+    ('rate', 'u1'),
+    ('duration', 'f8'),
+])
+
+SWEEP = struct.Struct('>IIIIBBBx')
+
+# a run of tuning words in a compactly encoded table: offset in the table, table length, first word, step
+# (modulo 2**32), number of distinct words and how many times each is repeated. A bit per step follows, set
+# where the step is one more than the given one, as happens when a scan in Hz is rounded to tuning words; it
+# is left out if no step needs it.
+RUN = struct.Struct('>HHIIHB')
+MAX_RUN_LENGTH = 2**16 - 1
+MAX_RUN_REPEAT = 2**8 - 1
+# the longest run with corrections: one bit per step in at most MAX_FRAME_VALUES bytes
+MAX_CORRECTED_RUN_LENGTH = 8 * MAX_FRAME_VALUES + 1
+
+
+def encode_header(channel, command, count):
+    """Pack the 3 byte header that starts every command
+
+    Args:
+        channel (int): the DDS channel the command applies to (see channel_index)
+        command (str): key of COMMANDS
+        count (int): the number of values that follow (0-255)
+
+    Returns:
+        bytes: the packed header
+    """
+    return HEADER.pack(channel, COMMANDS[command], count)
+
+
+def payload_length(command_id, count):
+    """The number of payload bytes that follow the header of a command"""
+    per_value, fixed = PAYLOAD_SIZES[command_id]
+    return per_value * count + fixed
+
+
+def encode_frame(seq, command):
+    """Wrap an encoded command in a frame
+
+    Args:
+        seq (int): sequence number (0-255) the arduino echoes in its acknowledgement
+        command (bytes): the encoded command
+
+    Returns:
+        bytes: SYNC, seq, then the command
+    """
+    return bytes((SYNC, seq)) + command
+
+
+def frequency_to_ftw(freq_list, sys_clock=SYS_CLOCK):
+    """Quantize DDS output frequencies to 32 bit frequency tuning words
+
+    Args:
+        freq_list (array_like): frequencies in Hz
+        sys_clock (float, optional): DDS system clock in Hz. Defaults to SYS_CLOCK.
+
+    Returns:
+        np.ndarray: uint32 tuning words, rounded to nearest and clipped to the register range
+    """
+    words = np.rint(np.asarray(freq_list, dtype=np.float64) * (FTW_RESOLUTION / sys_clock))
+    return np.clip(words, 0, FTW_RESOLUTION - 1).astype(np.uint32)
+
+
+def ftw_to_frequency(ftw_list, sys_clock=SYS_CLOCK):
+    """The frequencies in Hz the DDS outputs for the given tuning words"""
+    return np.asarray(ftw_list, dtype=np.float64) * (sys_clock / FTW_RESOLUTION)
+
+
+def encode_ftw(channel, ftw_list):
+    """Encode a list of frequency tuning words for a channel
+
+    Args:
+        channel (int): The channel to set
+        ftw_list (array_like): 32 bit tuning words, see frequency_to_ftw
+
+    Returns:
+        bytes: header followed by 4 bytes per tuning word
+    """
+    words = np.asarray(ftw_list, dtype='>u4')
+    return encode_header(channel, 'ftw', len(words)) + words.tobytes()
+
+
+def check_table_length(length):
+    """Make sure a table's offsets and length fit the 16 bit fields of the chunk and run commands
+
+    Raises:
+        Exception: if the table has more than MAX_TABLE_WORDS tuning words
+    """
+    if length > MAX_TABLE_WORDS:
+        raise Exception("A table of {} tuning words is longer than the {} the arduino can address".format(
+            length, MAX_TABLE_WORDS))
+
+
+def encode_ftw_chunks(channel, ftw_list):
+    """Encode a tuning word table of any length as commands of at most MAX_FRAME_VALUES words
+
+    Each chunk carries its offset into the channel's table and the length of the whole table, so the
+    firmware can assemble tables longer than one command holds.
+
+    Args:
+        channel (int): The channel to set
+        ftw_list (array_like): 32 bit tuning words, see frequency_to_ftw
+
+    Returns:
+        list: the encoded chunks, to be sent in order
+
+    Raises:
+        Exception: if the table has more than MAX_TABLE_WORDS tuning words
+    """
+    words = np.asarray(ftw_list, dtype='>u4')
+    check_table_length(len(words))
+    chunks = []
+    for offset in range(0, max(len(words), 1), MAX_FRAME_VALUES):
+        chunk = words[offset:offset + MAX_FRAME_VALUES]
+        chunks.append(encode_header(channel, 'chunk', len(chunk)) + struct.pack('>HH', offset, len(words))
+                      + chunk.tobytes())
+    return chunks
+
+
+def ftw_runs(ftw_list):
+    """Split a tuning word table into runs of nearly constant step
+
+    Within a run every word is repeated the same number of times, and every step between
+    distinct words is either s or s + 1 for one s. This covers held frequencies, stepped
+    scans with any number of shots per step, and scans in Hz after rounding to tuning words.
+
+    Args:
+        ftw_list (array_like): 32 bit tuning words
+
+    Returns:
+        list: (offset, length, repeat, first word, step s, corrections) of each run in table order.
+        length counts the distinct words, and corrections is a bytes object with the bit of each
+        step that is s + 1 (MSB first), or empty if there are none.
+    """
+    words = np.asarray(ftw_list, dtype=np.uint32)
+    # groups of equal consecutive words, at most MAX_RUN_REPEAT long
+    starts = np.flatnonzero(np.diff(words, prepend=words[:1] + 1) != 0) if len(words) else np.empty(0, dtype=int)
+    counts = np.diff(np.append(starts, len(words)))
+    group_starts = []
+    group_counts = []
+    for start, count in zip(starts.tolist(), counts.tolist()):
+        for offset in range(0, count, MAX_RUN_REPEAT):
+            group_starts.append(start + offset)
+            group_counts.append(min(count - offset, MAX_RUN_REPEAT))
+    values = words[group_starts]
+    steps = np.diff(values).tolist()
+
+    runs = []
+    group = 0
+    while group < len(group_starts):
+        repeat = group_counts[group]
+        end = group
+        low = high = None
+        # extend the run while the repeats match and the steps stay within one of each other
+        while end < len(steps) and group_counts[end + 1] == repeat:
+            step = steps[end]
+            new_low = step if low is None else min(low, step)
+            new_high = step if high is None else max(high, step)
+            length = end - group + 2
+            if new_high - new_low > 1 or length > MAX_RUN_LENGTH:
+                break
+            if new_high != new_low and length > MAX_CORRECTED_RUN_LENGTH:
+                break
+            low, high = new_low, new_high
+            end += 1
+        corrections = b''
+        if high is not None and high != low:
+            corrections = np.packbits(np.array(steps[group:end]) != low).tobytes()
+        runs.append((group_starts[group], end - group + 1, repeat, int(values[group]), low or 0, corrections))
+        group = end + 1
+    return runs
+
+
+def encode_ftw_runs(channel, ftw_list):
+    """Encode a tuning word table compactly
+
+    Runs of repeated words with nearly constant step (see ftw_runs) become one command each, when
+    that is shorter than 4 bytes per word. The words in between are sent as they are, with
+    encode_ftw_chunks' command.
+
+    Args:
+        channel (int): The channel to set
+        ftw_list (array_like): 32 bit tuning words
+
+    Returns:
+        list: the encoded commands, each with the offset of its first word and the table length
+
+    Raises:
+        Exception: if the table has more than MAX_TABLE_WORDS tuning words
+    """
+    words = np.asarray(ftw_list, dtype='>u4')
+    total = len(words)
+    check_table_length(total)
+    commands = []
+    # start of the words not yet sent
+    pending = 0
+
+    def send_pending(end):
+        for offset in range(pending, end, MAX_FRAME_VALUES):
+            chunk = words[offset:min(offset + MAX_FRAME_VALUES, end)]
+            commands.append(encode_header(channel, 'chunk', len(chunk)) + struct.pack('>HH', offset, total)
+                            + chunk.tobytes())
+
+    for offset, length, repeat, first, step, corrections in ftw_runs(words):
+        command = encode_header(channel, 'run', len(corrections)) + RUN.pack(
+            offset, total, first, step, length, repeat) + corrections
+        # every command also costs the two bytes of its frame
+        if len(command) + 2 < 4 * length * repeat:
+            send_pending(offset)
+            commands.append(command)
+            pending = offset + length * repeat
+    send_pending(total)
+    if not commands:
+        # an empty table still has to be sent
+        commands.append(encode_header(channel, 'chunk', 0) + struct.pack('>HH', 0, 0))
+    return commands
+
+
+def encode_ftw_table(channel, ftw_list):
+    """Encode a tuning word table in as few bytes as possible
+
+    Returns:
+        list: the encoded commands, to be sent in order. A table that fits in one command and gains
+        nothing from encode_ftw_runs is a single encode_ftw command.
+    """
+    if len(ftw_list) <= MAX_FRAME_VALUES:
+        plain = [encode_ftw(channel, ftw_list)]
+    else:
+        plain = encode_ftw_chunks(channel, ftw_list)
+    compact = encode_ftw_runs(channel, ftw_list)
+    if sum(map(len, compact)) < sum(map(len, plain)):
+        return compact
+    return plain
+
+
+def channel_index(name):
+    """The channel number commands address a channel by, from its name in the connection table
+
+    Args:
+        name (str): 'ch2' for channel 2 of the first board, 'b1.ch2' for channel 2 of the second one
+
+    Raises:
+        Exception: if the name is not of either form
+
+    Returns:
+        int: CHANNELS_PER_BOARD * board + channel
+    """
+    match = CHANNEL_NAME.fullmatch(name)
+    if match is None or int(match.group(2)) >= CHANNELS_PER_BOARD:
+        raise Exception("{} is not a channel of an AD9959: use 'ch0' to 'ch3', or 'b1.ch2' for channel 2 of "
+                        "board 1".format(name))
+    return CHANNELS_PER_BOARD * int(match.group(1) or 0) + int(match.group(2))
+
+
+def channel_name(index):
+    """The name of a channel in the form channel_index reads (boards after the first are prefixed with 'b<n>.')"""
+    board, channel = divmod(index, CHANNELS_PER_BOARD)
+    return 'ch{}'.format(channel) if board == 0 else 'b{}.ch{}'.format(board, channel)
+
+
+def encode_capacity_query():
+    """Encode a request for the number of tuning words each channel's table holds, the number of boards, and the
+    bytes the firmware can buffer"""
+    return encode_header(0, 'capacity', 0)
+
+
+def decode_capacity(data):
+    """Unpack the reply to encode_capacity_query
+
+    Returns:
+        (int, int, int): the table length in tuning words, the number of AD9959 boards the firmware drives
+        (1 for firmware that does not report it) and the bytes it buffers while applying a frame
+        (DEFAULT_RX_CAPACITY for firmware that does not report it)
+    """
+    capacity, = struct.unpack('>I', data[:4])
+    boards = data[4] if len(data) > 4 else 1
+    rx_capacity, = struct.unpack('>H', data[5:7]) if len(data) > 6 else (DEFAULT_RX_CAPACITY,)
+    return capacity, boards, rx_capacity
+
+
+def encode_digest_query(board=0):
+    """Encode a request for a digest of what each channel of a board has been programmed with"""
+    return encode_header(CHANNELS_PER_BOARD * board, 'digest', 0)
+
+
+def decode_digests(data):
+    """Unpack the reply to encode_digest_query
+
+    Returns:
+        list: for each channel of the board, a dict with the 'mode' (MODE_TABLE, MODE_PROFILE or MODE_SWEEP), the 'crc'
+        (see table_crc) and 'length' of its tuning words (the table, or the low and high words in
+        MODE_PROFILE), its 'phase_word' and 'amplitude_word' (WORD_UNSET if never set) and its 'group_mask'
+    """
+    fields = ['mode', 'crc', 'length', 'phase_word', 'amplitude_word', 'group_mask']
+    return [dict(zip(fields, values)) for values in DIGEST.iter_unpack(data)]
+
+
+def table_crc(ftw_list):
+    """CRC-32 (as zlib.crc32) of tuning words laid out as the firmware stores them: 4 bytes each, MSB first"""
+    return zlib.crc32(np.asarray(ftw_list, dtype='>u4').tobytes())
+
+
+def encode_profiles(channel, ftw_list):
+    """Encode the two tuning words of a channel in profile pin modulation
+
+    The DDS outputs the first while the channel's profile pin is low and the second while it
+    is high, and the arduino stops driving the pin so that the experiment can.
+
+    Args:
+        channel (int): The channel to set
+        ftw_list (array_like): the low and high 32 bit tuning words
+
+    Returns:
+        bytes: header followed by 4 bytes per tuning word
+    """
+    words = np.asarray(ftw_list, dtype='>u4')
+    return encode_header(channel, 'profile', len(words)) + words.tobytes()
+
+
+def sweep_parameters(start_ftw, stop_ftw, duration, sync_clock=SYNC_CLOCK):
+    """Quantize a linear sweep between two tuning words to the AD9959 sweep registers
+
+    The smallest ramp rate that allows a delta word of at least 1 is used, so the sweep is as
+    smooth as the DDS can make it.
+
+    Args:
+        start_ftw (int): tuning word at the start of the sweep
+        stop_ftw (int): tuning word at the end of the sweep
+        duration (float): requested length of the sweep in seconds
+        sync_clock (float, optional): rate at which the sweep advances in Hz. Defaults to SYNC_CLOCK.
+
+    Raises:
+        Exception: if the sweep would be slower than the DDS can go
+
+    Returns:
+        (int, int, float): delta word, ramp rate and the duration of the quantized sweep in seconds
+    """
+    span = abs(int(stop_ftw) - int(start_ftw))
+    if span == 0 or duration <= 0:
+        return max(span, 1), 1, 0.0
+    cycles = duration * sync_clock
+    if cycles > span * MAX_RAMP_RATE:
+        raise Exception("A sweep over {} tuning word steps can take at most {:.3g} s, not {:.3g} s".format(
+            span, span * MAX_RAMP_RATE / sync_clock, duration))
+    rate = int(min(max(np.ceil(cycles / span), 1), MAX_RAMP_RATE))
+    delta = max(int(round(span * rate / cycles)), 1)
+    steps = -(-span // delta)
+    return delta, rate, steps * rate / sync_clock
+
+
+def encode_sweep(channel, start_ftw, stop_ftw, delta, rate):
+    """Encode a linear sweep that the arduino starts on the channel's next trigger
+
+    The AD9959 sweeps between a low and a high tuning word, upwards while the channel's profile pin
+    is high and downwards while it is low. The direction not used by the ramp gets a delta word that
+    covers the whole span in one step, so the output can be parked at the start before the trigger.
+
+    Args:
+        channel (int): The channel to sweep
+        start_ftw (int): tuning word at the start of the sweep
+        stop_ftw (int): tuning word at the end of the sweep
+        delta (int): tuning word step, see sweep_parameters
+        rate (int): sync clock cycles between steps, see sweep_parameters
+
+    Returns:
+        bytes: header followed by the 20 bytes read by Channel::armSweep
+    """
+    start_ftw, stop_ftw = int(start_ftw), int(stop_ftw)
+    span = max(abs(stop_ftw - start_ftw), 1)
+    if stop_ftw >= start_ftw:
+        sweep = SWEEP.pack(start_ftw, stop_ftw, delta, span, rate, 1, 0)
+    else:
+        sweep = SWEEP.pack(stop_ftw, start_ftw, span, delta, 1, rate, 1)
+    return encode_header(channel, 'sweep', 0) + sweep
+
+
+def encode_phase(channel, phase_word):
+    """Encode a single 14 bit phase offset word for a channel
+
+    Args:
+        channel (int): The channel to set
+        phase_word (int): the phase in units of 360/2**14 degrees
+
+    Returns:
+        bytes: header followed by 2 bytes
+    """
+    return encode_header(channel, 'phase', 1) + struct.pack('>H', phase_word)
+
+
+def encode_amplitude(channel, amplitude_word):
+    """Encode a single 10 bit amplitude scale word for a channel
+
+    Args:
+        channel (int): The channel to set
+        amplitude_word (int): the amplitude (0-1023)
+
+    Returns:
+        bytes: header followed by 2 bytes
+    """
+    return encode_header(channel, 'amplitude', 1) + struct.pack('>H', amplitude_word)
+
+
+def encode_ramp(channel, start, stop, rate_up, cycles_up, rate_down, cycles_down):
+    """Encode a linear frequency sweep for a channel
+
+    The firmware reads the six words in this order into the inputLW array of
+    AD9959::linearSweepF. The count byte is 0 for this command.
+
+    Returns:
+        bytes: header followed by 6 words of 4 bytes
+    """
+    return encode_header(channel, 'ramp', 0) + struct.pack(
+        '>6I', start, stop, rate_up, cycles_up, rate_down, cycles_down)
+
+
+def encode_update(entries):
+    """Encode a change of several channels that the firmware applies with a single IOUpdate
+
+    Args:
+        entries (list): (channel, ftw, phase_word, amplitude_word) tuples. Any of the last three
+        may be None to leave that register of the channel alone.
+
+    Returns:
+        bytes: header followed by 10 bytes per channel
+    """
+    payload = bytearray()
+    for channel, ftw, phase_word, amplitude_word in entries:
+        fields = ((UPDATE_FTW if ftw is not None else 0) | (UPDATE_PHASE if phase_word is not None else 0)
+                  | (UPDATE_AMPLITUDE if amplitude_word is not None else 0))
+        payload += UPDATE_ENTRY.pack(channel, fields, int(ftw or 0), phase_word or 0, amplitude_word or 0)
+    return encode_header(0, 'update', len(entries)) + bytes(payload)
+
+
+def phase_to_word(phase):
+    """The 14 bit phase offset word for a phase in degrees"""
+    return int((phase % 360) / 360.0 * 2**14)
+
+
+def amplitude_to_word(amplitude):
+    """The 10 bit amplitude scale word for an amplitude between 0 and 1"""
+    return int(amplitude * 1023)
+
+
+def encode_rewind(channel):
+    """Encode a command returning a channel to the first entry of its frequency list
+
+    Returns:
+        bytes: the 3 byte header, this command has no payload
+    """
+    return encode_header(channel, 'rewind', 0)
+
+
+def encode_group(channel, followers):
+    """Encode which other channels a channel's trigger steps as well
+
+    The firmware then applies a trigger edge on the channel's step pin to all of them with a single
+    IOUpdate, and ignores the followers' own step pins.
+
+    Args:
+        channel (int): the channel whose step pin the shared trigger line is wired to
+        followers (iterable): the other channels it steps, all on the same board. Empty to step only the
+        channel itself.
+
+    Returns:
+        bytes: header followed by a byte with bit k set for channel k of the board
+    """
+    return encode_header(channel, 'group', 0) + bytes((group_mask(channel, followers),))
+
+
+def group_mask(channel, followers):
+    """The byte encode_group sends: bit k set for each channel k of the board stepped by the trigger of `channel`
+
+    Raises:
+        Exception: if a follower is on another board, which has its own IOUpdate
+    """
+    mask = 0
+    for follower in followers:
+        if follower // CHANNELS_PER_BOARD != channel // CHANNELS_PER_BOARD:
+            raise Exception("{} and {} are on different boards, so they cannot share a trigger".format(
+                channel_name(channel), channel_name(follower)))
+        if follower != channel:
+            mask |= 1 << (follower % CHANNELS_PER_BOARD)
+    return mask
+
+
+def encode_ping(padding=0):
+    """Encode a command that does nothing except get acknowledged
+
+    Args:
+        padding (int, optional): number of ignored 4 byte words to append, used to measure
+        throughput. Defaults to 0.
+    """
+    return encode_header(0, 'ping', padding) + bytes(4 * padding)
+
+
+def encode_baud(baud_rate):
+    """Encode a request for the arduino to switch its serial port to another baud rate
+
+    The arduino acknowledges at the old rate, then switches. If no frame arrives at the new rate
+    within BAUD_PROBATION it goes back to DEFAULT_BAUD_RATE.
+    """
+    return encode_header(0, 'baud', 0) + struct.pack('>I', baud_rate)
+
+
+def encode_latency_query():
+    """Encode a request for the trigger to IOUpdate latency histogram (which the firmware then clears)"""
+    return encode_header(0, 'latency', 0)
+
+
+def decode_latency(data):
+    """Unpack the reply to encode_latency_query
+
+    Returns:
+        dict: 'count' edges applied, 'max_us' worst latency, 'dropped' edges lost because a queue was full,
+        and 'histogram' mapping the upper bound of each bucket in us to its number of edges
+    """
+    values = struct.unpack('>{}I'.format(3 + LATENCY_BUCKETS), data)
+    count, max_us, dropped = values[:3]
+    histogram = {2 ** (bucket + 1): n for bucket, n in enumerate(values[3:])}
+    return {'count': count, 'max_us': max_us, 'dropped': dropped, 'histogram': histogram}
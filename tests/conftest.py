@@ -0,0 +1,99 @@
+"""Shared helpers for the tests in this folder.
+
+The device code uses relative imports (it is installed as
+user_devices.<lab>.AD9959ArduinoComm), so the modules are imported here as
+members of a package named after the repository folder, as the benchmarks
+do. labscript and BLACS are replaced by stand-ins (labscript's is the one
+the compile benchmarks use), so the device classes and the worker run with
+only numpy, h5py and pyserial installed.
+"""
+
+import importlib
+import os
+import sys
+import types
+
+import h5py
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+
+
+def install_standins():
+    """Make labscript, labscript_utils.h5_lock and blacs.tab_base_classes importable without the labscript suite"""
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    try:
+        import _labscript_standin
+    finally:
+        sys.path.pop(0)
+    _labscript_standin.install()
+
+    class Worker:
+        """What AD9959ArduinoCommWorker needs of blacs.tab_base_classes.Worker: nothing, outside a worker process"""
+
+    for name in ['labscript_utils', 'labscript_utils.h5_lock', 'blacs', 'blacs.tab_base_classes']:
+        sys.modules[name] = types.ModuleType(name)
+    sys.modules['labscript_utils'].h5_lock = sys.modules['labscript_utils.h5_lock']
+    sys.modules['blacs'].tab_base_classes = sys.modules['blacs.tab_base_classes']
+    sys.modules['blacs.tab_base_classes'].Worker = Worker
+
+
+install_standins()
+
+
+def load(module_name):
+    """Import a module of this device as part of its package"""
+    parent = os.path.dirname(ROOT)
+    if parent not in sys.path:
+        sys.path.insert(0, parent)
+    return importlib.import_module('{}.{}'.format(PACKAGE, module_name))
+
+
+CHANNELS = ['ch0', 'ch1', 'ch2', 'ch3']
+
+
+def make_device(name='dds', channels=CHANNELS, **kwargs):
+    """An AD9959ArduinoComm whose channels are named after themselves, each with a trigger of its own"""
+    labscript_devices = load('labscript_devices')
+    triggers = {channel: labscript_devices.AD9959ArduinoTriggerDigital('{}_{}_trigger'.format(name, channel), None,
+                                                                      'port0/line{}'.format(index))
+                for index, channel in enumerate(channels)}
+    return labscript_devices.AD9959ArduinoComm(name, 'COM1', {channel: channel for channel in channels}, triggers,
+                                               **kwargs)
+
+
+def shared_trigger_device(name='dds', **kwargs):
+    """An AD9959ArduinoComm with ch0 and ch1 on one trigger line, and ch2 and ch3 on a trigger each"""
+    labscript_devices = load('labscript_devices')
+    triggers = [labscript_devices.AD9959ArduinoTriggerDigital('{}_trigger{}'.format(name, index), None,
+                                                             'port0/line{}'.format(index)) for index in range(3)]
+    return labscript_devices.AD9959ArduinoComm(name, 'COM1', {channel: channel for channel in CHANNELS},
+                                               dict(zip(CHANNELS, [triggers[0]] + triggers)), **kwargs)
+
+
+def compile_shot(path, *devices):
+    """Write the shot file of the given devices, as labscript does when it compiles a shot"""
+    with h5py.File(path, 'a') as hdf5_file:
+        for device in devices:
+            device.generate_code(hdf5_file)
+    return path
+
+
+def worker_properties(port, **overrides):
+    """The keyword arguments the BLACS tab creates a worker with, for a device with one board on `port`"""
+    properties = {
+        'com_port': port,
+        'baud_rate': 115200,
+        'max_baud_rate': None,
+        # opening an emulator's port does not reset it, so there is no banner to wait for
+        'auto_reset': False,
+        'banner_timeout': 2.0,
+        'calibrate_link': False,
+        'channels': CHANNELS,
+        'boards': ['dds'],
+        'channel_mappings': {channel: channel for channel in CHANNELS},
+        'div_32': False,
+        'default_values': {},
+    }
+    properties.update(overrides)
+    return properties
@@ -0,0 +1,75 @@
+"""UploadCoordinator programming workers that run in this process, each on an emulated serial port"""
+
+import contextlib
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import compile_shot, load, make_device, worker_properties
+
+blacs_workers = load('blacs_workers')
+coordinator = load('coordinator')
+emulator = load('emulator')
+protocol = load('protocol')
+
+DEVICES = ['dds0', 'dds1', 'dds2']
+
+
+def test_in_process_needs_every_property():
+    properties = worker_properties('/dev/null')
+    worker = blacs_workers.AD9959ArduinoCommWorker.in_process(**properties)
+    assert worker.com_port == '/dev/null' and worker.default_values == {}
+    del properties['com_port']
+    with pytest.raises(Exception, match='com_port missing'):
+        blacs_workers.AD9959ArduinoCommWorker.in_process(**properties)
+    with pytest.raises(Exception, match='baud unknown'):
+        blacs_workers.AD9959ArduinoCommWorker.in_process(baud=9600, **worker_properties('/dev/null'))
+
+
+@pytest.fixture
+def ports():
+    with contextlib.ExitStack() as stack:
+        yield [stack.enter_context(emulator.EmulatedPort(emulator.FirmwareEmulator())) for _ in DEVICES]
+
+
+def test_every_device_programmed(ports, tmp_path):
+    devices = []
+    for index, name in enumerate(DEVICES):
+        device = make_device(name)
+        for step in range(10):
+            device.jump_frequency(1e-3 * step, 'ch1', 80e6 + 1e6 * index + 1e3 * step, trigger=step > 0)
+        devices.append(device)
+    path = compile_shot(str(tmp_path / 'shot.h5'), *devices)
+
+    upload = coordinator.UploadCoordinator()
+    for name, port in zip(DEVICES, ports):
+        upload.add(name, blacs_workers.AD9959ArduinoCommWorker.in_process(**worker_properties(port.port)))
+    assert upload.transition_to_buffered(path) == {name: {} for name in DEVICES}
+    for index, port in enumerate(ports):
+        assert port.device.channels[1].ftw_list == protocol.frequency_to_ftw(
+            80e6 + 1e6 * index + 1e3 * np.arange(10)).tolist()
+    assert set(upload.upload_times) == set(DEVICES)
+    assert upload.transition_to_manual()
+
+    assert upload.call('dds2', 'set_phase', 1, 90) is True
+    assert ports[2].device.channels[1].phase_word == protocol.phase_to_word(90)
+    upload.shutdown()
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith('upload')]
+
+
+def test_one_port_per_device(ports):
+    upload = coordinator.UploadCoordinator()
+    upload.add('dds0', blacs_workers.AD9959ArduinoCommWorker.in_process(**worker_properties(ports[0].port)))
+    with pytest.raises(Exception, match='has been added'):
+        upload.add('dds0', blacs_workers.AD9959ArduinoCommWorker.in_process(**worker_properties(ports[1].port)))
+    with pytest.raises(Exception, match='can only be opened once'):
+        upload.add('dds1', blacs_workers.AD9959ArduinoCommWorker.in_process(**worker_properties(ports[0].port)))
+    upload.shutdown()
+
+
+def test_no_devices(tmp_path):
+    upload = coordinator.UploadCoordinator()
+    assert upload.transition_to_buffered(str(tmp_path / 'shot.h5')) == {}
+    assert upload.transition_to_manual()
+    upload.shutdown()
@@ -0,0 +1,167 @@
+"""AD9959ArduinoComm compiling shots, with labscript replaced by the stand-in of the compile benchmarks"""
+
+import h5py
+import numpy as np
+import pytest
+
+from conftest import CHANNELS, compile_shot, load, make_device, shared_trigger_device
+
+protocol = load('protocol')
+
+
+def read_group(path, name='dds'):
+    with h5py.File(path, 'r') as hdf5_file:
+        return {key: dataset[()] for key, dataset in hdf5_file['devices'][name].items()}
+
+
+def test_generate_code_datasets(tmp_path):
+    device = make_device()
+    for step, frequency in enumerate([80e6, 81e6, 82e6]):
+        device.jump_frequency(1e-3 * step, 'ch0', frequency, trigger=step > 0)
+    device.jump_frequency(0, 'ch3', 90e6, trigger=False)
+    device.program_phase('ch3', 45)
+    device.program_amplitude('ch3', 0.25)
+    group = read_group(compile_shot(str(tmp_path / 'shot.h5'), device))
+
+    # the whole device in one channel table indexing into one frequency table
+    channel_table = group['channel_table']
+    assert channel_table.dtype == protocol.CHANNEL_TABLE_DTYPE
+    assert [tuple(row) for row in channel_table] == [(0, 0, 3, 0, 0.5, 0, 0), (3, 3, 1, 45, 0.25, 0, 3)]
+    ftw = protocol.frequency_to_ftw([80e6, 81e6, 82e6, 90e6])
+    assert group['frequency_table'].tolist() == ftw.tolist()
+    assert group['frequencies'] == pytest.approx(protocol.ftw_to_frequency(ftw))
+    assert group['frequencies'] == pytest.approx([80e6, 81e6, 82e6, 90e6], abs=0.1)
+    assert len(group['sweep_table']) == 0
+    assert group['channel_mappings'].tolist() == [channel.encode() for channel in CHANNELS]
+
+
+def test_nothing_programmed_writes_no_tables(tmp_path):
+    group = read_group(compile_shot(str(tmp_path / 'shot.h5'), make_device()))
+    assert group == {}
+
+
+def test_table_longer_than_max_table_length_raises(tmp_path):
+    device = make_device(max_table_length=100)
+    device.program_freq('ch0', 80e6 + 1e3 * np.arange(101))
+    with pytest.raises(Exception, match='steps through 101 frequencies on ch0, but the arduino holds at most 100'):
+        compile_shot(str(tmp_path / 'shot.h5'), device)
+    with pytest.raises(Exception, match='cannot be sent'):
+        make_device(max_table_length=protocol.MAX_TABLE_WORDS + 1)
+
+
+def test_jump_frequencies_matches_jump_frequency(tmp_path):
+    times = 1e-3 * np.arange(1, 200)
+    frequencies = 80e6 + 1e3 * np.arange(1, 200)
+    one_by_one, bulk = make_device('one_by_one'), make_device('bulk')
+    for device in (one_by_one, bulk):
+        device.jump_frequency(0, 'ch0', 80e6, trigger=False)
+    for t, frequency in zip(times, frequencies):
+        one_by_one.jump_frequency(t, 'ch0', frequency)
+    bulk.jump_frequencies(times, 'ch0', frequencies)
+
+    assert bulk.trigger_mappings['ch0'].instructions == one_by_one.trigger_mappings['ch0'].instructions
+    path = compile_shot(str(tmp_path / 'shot.h5'), one_by_one, bulk)
+    for name in ['channel_table', 'frequency_table']:
+        assert read_group(path, 'bulk')[name].tolist() == read_group(path, 'one_by_one')[name].tolist()
+
+
+def test_jump_frequencies_checks_before_storing():
+    device = make_device()
+    with pytest.raises(Exception, match='Got 2 times but 3 frequencies'):
+        device.jump_frequencies([1e-3, 2e-3], 'ch0', [80e6, 81e6, 82e6])
+    with pytest.raises(Exception, match='first trigger too close to the one before it is at t=0.0011'):
+        device.jump_frequencies([1e-3, 1.1e-3], 'ch0', [80e6, 81e6])
+    assert len(device.freq_dict['ch0']) == 0
+    assert device.trigger_mappings['ch0'].instructions == {}
+
+
+def test_shared_trigger(tmp_path):
+    device = shared_trigger_device()
+    assert device.trigger_group('ch0') == device.trigger_group('ch1') == ['ch0', 'ch1']
+    assert device.trigger_group('ch2') == ['ch2']
+    for step in range(4):
+        device.jump_frequency(1e-3 * step, 'ch0', 80e6 + 1e6 * step, trigger=step > 0)
+    device.jump_frequency(0, 'ch1', 90e6, trigger=False)
+    device.jump_frequencies(1e-3 * np.arange(1, 4), 'ch1', 90e6 + 1e6 * np.arange(1, 4))
+    # the line is raised once for both channels
+    assert sorted(device.trigger_mappings['ch0'].instructions.values()).count(1) == 3
+
+    channel_table = read_group(compile_shot(str(tmp_path / 'shot.h5'), device))['channel_table']
+    assert [(row['channel'], row['leader']) for row in channel_table] == [(0, 0), (1, 0)]
+    with pytest.raises(Exception, match='shares its trigger with other channels and cannot ramp'):
+        device.ramp(5e-3, 'ch1', 80e6, 81e6, 1e-3)
+
+
+def test_shared_trigger_step_check(tmp_path):
+    device = shared_trigger_device()
+    for step in range(4):
+        device.jump_frequency(1e-3 * step, 'ch0', 80e6 + 1e6 * step, trigger=step > 0)
+    # ch1 steps on each of the 3 edges as well, but only has a frequency for 2 of them
+    device.program_freq('ch1', [90e6, 91e6, 92e6])
+    with pytest.raises(Exception, match='ch1 of dds shares its trigger with ch0, which fires 3 times, but it steps 2 times'):
+        compile_shot(str(tmp_path / 'shot.h5'), device)
+
+
+def test_shared_trigger_across_boards_raises(tmp_path):
+    labscript_devices = load('labscript_devices')
+    trigger = labscript_devices.AD9959ArduinoTriggerDigital('dds_trigger', None, 'port0/line0')
+    device = labscript_devices.AD9959ArduinoComm('dds', 'COM1', {'a': 'ch0', 'b': 'b1.ch0'},
+                                                 {'a': trigger, 'b': trigger}, boards=['first', 'second'])
+    with pytest.raises(Exception, match='share a trigger but are on different boards'):
+        compile_shot(str(tmp_path / 'shot.h5'), device)
+
+
+def test_max_table_length_shared_by_the_boards():
+    assert make_device().max_table_length == protocol.DEFAULT_TABLE_CAPACITY
+    device = make_device(channels=['ch0', 'b1.ch0', 'b2.ch0'], boards=['a', 'b', 'c'])
+    assert device.max_table_length == protocol.DEFAULT_TABLE_CAPACITY // 3
+    assert len(device.channels) == 3 * protocol.CHANNELS_PER_BOARD
+    with pytest.raises(Exception, match='drives at most'):
+        make_device(boards=['board{}'.format(index) for index in range(protocol.MAX_BOARDS + 1)])
+
+
+def test_jump_profile(tmp_path):
+    labscript_devices = load('labscript_devices')
+    pin = labscript_devices.DigitalOut('dds_ch2_profile', None, 'port1/line0')
+    device = make_device(profile_mappings={'ch2': pin})
+    for t, frequency in [(0, 80e6), (1e-3, 85e6), (2e-3, 80e6), (3e-3, 85e6)]:
+        device.jump_frequency(t, 'ch2', frequency)
+    # the first frequency while the pin is low, the second while it is high, without triggering the arduino
+    assert pin.instructions == {0: 0, 1e-3: 1, 2e-3: 0, 3e-3: 1}
+    assert device.trigger_mappings['ch2'].instructions == {}
+    with pytest.raises(Exception, match='can only switch between two frequencies'):
+        device.jump_frequency(4e-3, 'ch2', 90e6)
+
+    group = read_group(compile_shot(str(tmp_path / 'shot.h5'), device))
+    row = group['channel_table'][0]
+    assert (row['channel'], row['length'], row['profile']) == (2, 2, 1)
+    assert group['frequency_table'].tolist() == protocol.frequency_to_ftw([80e6, 85e6]).tolist()
+
+
+def test_profile_channel_that_never_jumps(tmp_path):
+    labscript_devices = load('labscript_devices')
+    pin = labscript_devices.DigitalOut('dds_ch2_profile', None, 'port1/line0')
+    device = make_device(profile_mappings={'ch2': pin})
+    device.jump_profile(0, 'ch2', 80e6)
+    group = read_group(compile_shot(str(tmp_path / 'shot.h5'), device))
+    # the same frequency at both levels of the pin
+    assert group['frequency_table'].tolist() == protocol.frequency_to_ftw([80e6, 80e6]).tolist()
+
+
+def test_ramp_returns_the_quantized_duration(tmp_path):
+    device = make_device()
+    duration = device.ramp(1e-3, 'ch2', 70e6, 80e6, 1.234567e-3)
+    start, stop = protocol.frequency_to_ftw([70e6, 80e6])
+    assert duration == protocol.sweep_parameters(start, stop, 1.234567e-3)[2]
+    assert duration != 1.234567e-3 and duration == pytest.approx(1.234567e-3, rel=0.05)
+
+    sweep_table = read_group(compile_shot(str(tmp_path / 'shot.h5'), device))['sweep_table']
+    assert len(sweep_table) == 1
+    assert (sweep_table[0]['channel'], sweep_table[0]['start'], sweep_table[0]['stop']) == (2, start, stop)
+    assert sweep_table[0]['duration'] == duration
+
+
+def test_ramp_slower_than_the_dds_raises():
+    device = make_device()
+    with pytest.raises(Exception, match='can take at most'):
+        device.ramp(0, 'ch0', 80e6, 80.001e6, 10.0)
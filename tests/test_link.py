@@ -0,0 +1,195 @@
+"""ArduinoLink against the firmware emulator, with bytes garbled or lost on the line"""
+
+import time
+
+import pytest
+
+from conftest import load, worker_properties
+
+blacs_workers = load('blacs_workers')
+emulator = load('emulator')
+link = load('link')
+protocol = load('protocol')
+
+
+class LossyEmulator(emulator.FirmwareEmulator):
+    """The emulator behind a line that loses the writes, or the replies to the writes, numbered in `lost_writes`
+    and `lost_replies` (counting from 1)"""
+
+    def __init__(self, lost_writes=(), lost_replies=(), **kwargs):
+        super().__init__(timeout=0.01, **kwargs)
+        self.lost_writes = set(lost_writes)
+        self.lost_replies = set(lost_replies)
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes in self.lost_writes:
+            return len(data)
+        replies = len(self._replies)
+        written = super().write(data)
+        if self.writes in self.lost_replies:
+            while len(self._replies) > replies:
+                self._replies.pop()
+        return written
+
+
+def ftw_command(channel, frequency):
+    return protocol.encode_ftw(channel, protocol.frequency_to_ftw([frequency]))
+
+
+def send_frequencies(arduino, frequencies):
+    for channel, frequency in enumerate(frequencies):
+        arduino.send(ftw_command(channel, frequency))
+    arduino.wait_all()
+
+
+def output(device, frequencies):
+    return [device.channels[channel].ftw_list for channel in range(len(frequencies))]
+
+
+def expected(frequencies):
+    return [[int(protocol.frequency_to_ftw([frequency])[0])] for frequency in frequencies]
+
+
+FREQUENCIES = [80e6, 81e6, 82e6, 83e6]
+
+
+def test_every_frame_acknowledged():
+    device = LossyEmulator()
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    send_frequencies(arduino, FREQUENCIES)
+    assert output(device, FREQUENCIES) == expected(FREQUENCIES)
+    assert arduino.frames_resent == 0
+    assert not arduino.outstanding and arduino.outstanding_bytes == 0
+
+
+@pytest.mark.parametrize('lost', [1, 2, 4])
+def test_lost_frame_is_resent(lost):
+    device = LossyEmulator(lost_writes=[lost])
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    send_frequencies(arduino, FREQUENCIES)
+    assert output(device, FREQUENCIES) == expected(FREQUENCIES)
+    # go back N: the lost frame and every frame after it
+    assert arduino.frames_resent == len(FREQUENCIES) - lost + 1
+
+
+@pytest.mark.parametrize('lost', [1, 3, 4])
+def test_dropped_acknowledgement(lost):
+    device = LossyEmulator(lost_replies=[lost])
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    send_frequencies(arduino, FREQUENCIES)
+    assert output(device, FREQUENCIES) == expected(FREQUENCIES)
+    assert arduino.frames_resent >= 1
+    assert not arduino.outstanding and arduino.outstanding_bytes == 0
+    # later frames are acknowledged as usual
+    arduino.ping()
+
+
+def test_timeout_raises_after_retries():
+    device = LossyEmulator(lost_writes=range(1, 100))
+    arduino = link.ArduinoLink(device, timeout=0.02, retries=2)
+    arduino.send(protocol.encode_ping())
+    start = time.perf_counter()
+    with pytest.raises(Exception, match='did not acknowledge frame 0 within 0.02 s, 3 times'):
+        arduino.wait_all()
+    assert time.perf_counter() - start < 1.0
+    assert arduino.frames_resent == 2
+    assert not arduino.outstanding and arduino.outstanding_bytes == 0
+
+
+def test_oversized_frame_is_rejected():
+    # more bytes than MAX_PAYLOAD: the firmware answers with NAK, without waiting for the timeout
+    entries = [(0, protocol.UPDATE_PHASE, 0, 0, 0)] * 255
+    oversized = protocol.encode_header(0, 'update', len(entries)) + b''.join(
+        protocol.UPDATE_ENTRY.pack(*entry) for entry in entries)
+    assert len(oversized) - protocol.HEADER.size > protocol.MAX_PAYLOAD
+    device = LossyEmulator()
+    arduino = link.ArduinoLink(device, timeout=10.0, rx_capacity=4096, retries=1)
+    arduino.send(oversized)
+    start = time.perf_counter()
+    with pytest.raises(Exception, match='did not acknowledge'):
+        arduino.wait_all()
+    assert time.perf_counter() - start < 1.0
+    assert device.frames_received == 0
+    # the parser skipped the payload, so the next frame is read as usual
+    arduino.ping()
+
+
+def test_bytes_in_flight_bounded_by_rx_capacity():
+    device = LossyEmulator()
+    arduino = link.ArduinoLink(device, window=8, timeout=0.05, rx_capacity=100)
+    most = 0
+    for channel in range(4):
+        arduino.send(protocol.encode_ftw(channel, list(range(10))))
+        most = max(most, arduino.outstanding_bytes)
+    assert most <= arduino.rx_capacity
+    # a frame longer than rx_capacity still goes out, alone
+    arduino.send(protocol.encode_ftw(0, list(range(40))))
+    assert len(arduino.outstanding) == 1
+    arduino.wait_all()
+    assert device.channels[0].ftw_list == list(range(40))
+
+
+def test_window_bounds_frames_in_flight():
+    device = LossyEmulator()
+    arduino = link.ArduinoLink(device, window=3, timeout=0.05)
+    for _ in range(10):
+        arduino.send(protocol.encode_ping())
+        assert len(arduino.outstanding) <= 3
+    arduino.wait_all()
+    assert device.frames_received == 10
+
+
+def test_manual_commands_wait_for_the_arduino():
+    device = LossyEmulator()
+    with emulator.EmulatedPort(device) as port:
+        worker = blacs_workers.AD9959ArduinoCommWorker.in_process(**worker_properties(port.port))
+        worker.init()
+        worker.link.timeout = 0.05
+        # each call returns once the arduino has applied it
+        assert worker.set_frequency(1, [90e6])
+        assert device.channels[1].ftw_list == protocol.frequency_to_ftw([90e6]).tolist()
+        assert worker.set_phase(1, 90)
+        assert device.channels[1].phase_word == protocol.phase_to_word(90)
+        assert worker.set_amplitude(1, 0.25)
+        assert device.channels[1].amplitude_word == protocol.amplitude_to_word(0.25)
+        worker.rewind(1)
+        # a command the arduino never gets fails in the call that sent it
+        device.lost_writes = set(range(device.writes + 1, device.writes + 100))
+        with pytest.raises(Exception, match='did not acknowledge'):
+            worker.set_phase(1, 45)
+        worker.shutdown()
+
+
+def test_wait_banner():
+    device = LossyEmulator()
+    device.reset(boot_time=0.05)
+    device._replies.appendleft((0.0, b'bootloader'))
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    assert 0.05 <= arduino.wait_banner() < 1.0
+    # no reset, no banner: give up after the timeout, dropping what came meanwhile
+    device._replies.append((0.0, b'\x00'))
+    assert arduino.wait_banner(timeout=0.05) is None
+    assert not arduino._received
+    assert arduino.wait_ready() < 1.0
+
+
+class GarblingEmulator(emulator.FirmwareEmulator):
+    """An emulator that reads a SYNC byte into whatever arrives at a rate it does not understand"""
+
+    def write(self, data):
+        if self.baudrate != self.device_baud_rate or self.device_baud_rate > self.max_baud_rate:
+            self._pending += bytes((protocol.SYNC,))
+        return super().write(data)
+
+
+def test_negotiate_baud_after_garbage():
+    # 2000000 baud is unreliable: the arduino reads garbage at that rate, then falls back and the next rate works
+    device = GarblingEmulator(timeout=0.01, max_baud_rate=1000000)
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    arduino.wait_banner()
+    assert arduino.negotiate_baud(2000000) == 1000000
+    assert device.device_baud_rate == 1000000
+    send_frequencies(arduino, FREQUENCIES)
+    assert arduino.frames_resent == 0
@@ -0,0 +1,140 @@
+"""Encoders of protocol.py against the firmware emulator, and the limits they enforce"""
+
+import struct
+
+import numpy as np
+import pytest
+
+from conftest import load
+
+emulator = load('emulator')
+link = load('link')
+protocol = load('protocol')
+
+
+def program(table, channel=0):
+    """Send a table as encode_ftw_runs encodes it, and return the emulator that applied it"""
+    device = emulator.FirmwareEmulator()
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    for command in protocol.encode_ftw_runs(channel, table):
+        arduino.send(command)
+    arduino.wait_all()
+    return device, arduino
+
+
+def scan_in_hz(start, stop, points, repeat=1):
+    return np.repeat(protocol.frequency_to_ftw(np.linspace(start, stop, points)), repeat)
+
+
+TABLES = {
+    'single word': [protocol.frequency_to_ftw([80e6])[0]],
+    'held': [123456789] * 600,
+    'stepped scan with repeats': np.repeat(np.arange(1000, 1000 + 7 * 300, 7), 3),
+    'scan in Hz': scan_in_hz(70e6, 90e6, 1000),
+    'scan in Hz with repeats': scan_in_hz(90e6, 70e6, 400, repeat=4),
+    'random': np.random.default_rng(0).integers(0, 2**32, 700, dtype=np.uint64),
+    'mixed': np.concatenate([[5] * 300, np.random.default_rng(1).integers(0, 2**32, 50, dtype=np.uint64),
+                             np.arange(0, 2**31, 2**20)]),
+    'wrapping step': (2**32 - 1000 + 300 * np.arange(20, dtype=np.uint64)) % 2**32,
+}
+
+
+@pytest.mark.parametrize('name', sorted(TABLES))
+def test_ftw_runs_round_trip(name):
+    table = [int(word) for word in TABLES[name]]
+    device, _ = program(table)
+    assert device.channels[0].ftw_list == table
+
+
+@pytest.mark.parametrize('name', sorted(TABLES))
+def test_ftw_table_round_trip(name):
+    table = [int(word) for word in TABLES[name]]
+    device = emulator.FirmwareEmulator()
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    for command in protocol.encode_ftw_table(2, table):
+        arduino.send(command)
+    arduino.wait_all()
+    assert device.channels[2].ftw_list == table
+
+
+def test_ftw_runs_is_compact():
+    table = scan_in_hz(70e6, 90e6, 1000)
+    assert sum(map(len, protocol.encode_ftw_runs(0, table))) < 4 * len(table) / 10
+
+
+def test_table_longer_than_offsets_raises():
+    table = np.zeros(protocol.MAX_TABLE_WORDS + 1, dtype=np.uint32)
+    with pytest.raises(Exception, match='longer than'):
+        protocol.encode_ftw_runs(0, table)
+    with pytest.raises(Exception, match='longer than'):
+        protocol.encode_ftw_chunks(0, table)
+    protocol.check_table_length(protocol.MAX_TABLE_WORDS)
+
+
+def test_decode_capacity():
+    # older firmware reports the table capacity alone, or without the size of its receive buffer
+    assert protocol.decode_capacity(struct.pack('>I', 100)) == (100, 1, protocol.DEFAULT_RX_CAPACITY)
+    assert protocol.decode_capacity(struct.pack('>IB', 2048, 2)) == (2048, 2, protocol.DEFAULT_RX_CAPACITY)
+    assert protocol.decode_capacity(struct.pack('>IBH', 4096, 3, 384)) == (4096, 3, 384)
+
+
+def test_capacity_query():
+    device = emulator.FirmwareEmulator(table_capacity=1024, boards=2, rx_capacity=64 + 256)
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    reply = arduino.query(protocol.encode_capacity_query())
+    assert protocol.decode_capacity(reply) == (1024, 2, 64 + 256)
+
+
+def test_digests():
+    table = [int(word) for word in TABLES['scan in Hz']]
+    device, arduino = program(table, channel=1)
+    arduino.send(protocol.encode_profiles(2, [10, 20]))
+    arduino.send(protocol.encode_phase(3, 1000))
+    digests = protocol.decode_digests(arduino.query(protocol.encode_digest_query()))
+
+    assert len(digests) == protocol.CHANNELS_PER_BOARD
+    assert digests[1]['mode'] == protocol.MODE_TABLE
+    assert digests[1]['crc'] == protocol.table_crc(table)
+    assert digests[1]['length'] == len(table)
+    assert digests[1]['phase_word'] == protocol.WORD_UNSET
+    assert digests[2]['mode'] == protocol.MODE_PROFILE
+    assert (digests[2]['crc'], digests[2]['length']) == (protocol.table_crc([10, 20]), 2)
+    assert digests[3]['phase_word'] == 1000
+    assert digests[3]['amplitude_word'] == protocol.WORD_UNSET
+    # a channel that was never programmed holds the single word 0
+    assert (digests[0]['crc'], digests[0]['length']) == (protocol.table_crc([0]), 1)
+
+
+@pytest.mark.parametrize('duration', [1e-6, 1e-3, 0.1])
+def test_sweep_parameters(duration):
+    start, stop = protocol.frequency_to_ftw([70e6, 80e6])
+    delta, rate, quantized = protocol.sweep_parameters(start, stop, duration)
+    assert 1 <= rate <= protocol.MAX_RAMP_RATE
+    assert delta >= 1
+    # the quantized sweep is what the registers make, close to the requested one
+    assert quantized == -(-abs(int(stop) - int(start)) // delta) * rate / protocol.SYNC_CLOCK
+    assert quantized == pytest.approx(duration, rel=0.05)
+
+
+def test_sweep_parameters_limits():
+    # no span, or no time: a single step
+    assert protocol.sweep_parameters(100, 100, 1.0) == (1, 1, 0.0)
+    assert protocol.sweep_parameters(100, 200, 0) == (100, 1, 0.0)
+    # the slowest sweep the DDS can make, and one slower than that
+    span = 1000
+    slowest = span * protocol.MAX_RAMP_RATE / protocol.SYNC_CLOCK
+    assert protocol.sweep_parameters(0, span, 0.999 * slowest) == (1, protocol.MAX_RAMP_RATE, pytest.approx(slowest))
+    with pytest.raises(Exception, match='can take at most'):
+        protocol.sweep_parameters(0, span, 1.01 * slowest)
+    # sweeping down takes the same registers as sweeping up
+    assert protocol.sweep_parameters(span, 0, 1e-5) == protocol.sweep_parameters(0, span, 1e-5)
+
+
+def test_digest_of_other_board():
+    device = emulator.FirmwareEmulator(boards=2)
+    arduino = link.ArduinoLink(device, timeout=0.05)
+    for command in protocol.encode_ftw_runs(protocol.channel_index('b1.ch2'), [1, 2, 3]):
+        arduino.send(command)
+    digests = protocol.decode_digests(arduino.query(protocol.encode_digest_query(board=1)))
+    assert digests[2]['crc'] == protocol.table_crc([1, 2, 3])
+    assert digests[0]['length'] == 1
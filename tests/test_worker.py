@@ -0,0 +1,178 @@
+"""AD9959ArduinoCommWorker programming the firmware emulator through an emulated serial port"""
+
+import numpy as np
+import pytest
+
+from conftest import CHANNELS, compile_shot, load, make_device, shared_trigger_device, worker_properties
+
+blacs_workers = load('blacs_workers')
+emulator = load('emulator')
+protocol = load('protocol')
+
+SCAN = 80e6 + 1e3 * np.arange(10)
+
+
+@pytest.fixture
+def port():
+    with emulator.EmulatedPort(emulator.FirmwareEmulator()) as port:
+        yield port
+
+
+def scan_shot(path, frequencies=SCAN):
+    device = make_device()
+    for step, frequency in enumerate(frequencies):
+        device.jump_frequency(1e-3 * step, 'ch1', frequency, trigger=step > 0)
+    return compile_shot(path, device)
+
+
+def start_worker(port, **overrides):
+    worker = blacs_workers.AD9959ArduinoCommWorker.in_process(**worker_properties(port.port, **overrides))
+    worker.init()
+    return worker
+
+
+def run_shot(worker, path, fresh):
+    worker.transition_to_buffered('dds', path, {}, fresh)
+    telemetry = worker.telemetry
+    worker.transition_to_manual()
+    return telemetry
+
+
+def test_restart_applies_the_defaults(port, tmp_path):
+    path = scan_shot(str(tmp_path / 'shot.h5'))
+    worker = start_worker(port, default_values={'ch1': 70e6})
+    run_shot(worker, path, fresh=True)
+    assert port.device.channels[1].ftw_list == protocol.frequency_to_ftw(SCAN).tolist()
+    worker.shutdown()
+
+    # the arduino kept the shot's table, but a restarted worker puts the default back
+    worker = start_worker(port, default_values={'ch1': 70e6})
+    default = protocol.frequency_to_ftw([70e6]).tolist()
+    assert port.device.channels[1].ftw_list == default
+    assert worker.programmed_digests[(1, 'freq')] == (protocol.MODE_TABLE, protocol.table_crc(default), 1)
+    # so the same shot again sends its table again
+    telemetry = run_shot(worker, path, fresh=False)
+    assert telemetry['channels_programmed'] == 1
+    assert port.device.channels[1].ftw_list == protocol.frequency_to_ftw(SCAN).tolist()
+    worker.shutdown()
+
+
+def test_defaults_already_output_are_not_sent(port):
+    worker = start_worker(port, default_values={'ch0': 70e6, 'ch2': 75e6})
+    first = worker.link.bytes_sent
+    worker.shutdown()
+    worker = start_worker(port, default_values={'ch0': 70e6, 'ch2': 75e6})
+    # a restart only reads the capacity and the digests
+    assert worker.link.bytes_sent < first
+    worker.shutdown()
+    worker = start_worker(port, default_values={'ch0': 70e6, 'ch2': 76e6})
+    assert port.device.channels[2].ftw_list == protocol.frequency_to_ftw([76e6]).tolist()
+    assert port.device.channels[0].ftw_list == protocol.frequency_to_ftw([70e6]).tolist()
+    worker.shutdown()
+
+
+def test_telemetry(port, tmp_path):
+    worker = blacs_workers.AD9959ArduinoCommWorker.in_process(**worker_properties(str(tmp_path / 'no port')))
+    assert worker.get_telemetry() is None
+    # a worker whose init failed has no telemetry either, rather than failing to report it
+    with pytest.raises(Exception):
+        worker.init()
+    assert worker.get_telemetry() is None
+
+    worker = start_worker(port)
+    assert worker.get_telemetry() == {'startup': worker.startup_time, 'shots': 0}
+    run_shot(worker, scan_shot(str(tmp_path / 'shot.h5')), fresh=True)
+    statistics = worker.get_telemetry()
+    assert statistics['shots'] == 1
+    assert statistics['channels_programmed']['last'] == 1
+    worker.shutdown()
+
+
+def test_smart_programming(port, tmp_path):
+    path = scan_shot(str(tmp_path / 'shot.h5'))
+    changed = scan_shot(str(tmp_path / 'changed.h5'), SCAN + 10e3)
+    worker = start_worker(port)
+    first = run_shot(worker, path, fresh=True)
+    assert (first['channels_programmed'], first['channels_skipped']) == (1, 0)
+
+    # the arduino already holds the table: only the rewind goes out
+    again = run_shot(worker, path, fresh=False)
+    assert (again['channels_programmed'], again['channels_skipped']) == (0, 1)
+    assert again['bytes_sent'] < first['bytes_sent'] / 4
+    assert port.device.channels[1].ftw_list == protocol.frequency_to_ftw(SCAN).tolist()
+
+    telemetry = run_shot(worker, changed, fresh=False)
+    assert telemetry['channels_programmed'] == 1
+    assert port.device.channels[1].ftw_list == protocol.frequency_to_ftw(SCAN + 10e3).tolist()
+
+    # a fresh program sends everything again, and checks that the arduino holds it
+    assert run_shot(worker, path, fresh=True)['bytes_sent'] == first['bytes_sent']
+    port.device.channels[1].ftw_list = [0]
+    with pytest.raises(Exception, match='does not hold what was uploaded: ch1 freq'):
+        worker.verify_device_state()
+    # after which the table is sent again
+    assert run_shot(worker, path, fresh=False)['channels_programmed'] == 1
+    assert port.device.channels[1].ftw_list == protocol.frequency_to_ftw(SCAN).tolist()
+    worker.shutdown()
+
+
+def test_long_tables(tmp_path):
+    frequencies = 70e6 + 1e3 * np.random.default_rng(0).permutation(1000)
+    path = scan_shot(str(tmp_path / 'shot.h5'), frequencies)
+    # sent in chunks of at most 255 tuning words
+    with emulator.EmulatedPort(emulator.FirmwareEmulator()) as port:
+        worker = start_worker(port)
+        run_shot(worker, path, fresh=True)
+        assert port.device.channels[1].ftw_list == protocol.frequency_to_ftw(frequencies).tolist()
+        worker.shutdown()
+    # more than the arduino it is sent to holds
+    with emulator.EmulatedPort(emulator.FirmwareEmulator(table_capacity=100)) as port:
+        worker = start_worker(port)
+        with pytest.raises(Exception, match='ch1 has 1000 frequencies, but the arduino can only hold 100'):
+            worker.transition_to_buffered('dds', path, {}, True)
+        worker.shutdown()
+
+
+def test_shared_trigger(port, tmp_path):
+    device = shared_trigger_device()
+    for channel, frequency in [('ch0', 80e6), ('ch1', 90e6)]:
+        device.jump_frequency(0, channel, frequency, trigger=False)
+        device.jump_frequencies(1e-3 * np.arange(1, 3), channel, frequency + 1e6 * np.arange(1, 3))
+    worker = start_worker(port)
+    run_shot(worker, compile_shot(str(tmp_path / 'shot.h5'), device), fresh=True)
+    # the arduino steps ch1 on the edges at ch0's step pin
+    state = worker.read_device_state()
+    assert state[(0, 'group')] == protocol.group_mask(0, [0, 1])
+    assert state[(1, 'group')] == 0
+    worker.shutdown()
+
+
+def test_second_board(tmp_path):
+    device = make_device(channels=['ch0', 'b1.ch2'], boards=['a', 'b'])
+    device.jump_frequencies(1e-3 * np.arange(1, 4), 'b1.ch2', SCAN[:3], trigger=False)
+    path = compile_shot(str(tmp_path / 'shot.h5'), device)
+    with emulator.EmulatedPort(emulator.FirmwareEmulator(boards=2)) as port:
+        worker = start_worker(port, channels=['ch0', 'b1.ch2'], boards=['a', 'b'],
+                              channel_mappings={'ch0': 'ch0', 'b1.ch2': 'b1.ch2'})
+        run_shot(worker, path, fresh=True)
+        assert port.device.channels[6].ftw_list == protocol.frequency_to_ftw(SCAN[:3]).tolist()
+        worker.shutdown()
+    # firmware built for fewer boards than the connection table has
+    with emulator.EmulatedPort(emulator.FirmwareEmulator()) as port:
+        with pytest.raises(Exception, match='has 2 AD9959 boards, but the arduino firmware was built for 1'):
+            start_worker(port, boards=['a', 'b'])
+
+
+def test_startup(port):
+    # the port of a fresh emulator resets it, so the worker starts on its banner
+    worker = start_worker(port, auto_reset=True, default_values={channel: 70e6 + 1e6 * index
+                                                                 for index, channel in enumerate(CHANNELS)})
+    # the capacity and digest queries, then the four defaults in one command
+    assert port.device.frames_received == 3
+    assert [channel.ftw_list for channel in port.device.channels] == [
+        [int(word)] for word in protocol.frequency_to_ftw(70e6 + 1e6 * np.arange(4))]
+    worker.shutdown()
+    # no reset this time: no banner comes, and after banner_timeout the worker pings the running arduino
+    worker = start_worker(port, auto_reset=True, banner_timeout=0.05)
+    assert 0.05 <= worker.startup_time < 1.0
+    worker.shutdown()